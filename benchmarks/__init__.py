@@ -0,0 +1 @@
+"""Benchmarks of the github repo loc analyser and the local stand-ins they run against."""
@@ -0,0 +1,263 @@
+"""
+Module for benchmarks of the whole pipeline and of performance critical parts.
+
+Run from the root of the repository with: python -m benchmarks.benchmark <name> [size ...] [option=value ...]
+The options are set in the main section of the config of the benchmarks, which run the analysis.
+"""
+import os
+import resource
+import sys
+import tempfile
+from datetime import date
+from json import dumps, loads
+from math import ceil
+from random import Random
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from github_repo_loc_analyser import setup
+from github_repo_loc_analyser.code_analyser import CodeAnalyzer
+from github_repo_loc_analyser.data_structure import AnalysisRepo, Result
+from github_repo_loc_analyser.github_api_querier import ApiQuerier, REQUESTED_PAGE_SIZE
+from github_repo_loc_analyser.helper import SerializableJsonDecoder, SerializableJsonEncoder, msgpack, msgpack_dumps
+from github_repo_loc_analyser.helper import msgpack_loads, sanitize_filename
+from github_repo_loc_analyser.metrics import TaskMetrics
+from github_repo_loc_analyser.sampling import RepoSampler
+from github_repo_loc_analyser.scheduling import parse_size_classes
+
+from .fixtures import FIRST_CREATED, MIN_STARS, FakeGitHub, FixtureRepo, create_fixture_repo, create_fixture_repos
+
+PAGE_SIZE = 100
+LANGUAGES = ["Python", "Java", "Go"]
+PERCENTILES = [50, 90, 99]
+UNLIMITED = 10 ** 9
+
+
+def _configure(directory: str, languages: List[str], main: Dict[str, Any], celery: Optional[Dict[str, Any]] = None):
+    """Write the config for a benchmark into the directory and set it up."""
+    sections = {
+        "main": dict({
+            "data_dir": os.path.join(directory, "data"),
+            "tmp_dir": os.path.join(directory, "tmp"),
+            "num_repos_per_page": 10,
+            "num_repo_pages": 1,
+            "old_repo_date": "2012-06-01",
+            "new_repo_date": "2020-06-01",
+            "minimum_code_lines": 0,
+            "max_tasks_in_queue": 4,
+            "sampling_seed": 0,
+        }, **main),
+        "repo_filters": {
+            "languages": ",".join(languages),
+            "size": "10..100000",
+            "stars": ">20",
+            "old_repo_created": "<2012-01-01",
+            "old_repo_updated": ">2012-01-01",
+            "new_repo_created": "<2020-01-01",
+            "new_repo_updated": ">2020-01-01",
+        },
+        "celery": celery or {},
+    }
+    config_file = os.path.join(directory, "grla.conf")
+    with open(config_file, "w") as f:
+        for section, options in sections.items():
+            f.write("[{}]\n".format(section))
+            f.writelines("{} = {}\n".format(key, value) for key, value in options.items())
+    os.environ["GRLA_CONFIG"] = config_file
+    setup()
+
+
+def _percentiles(values: List[float]) -> List[float]:
+    """Return the PERCENTILES and the maximum of the values (nearest rank)."""
+    ordered = sorted(values)
+    return [ordered[max(0, ceil(p / 100 * len(ordered)) - 1)] for p in PERCENTILES] + [ordered[-1]]
+
+
+def _print_stage_latencies(metrics: Iterable[Dict[str, Any]]):
+    """Print the percentiles of the durations of the stages in the metrics of the results."""
+    stages: Dict[str, List[float]] = {}
+    for result_metrics in metrics:
+        for stage, seconds in result_metrics["timings"].items():
+            stages.setdefault(stage, []).append(seconds)
+    print("{:<12}".format("stage") + "".join("{:>10}".format("p{}".format(p)) for p in PERCENTILES) +
+          "{:>10}".format("max"))
+    for stage, values in sorted(stages.items()):
+        print("{:<12}".format(stage) + "".join("{:>9.3f}s".format(value) for value in _percentiles(values)))
+
+
+def _print_peak_memory():
+    """Print the peak resident memory of this process and of the largest child process (like git)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print("Peak memory: {:.1f} MB in this process, {:.1f} MB in the largest child process.".format(
+        own / 1024, children / 1024))
+
+
+def benchmark_sampling(num_candidates: int = 1000000, picks_per_page: int = 10, used_fraction: float = 0.1):
+    """
+    Sample from num_candidates fake search results in pages of PAGE_SIZE.
+
+    A fraction of the candidates is already used, like after a restart. Every candidate is also listed twice, like
+    repos showing up in the searches for old and new repos.
+    """
+    language = "Python"
+    rng = Random(0)
+    names = ["owner{}/repo{}".format(i // 7, i) for i in range(num_candidates)]
+    used = [sanitize_filename(name, language) for name in rng.sample(names, int(num_candidates * used_fraction))]
+    pages = [[{"full_name": name} for name in names[start:start + PAGE_SIZE]]
+             for start in range(0, num_candidates, PAGE_SIZE)]
+
+    start_time = perf_counter()
+    sampler = RepoSampler(used)
+    picked = 0
+    for _ in range(2):
+        for page_number, items in enumerate(pages):
+            picked += len(sampler.sample(items, language, picks_per_page, Random(page_number)))
+    duration = perf_counter() - start_time
+
+    print("Sampled {} of {} candidates ({} already used) in {:.3f}s ({:.0f} pages/s).".format(
+        picked, num_candidates, len(used), duration, 2 * len(pages) / duration))
+
+
+def benchmark_serializer(num_results: int = 10000):
+    """Serialize and deserialize num_results results one by one, like celery does for the messages of the tasks."""
+    results = []
+    for i in range(num_results):
+        repo = AnalysisRepo("owner{}/repo{}".format(i // 7, i), "Python", i % 2 == 0,
+                            "https://github.com/owner{}/repo{}.git".format(i // 7, i), "{:040x}".format(i), i * 10)
+        analysis = {"nFiles": i % 100, "blank": i * 3, "comment": i * 2, "code": i * 10}
+        results.append(Result(repo, analysis=analysis, blob_cache_stats={"hits": i, "misses": i},
+                              metrics=TaskMetrics().to_dict()))
+    serializers: Dict[str, Tuple[Callable[[Any], Any], Callable[[Any], Any]]] = {
+        "grla_json": (lambda o: dumps(o, cls=SerializableJsonEncoder), lambda o: loads(o, cls=SerializableJsonDecoder)),
+    }
+    if msgpack is not None:
+        serializers["grla_msgpack"] = (msgpack_dumps, msgpack_loads)
+
+    for name, (serialize, deserialize) in serializers.items():
+        start_time = perf_counter()
+        messages = [serialize(result) for result in results]
+        dumps_duration = perf_counter() - start_time
+        start_time = perf_counter()
+        for message in messages:
+            deserialize(message)
+        loads_duration = perf_counter() - start_time
+        print("{:<13} dumps {:.3f}s ({:.0f}/s), loads {:.3f}s ({:.0f}/s), {:.0f} bytes per result.".format(
+            name, dumps_duration, num_results / dumps_duration, loads_duration, num_results / loads_duration,
+            sum(len(message) for message in messages) / num_results))
+
+
+def benchmark_get_repos(num_fixture_repos: int = 5000, **options: str):
+    """
+    Page through the search results of num_fixture_repos repos per language, which are served by the fake GitHub API.
+
+    With adaptive_partitioning, the search is partitioned and num_repos repos are sampled from all results instead.
+    """
+    first_created = FIRST_CREATED.toordinal()
+    repos = [FixtureRepo("owner{}/{}{}".format(i // 7, language.lower(), i), language, "/nonexistent", "0" * 40,
+                         i % 100000, date.fromordinal(first_created + i % 1500), MIN_STARS + i % 1000)
+             for language in LANGUAGES for i in range(num_fixture_repos)]
+    github = FakeGitHub(repos, search_rate_limit=UNLIMITED, core_rate_limit=UNLIMITED)
+    with tempfile.TemporaryDirectory() as directory:
+        _configure(directory, LANGUAGES, dict({
+            "api_server": github.get_url(),
+            "num_repo_pages": ceil(num_fixture_repos / REQUESTED_PAGE_SIZE),
+        }, **options))
+        api = ApiQuerier()
+        sampler = RepoSampler()
+        start_time = perf_counter()
+        pages = picked = 0
+        for language in LANGUAGES:
+            get_pages = api._get_sampled_repos if api.adaptive_partitioning else api._get_repos
+            for _, page in get_pages(language, False, sampler, frozenset()):
+                pages += 1
+                picked += len(page)
+        duration = perf_counter() - start_time
+    github.close()
+    print("Got {} pages and picked {} repos in {:.3f}s ({:.0f} pages/s).".format(
+        pages, picked, duration, pages / duration))
+
+
+def benchmark_process_repo(repetitions: int = 20, num_files: int = 500, lines_per_file: int = 100, **options: str):
+    """Fetch and count a fixture repo repetitions times with CodeAnalyzer.process_repo."""
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = create_fixture_repo(directory, "owner/repo", "Python", num_files, lines_per_file, Random(0))
+        _configure(directory, ["Python"], options)
+        repo = AnalysisRepo(fixture.name, fixture.language, False, fixture.get_remote_url(), fixture.commit,
+                            fixture.size)
+        durations = []
+        metrics = []
+        for _ in range(repetitions):
+            start_time = perf_counter()
+            result = CodeAnalyzer(repo).process_repo()
+            durations.append(perf_counter() - start_time)
+            metrics.append(result.get_metrics())
+    print("Processed a repo with {} files ({} KB) {} times: p50 {:.3f}s, p90 {:.3f}s, p99 {:.3f}s, max {:.3f}s".format(
+        num_files, fixture.size, repetitions, *_percentiles(durations)))
+    _print_stage_latencies(metrics)
+    _print_peak_memory()
+
+
+def benchmark_end_to_end(num_fixture_repos: int = 50, threads: int = 4, num_files: int = 200, lines_per_file: int = 100,
+                         **options: str):
+    """
+    Run the master and one worker with threads threads against the fake GitHub API and num_fixture_repos repos.
+
+    The master and the worker run in this process and communicate over an in-memory broker. With size_classes, the
+    worker consumes the queues of all size classes.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        repos = create_fixture_repos(os.path.join(directory, "repos"), num_fixture_repos, LANGUAGES, num_files,
+                                     lines_per_file)
+        github = FakeGitHub(repos)
+        repos_per_language = ceil(num_fixture_repos / len(LANGUAGES))
+        _configure(directory, LANGUAGES, dict({
+            "api_server": github.get_url(),
+            "num_repos_per_page": min(repos_per_language, REQUESTED_PAGE_SIZE),
+            "num_repo_pages": ceil(repos_per_language / REQUESTED_PAGE_SIZE),
+            "max_tasks_in_queue": 2 * threads,
+        }, **options), {"broker_url": "memory://", "result_backend": "cache+memory://"})
+        # Imported after the config is set up, because the tasks module configures celery from it on import.
+        from celery.contrib.testing.worker import start_worker
+        from github_repo_loc_analyser.master import Master
+        from github_repo_loc_analyser.result_store import create_result_store
+        from github_repo_loc_analyser.tasks import app
+
+        queues = None
+        if "size_classes" in options:
+            queues = [size_class.queue for size_class in parse_size_classes(options["size_classes"])]
+        start_time = perf_counter()
+        with start_worker(app, concurrency=threads, pool="threads", perform_ping_check=False, queues=queues):
+            Master().start()
+        duration = perf_counter() - start_time
+        results = list(create_result_store())
+        github.close()
+
+    successful = sum(1 for result in results if result.is_success())
+    print("Processed {} repos ({} successful) with {} threads in {:.1f}s: {:.1f} repos/min, {} API requests.".format(
+        len(results), successful, threads, duration, 60 * len(results) / duration, github.requests))
+    _print_stage_latencies(result.get_metrics() for result in results if result.get_metrics() is not None)
+    _print_peak_memory()
+
+
+BENCHMARKS = {
+    "sampling": benchmark_sampling,
+    "serializer": benchmark_serializer,
+    "get_repos": benchmark_get_repos,
+    "process_repo": benchmark_process_repo,
+    "end_to_end": benchmark_end_to_end,
+}
+
+
+def main():
+    """Run the benchmark given as argument."""
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: {} <{}> [size ...] [option=value ...]".format(sys.argv[0], "|".join(BENCHMARKS)))
+        exit(1)
+    args = [int(arg) for arg in sys.argv[2:] if "=" not in arg]
+    options = dict(arg.split("=", 1) for arg in sys.argv[2:] if "=" in arg)
+    BENCHMARKS[sys.argv[1]](*args, **options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Module for the local stand-ins of the benchmarks: generated git repositories and a fake GitHub API serving them."""
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import date
+from random import Random
+from time import time
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from github_repo_loc_analyser.deadlines import run_process
+from github_repo_loc_analyser.git_cache import get_directory_size
+from github_repo_loc_analyser.git_objects import GIT_EXECUTABLE
+from github_repo_loc_analyser.search_partitioning import Range, SEARCH_RESULT_CAP
+
+logger: logging.Logger = logging.getLogger("fixtures")
+
+# Lines of a typical source file per GitHub language: a comment, code and a blank line.
+SNIPPETS: Dict[str, Tuple[str, List[str]]] = {
+    "Java": (".java", ["// A comment", "int value{n} = {n} * 2;", ""]),
+    "Python": (".py", ["# A comment", "value{n} = {n} * 2", ""]),
+    "C++": (".cpp", ["// A comment", "int value{n} = {n} * 2;", ""]),
+    "Go": (".go", ["// A comment", "var value{n} = {n} * 2", ""]),
+    "JavaScript": (".js", ["// A comment", "const value{n} = {n} * 2;", ""]),
+    "Ruby": (".rb", ["# A comment", "value{n} = {n} * 2", ""]),
+}
+# The share of the files of a repo, which are in its main language. The others are in random other languages.
+DEFAULT_MAIN_LANGUAGE_SHARE = 0.8
+# The rate limits of authenticated requests. The search limit is per minute like on GitHub, the core limit is per hour
+# on GitHub, but here it is per minute, too, so commit resolution doesn't dominate the benchmarks.
+SEARCH_RATE_LIMIT = 30
+CORE_RATE_LIMIT = 5000
+RATE_LIMIT_WINDOW = 60  # seconds
+# The range of the creation dates and the minimum stars of the generated repos. Every repo has more than 20 stars, so
+# it matches the stars filter of the benchmarks.
+FIRST_CREATED = date(2008, 1, 1)
+LAST_CREATED = date(2019, 12, 31)
+MIN_STARS = 21
+# The search qualifiers, which filter the fixture repos by a range. Other qualifiers like pushed are ignored.
+RANGE_QUALIFIERS = {"created": True, "stars": False, "size": False}  # Whether the values are dates
+
+
+class FixtureRepo:
+    """A generated git repository with a single commit."""
+
+    def __init__(self, name: str, language: str, directory: str, commit: str, size: int,
+                 created: date = FIRST_CREATED, stars: int = MIN_STARS):
+        """Init. size is in KB like the size in the GitHub API."""
+        self.name = name
+        self.language = language
+        self.directory = directory
+        self.commit = commit
+        self.size = size
+        self.created = created
+        self.stars = stars
+
+    def get_qualifier_value(self, qualifier: str) -> int:
+        """Return the value of the repo for the range qualifier. Dates are ordinals like in the parsed ranges."""
+        if qualifier == "created":
+            return self.created.toordinal()
+        return getattr(self, qualifier)
+
+    def get_remote_url(self) -> str:
+        """Return the url to fetch the repository from."""
+        return "file://" + self.directory
+
+
+def _git(directory: str, *args: str) -> bytes:
+    return run_process([GIT_EXECUTABLE, "-C", directory, *args])
+
+
+def create_fixture_repo(directory: str, name: str, language: str, num_files: int, lines_per_file: int,
+                        rng: Random, main_language_share: float = DEFAULT_MAIN_LANGUAGE_SHARE) -> FixtureRepo:
+    """
+    Create a repository with num_files source files, which are mostly in the given language.
+
+    The creation date and stars, which the fake GitHub API filters by, are random.
+    """
+    repo_dir = os.path.join(directory, name.replace("/", "_"))
+    os.makedirs(repo_dir)
+    _git(repo_dir, "init", "-q")
+    # Allow fetching a single commit by its sha and partial fetches, like GitHub does.
+    _git(repo_dir, "config", "uploadpack.allowAnySHA1InWant", "true")
+    _git(repo_dir, "config", "uploadpack.allowFilter", "true")
+    other_languages = [other for other in SNIPPETS if other != language]
+    for i in range(num_files):
+        file_language = language if rng.random() < main_language_share else rng.choice(other_languages)
+        extension, snippet = SNIPPETS[file_language]
+        file_dir = os.path.join(repo_dir, "src", "module{}".format(i % 10))
+        os.makedirs(file_dir, exist_ok=True)
+        lines = (snippet[n % len(snippet)].format(n=n + i) for n in range(lines_per_file))
+        with open(os.path.join(file_dir, "file{}{}".format(i, extension)), "w") as f:
+            f.write("\n".join(lines) + "\n")
+    _git(repo_dir, "add", "-A")
+    _git(repo_dir, "-c", "user.name=grla", "-c", "user.email=grla@localhost", "commit", "-q", "-m", "Fixture")
+    commit = _git(repo_dir, "rev-parse", "HEAD").decode().strip()
+    created = date.fromordinal(rng.randint(FIRST_CREATED.toordinal(), LAST_CREATED.toordinal()))
+    return FixtureRepo(name, language, repo_dir, commit, get_directory_size(repo_dir) // 1024, created,
+                       MIN_STARS + int(rng.expovariate(1 / 100)))
+
+
+def create_fixture_repos(directory: str, num_repos: int, languages: List[str], num_files: int, lines_per_file: int,
+                         seed: int = 0) -> List[FixtureRepo]:
+    """
+    Create num_repos repositories with the languages taking turns as main language.
+
+    The number of files of a repo varies between half and one and a half of num_files, so the repos have different
+    sizes like real ones.
+    """
+    rng = Random(seed)
+    result = []
+    for i in range(num_repos):
+        files = max(1, int(num_files * rng.uniform(0.5, 1.5)))
+        result.append(create_fixture_repo(directory, "owner{}/repo{}".format(i % 10, i), languages[i % len(languages)],
+                                          files, lines_per_file, rng))
+    logger.info("Created {} fixture repos in {}".format(len(result), directory))
+    return result
+
+
+class FakeGitHub:
+    """
+    A local http server answering the requests of the ApiQuerier for the fixture repos.
+
+    It serves search/repositories and the commits of the repos with Link and X-RateLimit headers. Requests beyond the
+    rate limit of a minute are answered with 403 like on GitHub. The search filters by the language and the created,
+    stars and size ranges, sorts by stars if requested and only returns the first SEARCH_RESULT_CAP results.
+    """
+
+    def __init__(self, repos: List[FixtureRepo], search_rate_limit: int = SEARCH_RATE_LIMIT,
+                 core_rate_limit: int = CORE_RATE_LIMIT):
+        """Init. Starts the server on a free port."""
+        self._repos = {repo.name: repo for repo in repos}
+        self._limits = {"search": search_rate_limit, "core": core_rate_limit}
+        self._used: Dict[str, int] = {"search": 0, "core": 0}
+        self._reset = int(time()) + RATE_LIMIT_WINDOW
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._create_handler())
+        threading.Thread(target=self._server.serve_forever, name="fake-github", daemon=True).start()
+
+    def get_url(self) -> str:
+        """Return the url to use as api_server."""
+        return "http://127.0.0.1:{}/".format(self._server.server_address[1])
+
+    def close(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _take(self, resource: str) -> Tuple[bool, Dict[str, str]]:
+        """Count the request. Return whether it is within the rate limit and the rate limit headers."""
+        with self._lock:
+            self.requests += 1
+            now = int(time())
+            if now >= self._reset:
+                self._used = {"search": 0, "core": 0}
+                self._reset = now + RATE_LIMIT_WINDOW
+            limit = self._limits[resource]
+            allowed = self._used[resource] < limit
+            if allowed:
+                self._used[resource] += 1
+            return allowed, {
+                "X-RateLimit-Limit": str(limit),
+                "X-RateLimit-Remaining": str(limit - self._used[resource]),
+                "X-RateLimit-Reset": str(self._reset),
+                "X-RateLimit-Resource": resource,
+            }
+
+    def _matches(self, qualifiers: Dict[str, str]) -> List[FixtureRepo]:
+        """Return the repos matching the qualifiers of a search."""
+        ranges = [(name, Range.parse(qualifiers[name], is_date)) for name, is_date in RANGE_QUALIFIERS.items()
+                  if name in qualifiers]
+        candidates = (repo for repo in self._repos.values() if repo.language == qualifiers.get("language"))
+        return [repo for repo in candidates if all(r.start <= repo.get_qualifier_value(name) <= r.end
+                                                   for name, r in ranges)]
+
+    def _search(self, url: str, query: Dict[str, List[str]]) -> Tuple[int, dict, Dict[str, str]]:
+        qualifiers = dict(part.split(":", 1) for part in query.get("q", [""])[0].split() if ":" in part)
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        matches = self._matches(qualifiers)
+        if query.get("sort") == ["stars"]:
+            matches.sort(key=lambda repo: (repo.stars, repo.name), reverse=query.get("order") != ["asc"])
+        if (page - 1) * per_page >= SEARCH_RESULT_CAP:
+            return 422, {"message": "Only the first {} search results are available".format(SEARCH_RESULT_CAP)}, {}
+        available = matches[:SEARCH_RESULT_CAP]
+        items = [self._repo_item(repo) for repo in available[(page - 1) * per_page:page * per_page]]
+        last_page = max(1, -(-len(available) // per_page))
+        links = []
+        for rel, target in [("prev", page - 1), ("next", page + 1), ("last", last_page), ("first", 1)]:
+            if 1 <= target <= last_page:
+                links.append('<{}?{}>; rel="{}"'.format(url, urlencode(dict(query, page=[str(target)]), True), rel))
+        body = {"total_count": len(matches), "incomplete_results": False, "items": items}
+        return 200, body, {"Link": ", ".join(links)}
+
+    def _repo_item(self, repo: FixtureRepo) -> dict:
+        return {
+            "full_name": repo.name,
+            "language": repo.language,
+            "clone_url": repo.get_remote_url(),
+            "commits_url": "{}repos/{}/commits{{/sha}}".format(self.get_url(), repo.name),
+            "size": repo.size,
+            "created_at": repo.created.isoformat() + "T00:00:00Z",
+            "stargazers_count": repo.stars,
+        }
+
+    def _create_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query, keep_blank_values=True)
+                parts = parsed.path.strip("/").split("/")
+                resource = "search" if parts[:2] == ["search", "repositories"] else "core"
+                allowed, headers = fake._take(resource)
+                if not allowed:
+                    self._send(403, {"message": "API rate limit exceeded"}, headers)
+                elif resource == "search":
+                    status, body, link_headers = fake._search(fake.get_url() + "search/repositories", query)
+                    self._send(status, body, dict(headers, **link_headers))
+                elif len(parts) == 4 and parts[0] == "repos" and parts[3] == "commits":
+                    repo = fake._repos.get("{}/{}".format(parts[1], parts[2]))
+                    if repo is None:
+                        self._send(404, {"message": "Not Found"}, headers)
+                    else:
+                        self._send(200, [{"sha": repo.commit}], headers)
+                else:
+                    self._send(404, {"message": "Not Found"}, headers)
+
+            def _send(self, status: int, body, headers: Dict[str, str]):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
@@ -0,0 +1,71 @@
+"""Module for the persistent cache of the counts of all languages of a commit, keyed by its remote url and sha."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+from . import CONFIG
+
+logger: logging.Logger = logging.getLogger("anacache")
+
+BUSY_TIMEOUT = 60  # seconds
+
+FullAnalysis = Dict[str, Dict[str, int]]
+
+_analysis_cache = None
+
+
+class AnalysisCache:
+    """
+    A cache of the full analysis (the counts of every language) of commits.
+
+    The counts of a commit never change, so a cached commit is neither fetched nor counted again. The analyses are
+    also kept per counter, because the counters don't count exactly the same. The cache is a sqlite database in WAL
+    mode, so it can be shared by all processes of a node.
+    """
+
+    def __init__(self, db_file: str):
+        """Init."""
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS analyses (remote_url TEXT NOT NULL, "
+                                 "commit_sha TEXT NOT NULL, counter TEXT NOT NULL, analysis TEXT NOT NULL, "
+                                 "PRIMARY KEY (remote_url, commit_sha, counter))")
+        self._connection.commit()
+
+    def get(self, remote_url: str, commit: str, counter: str) -> Optional[FullAnalysis]:
+        """Return the cached analysis of the commit or None if it is not in the cache."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT analysis FROM analyses WHERE remote_url = ? AND commit_sha = ? AND counter = ?",
+                (remote_url, commit, counter)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, remote_url: str, commit: str, counter: str, analysis: FullAnalysis):
+        """Add the analysis of the commit to the cache."""
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO analyses (remote_url, commit_sha, counter, analysis) VALUES (?, ?, ?, ?)",
+                    (remote_url, commit, counter, json.dumps(analysis)))
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str, FullAnalysis]]:
+        """Iterate over the remote url, commit, counter and analysis of all cached commits."""
+        with self._lock:
+            rows = self._connection.execute("SELECT remote_url, commit_sha, counter, analysis FROM analyses").fetchall()
+        for remote_url, commit, counter, analysis in rows:
+            yield remote_url, commit, counter, json.loads(analysis)
+
+
+def get_analysis_cache() -> Optional[AnalysisCache]:
+    """Return the analysis cache of this process or None if no analysis cache is configured."""
+    global _analysis_cache
+    if "analysis_cache_file" not in CONFIG["main"]:
+        return None
+    # A sqlite connection must not be used in a forked process.
+    if _analysis_cache is None or _analysis_cache[0] != os.getpid():
+        _analysis_cache = (os.getpid(), AnalysisCache(CONFIG["main"]["analysis_cache_file"]))
+    return _analysis_cache[1]
@@ -1,3 +1,3 @@
 """The base celery configuration for this project"""
-worker_pool = 'solo'
+worker_pool = 'prefork'
 worker_hijack_root_logger = False
@@ -0,0 +1,65 @@
+"""Module for the persistent cache of the line counts of single files, keyed by their git blob sha."""
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from . import CONFIG
+
+logger: logging.Logger = logging.getLogger("blobcache")
+
+LOOKUP_CHUNK_SIZE = 500
+BUSY_TIMEOUT = 60  # seconds
+
+_blob_cache = None
+
+
+class BlobCache:
+    """
+    A cache of the blank, comment and code lines of files keyed by their blob sha and language.
+
+    The cache is a sqlite database in WAL mode, so it can be shared by all processes of a node.
+    """
+
+    def __init__(self, db_file: str):
+        """Init."""
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS counts (sha TEXT NOT NULL, language TEXT NOT NULL, "
+                                 "blank INTEGER, comment INTEGER, code INTEGER, PRIMARY KEY (sha, language))")
+        self._connection.commit()
+
+    def get_counts(self, shas: Iterable[str], language: str) -> Dict[str, Tuple[int, int, int]]:
+        """Return the cached counts for those of the given blobs, which are in the cache."""
+        shas = list(shas)
+        result = {}
+        with self._lock:
+            for i in range(0, len(shas), LOOKUP_CHUNK_SIZE):
+                chunk = shas[i:i + LOOKUP_CHUNK_SIZE]
+                rows = self._connection.execute(
+                    "SELECT sha, blank, comment, code FROM counts WHERE language = ? AND sha IN ({})".format(
+                        ",".join("?" * len(chunk))), [language] + chunk)
+                for sha, blank, comment, code in rows:
+                    result[sha] = (blank, comment, code)
+        return result
+
+    def put_counts(self, counts: Dict[str, Tuple[int, int, int]], language: str):
+        """Add the given counts to the cache."""
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO counts (sha, language, blank, comment, code) VALUES (?, ?, ?, ?, ?)",
+                    ((sha, language, blank, comment, code) for sha, (blank, comment, code) in counts.items()))
+
+
+def get_blob_cache() -> Optional[BlobCache]:
+    """Return the blob cache of this process or None if no blob cache is configured."""
+    global _blob_cache
+    if "blob_cache_file" not in CONFIG["main"]:
+        return None
+    # A sqlite connection must not be used in a forked process.
+    if _blob_cache is None or _blob_cache[0] != os.getpid():
+        _blob_cache = (os.getpid(), BlobCache(CONFIG["main"]["blob_cache_file"]))
+    return _blob_cache[1]
@@ -1,17 +1,31 @@
-import json
 import os
-import subprocess
 import shutil
 import logging
+import tempfile
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import git
 
 from . import CONFIG
 
-from github_repo_loc_analyser.data_structure import AnalysisRepo, Result
+from github_repo_loc_analyser.analysis_cache import FullAnalysis, get_analysis_cache
+from github_repo_loc_analyser.blob_cache import get_blob_cache
+from github_repo_loc_analyser.data_structure import AnalysisRepo, Repo, Result
+from github_repo_loc_analyser.deadlines import Deadline, STAGE_CHECKOUT, STAGE_COUNT, STAGE_FETCH
+from github_repo_loc_analyser.deadlines import get_deadline, run_process
+from github_repo_loc_analyser.git_cache import get_directory_size, get_git_cache, PARTIAL_FETCH_FILTER
+from github_repo_loc_analyser.git_objects import BlobReader, list_blobs, find_missing_objects, fetch_blobs
+from github_repo_loc_analyser.git_objects import GIT_EXECUTABLE
+from github_repo_loc_analyser.loc_counter import ALL_EXTENSIONS, get_counter, get_language_of, summarize
+from github_repo_loc_analyser.helper import sanitize_filename
+from github_repo_loc_analyser.metrics import TaskMetrics
 
 logger: logging.Logger = logging.getLogger("codeana")
 
+WORKSPACES_DIRNAME = "workspaces"
+ANALYSIS_SOURCES = ["worktree", "object_db"]
+
 github_to_cloc_lookup_table = {
     "java": "Java",
     "python": "Python",
@@ -27,65 +41,283 @@ github_to_cloc_lookup_table = {
 
 
 class CodeAnalyzer:
-    CLOCK_EXECUTABLE = "cloc"
-
-    def __init__(self, repo: AnalysisRepo):
+    def __init__(self, repo: AnalysisRepo, metrics: Optional[TaskMetrics] = None):
         self.repo = repo
-        self.WORK_DIR = os.path.join(CONFIG["main"]["tmp_dir"], "repo/")
+        self.metrics = TaskMetrics() if metrics is None else metrics
+        self.WORK_DIR = None
+        self.blob_cache_stats = None
+        # Holds the git cache entry from the fetch until the analyser is closed.
+        self._exit_stack = ExitStack()
+        self.partial_fetch = CONFIG["main"].getboolean("partial_fetch", False)
+        self.analysis_source = CONFIG["main"].get("analysis_source", "worktree")
+        if self.analysis_source not in ANALYSIS_SOURCES:
+            raise ValueError("Unknown analysis source: {}".format(self.analysis_source))
+        if self.analysis_source == "object_db" and not get_counter().SUPPORTS_BLOBS:
+            logger.warning("The configured counter cannot count from the object database. Using the worktree.")
+            self.analysis_source = "worktree"
 
-    def shallow_clone_repo(self):
-        logger.info('Cloning repository ' + self.repo.get_name() + '...')
+    def get_cloc_language(self) -> str:
+        """Return the cloc name of the language of the repo."""
+        gh_lang = self.repo.get_language().lower()
+        if gh_lang not in github_to_cloc_lookup_table:
+            raise ValueError("Unsupported language: {}".format(gh_lang))
+        return github_to_cloc_lookup_table[gh_lang]
+
+    def create_workspace(self):
+        """Create a fresh workspace directory, which is used by this analyzer only."""
+        workspaces_dir = os.path.join(CONFIG["main"]["tmp_dir"], WORKSPACES_DIRNAME)
+        os.makedirs(workspaces_dir, exist_ok=True)
+        prefix = sanitize_filename(self.repo.get_name(), self.repo.get_language()) + "-"
+        self.WORK_DIR = tempfile.mkdtemp(prefix=prefix, dir=workspaces_dir) + "/"
+        logger.debug("Created workspace {}".format(self.WORK_DIR))
+
+    def remove_workspace(self):
+        """Remove the workspace of this analyzer, if there is one."""
+        if self.WORK_DIR is None:
+            return
+        logger.debug("Removing workspace {}".format(self.WORK_DIR))
+        shutil.rmtree(self.WORK_DIR, onerror=lambda _f, p, e: logger.warning("Could not remove {}: {}".format(p, e[1])))
+        self.WORK_DIR = None
+
+    @contextmanager
+    def get_cached_objects(self, deadline: Deadline) -> Iterator[Optional[Tuple[str, str]]]:
+        """Yield the object directory and shallow file from the git cache or None if there is no git cache."""
+        git_cache = get_git_cache()
+        if git_cache is None:
+            yield None
+            return
+        with git_cache.get_objects(self.repo.get_remote_url(), self.repo.get_commit(),
+                                   self.partial_fetch, deadline, self.metrics) as cached_objects:
+            yield cached_objects
+
+    def configure_sparse_checkout(self, git_repo: git.Repo):
+        """Restrict the checkout of the workspace to the files of the known languages."""
+        patterns = []
+        for extension in ALL_EXTENSIONS:
+            patterns.append("*" + extension)
+            patterns.append("*" + extension.upper())
+        with open(os.path.join(git_repo.git_dir, "info", "sparse-checkout"), "w") as f:
+            f.write("\n".join(patterns) + "\n")
+        git_repo.git.config("core.sparseCheckout", "true")
 
-        if os.path.exists(self.WORK_DIR):
-            shutil.rmtree(self.WORK_DIR)
-        os.makedirs(self.WORK_DIR)
+    def configure_promisor_remote(self, git_repo: git.Repo):
+        """Make the origin a promisor remote, so that blobs missing in the (partial) git cache are fetched lazily."""
+        git_repo.git.config("core.repositoryformatversion", "1")
+        git_repo.git.config("extensions.partialClone", "origin")
+        git_repo.git.config("remote.origin.promisor", "true")
+
+    def shallow_clone_repo(self, cached_objects: Optional[Tuple[str, str]] = None,
+                           deadline: Optional[Deadline] = None):
+        logger.info('Cloning repository ' + self.repo.get_name() + '...')
 
         git_repo = git.Repo.init(self.WORK_DIR, mkdir=True)
-        if not git_repo.remotes:
-            # add the remote if not already done in a previous run
-            origin = git_repo.create_remote("origin", self.repo.get_remote_url())
-            git_repo.remotes.append(origin)
-        else:
-            # origin already added
-            origin = git_repo.remotes.origin
+        origin = git_repo.create_remote("origin", self.repo.get_remote_url())
         assert origin.exists()
-        assert git_repo.remotes.origin == git_repo.remotes['origin']
-        git_repo.git.fetch("--depth", "1", "origin", self.repo.get_commit())
 
-        git_repo.git.checkout("FETCH_HEAD")
+        checkout = self.analysis_source == "worktree"
+        if self.partial_fetch and checkout:
+            self.configure_sparse_checkout(git_repo)
+
+        if cached_objects is None:
+            fetch_args = ["--depth", "1"]
+            if self.partial_fetch:
+                fetch_args.append(PARTIAL_FETCH_FILTER)
+            with self.metrics.time("fetch"):
+                run_process([GIT_EXECUTABLE, "fetch", *fetch_args, "origin", self.repo.get_commit()], deadline,
+                            cwd=self.WORK_DIR)
+            self.metrics.count("bytes_fetched", self.get_objects_size())
+            if checkout:
+                with self.metrics.time("checkout"):
+                    run_process([GIT_EXECUTABLE, "checkout", "FETCH_HEAD"], get_deadline(STAGE_CHECKOUT),
+                                cwd=self.WORK_DIR)
+            return
+
+        objects_dir, shallow_file = cached_objects
+        with open(os.path.join(git_repo.git_dir, "objects", "info", "alternates"), "w") as f:
+            f.write(objects_dir + "\n")
+        if os.path.exists(shallow_file):
+            shutil.copyfile(shallow_file, os.path.join(git_repo.git_dir, "shallow"))
+        # The cache entry might have been fetched partially by some other task.
+        self.configure_promisor_remote(git_repo)
+        if checkout:
+            with self.metrics.time("checkout"):
+                run_process([GIT_EXECUTABLE, "checkout", self.repo.get_commit()], get_deadline(STAGE_CHECKOUT),
+                            cwd=self.WORK_DIR)
+
+    def get_objects_size(self) -> int:
+        """Return the size of the objects in the workspace (without the alternates) in bytes."""
+        return get_directory_size(os.path.join(self.WORK_DIR, ".git", "objects"))
+
+    def fetch(self):
+        """Create the workspace and fetch the commit into it. close must be called afterwards."""
+        self.create_workspace()
+        deadline = get_deadline(STAGE_FETCH)
+        with self.metrics.time("fetch"):
+            cached_objects = self._exit_stack.enter_context(self.get_cached_objects(deadline))
+        self.shallow_clone_repo(cached_objects, deadline)
+
+    def analyse(self) -> Result:
+        """
+        Count the lines of code of all languages of the fetched commit in one pass and add them to the analysis cache.
+
+        Raises StageTimeout if it runs past the count deadline.
+        """
+        deadline = get_deadline(STAGE_COUNT)
+        if self.analysis_source == "object_db":
+            full_analysis = self.analyse_objects(deadline)
+        else:
+            full_analysis = self.analyse_repo(deadline)
+        self.metrics.count("files", sum(counts["nFiles"] for counts in full_analysis.values()))
+        analysis_cache = get_analysis_cache()
+        if analysis_cache is not None:
+            analysis_cache.put(self.repo.get_remote_url(), self.repo.get_commit(), get_counter().NAME, full_analysis)
+        return self.evaluate(full_analysis)
+
+    def get_cached_result(self) -> Optional[Result]:
+        """Return the result from the analysis cache or None if the commit is not in the cache."""
+        analysis_cache = get_analysis_cache()
+        if analysis_cache is None:
+            return None
+        full_analysis = analysis_cache.get(self.repo.get_remote_url(), self.repo.get_commit(), get_counter().NAME)
+        if full_analysis is None:
+            return None
+        logger.info("Using the cached analysis of repository {}".format(self.repo.get_name()))
+        self.metrics.count("analysis_cache_hits", 1)
+        return self.evaluate(full_analysis)
+
+    def close(self):
+        """Release the git cache entry and remove the workspace."""
+        try:
+            self._exit_stack.close()
+        finally:
+            self.remove_workspace()
 
     def process_repo(self) -> Result:
         logger.info('Begin processing repository ' + self.repo.get_name() + '...')
-        if not os.path.exists(self.WORK_DIR + self.repo.get_name()):
-            self.shallow_clone_repo()
+        # A cached commit is neither fetched nor counted again.
+        cached_result = self.get_cached_result()
+        if cached_result is not None:
+            return cached_result
+        try:
+            self.fetch()
+            return self.analyse()
+        finally:
+            self.close()
 
-        logger.info('Obtaining cloc report for repository ' + self.repo.get_name() + '...')
+    def analyse_repo(self, deadline: Optional[Deadline] = None) -> FullAnalysis:
+        """Count the lines of code of all languages in the worktree."""
+        logger.info('Counting lines of code for repository ' + self.repo.get_name() + '...')
+        with self.metrics.time("count"):
+            if get_blob_cache() is None or not get_counter().SUPPORTS_BLOBS:
+                return get_counter().count_directory(self.WORK_DIR, deadline)
+            # Use the shas from the tree, so the blob cache can be used.
+            blobs = [(sha, path) for sha, path in self.list_blobs(deadline)
+                     if os.path.isfile(os.path.join(self.WORK_DIR, path))]
+            return self.count_blobs(blobs, self.read_files, deadline)
 
-        gh_lang = self.repo.get_language().lower()
-        if gh_lang not in github_to_cloc_lookup_table:
-            raise ValueError("Unsupported language: {}".format(gh_lang))
-        lang = github_to_cloc_lookup_table[gh_lang]
-
-        proc = subprocess.Popen(
-            [self.CLOCK_EXECUTABLE, self.WORK_DIR, "--include-lang=" + lang,
-             "--json"],  # "--quiet"
-            stdout=subprocess.PIPE)
-        cloc_output = proc.stdout.read()
-        if len(cloc_output) < 1:
-            txt = "Cloc could not find any data for language {}".format(lang)
-            logger.info(txt)
-            return Result(self.repo, False, failure_reason=txt)
-        try:
-            output = json.loads(cloc_output)
-        except json.decoder.JSONDecodeError as e:
-            raise ValueError("Output cannot be parsed as json. Cloc output is: {}".format(cloc_output)) from e
-        logger.debug("Got cloc output:{}".format(output))
-
-        lang_result = output[lang]
-        code_lines = lang_result["code"]
-        if code_lines < CONFIG["main"].getint("minimum_code_lines"):
-            txt = "To few code lines ({}) for language {}".format(code_lines, lang)
-            logger.info(txt)
-            return Result(self.repo, False, failure_reason=txt, analysis=lang_result)
-
-        return Result(self.repo, True, analysis=lang_result)
+    def analyse_objects(self, deadline: Optional[Deadline] = None) -> FullAnalysis:
+        """Count the lines of code of all languages by reading the files directly from the object database."""
+        logger.info('Counting lines of code in the objects of repository ' + self.repo.get_name() + '...')
+        with self.metrics.time("count"):
+            blobs = self.list_blobs(deadline)
+            missing = find_missing_objects(self.WORK_DIR, self.repo.get_commit(), deadline).intersection(
+                sha for sha, _ in blobs)
+        if missing:
+            logger.debug("Fetching {} missing blobs".format(len(missing)))
+            size_before = self.get_objects_size()
+            with self.metrics.time("fetch"):
+                fetch_blobs(self.WORK_DIR, missing, get_deadline(STAGE_FETCH))
+            self.metrics.count("bytes_fetched", self.get_objects_size() - size_before)
+        with self.metrics.time("count"), BlobReader(self.WORK_DIR) as reader:
+            return self.count_blobs(blobs, lambda b: reader.read_all((sha for sha, _ in b), deadline), deadline)
+
+    def list_blobs(self, deadline: Optional[Deadline] = None) -> List[Tuple[str, str]]:
+        """Return the sha and path of the files of all known languages in the commit."""
+        return list_blobs(self.WORK_DIR, self.repo.get_commit(), ALL_EXTENSIONS, deadline)
+
+    def read_files(self, blobs: List[Tuple[str, str]]) -> Iterator[bytes]:
+        """Read the given blobs from the worktree."""
+        for _, path in blobs:
+            with open(os.path.join(self.WORK_DIR, path), "rb") as f:
+                yield f.read()
+
+    def count_blobs(self, blobs: List[Tuple[str, str]], read: Callable[[List[Tuple[str, str]]], Iterable[bytes]],
+                    deadline: Optional[Deadline] = None) -> FullAnalysis:
+        """Count the given blobs of all languages. read must return the contents of blobs."""
+        blobs_per_language: Dict[str, List[Tuple[str, str]]] = {}
+        for sha, path in blobs:
+            language = get_language_of(path)
+            if language is not None:
+                blobs_per_language.setdefault(language, []).append((sha, path))
+        result = {}
+        for language, language_blobs in blobs_per_language.items():
+            counts = self.count_language_blobs(language_blobs, language, read, deadline)
+            if counts is not None:
+                result[language] = counts
+        return result
+
+    def count_language_blobs(self, blobs: List[Tuple[str, str]], lang: str,
+                             read: Callable[[List[Tuple[str, str]]], Iterable[bytes]],
+                             deadline: Optional[Deadline] = None) -> Optional[dict]:
+        """Count the given blobs of the language, using the blob cache if there is one."""
+        counter = get_counter()
+        blob_cache = get_blob_cache()
+        if blob_cache is None:
+            return counter.count_blobs(read(blobs), lang, deadline)
+
+        unique_blobs = list(dict(blobs).items())
+        counts = blob_cache.get_counts((sha for sha, _ in unique_blobs), lang)
+        missing = [(sha, path) for sha, path in unique_blobs if sha not in counts]
+        counted = counter.count_contents(read(missing), lang, deadline)
+        new_counts = {sha: (blank, comment, code) for (sha, _), (_, blank, comment, code) in zip(missing, counted)}
+        blob_cache.put_counts(new_counts, lang)
+        counts.update(new_counts)
+        if self.blob_cache_stats is None:
+            self.blob_cache_stats = {"hits": 0, "misses": 0}
+        self.blob_cache_stats["hits"] += len(unique_blobs) - len(missing)
+        self.blob_cache_stats["misses"] += len(missing)
+        logger.debug("Blob cache stats: {}".format(self.blob_cache_stats))
+
+        result = summarize((sha, blank, comment, code) for sha, (blank, comment, code) in counts.items())
+        if result["nFiles"] < 1:
+            return None
+        return result
+
+    def evaluate(self, full_analysis: FullAnalysis) -> Result:
+        """Create the result for the counts of all languages."""
+        logger.debug("Got counts:{}".format(full_analysis))
+        return evaluate_analysis(self.repo, full_analysis, blob_cache_stats=self.blob_cache_stats,
+                                 metrics=self.metrics.to_dict())
+
+
+def evaluate_analysis(repo: Repo, full_analysis: FullAnalysis, blob_cache_stats: Optional[Dict[str, int]] = None,
+                      metrics: Optional[Dict[str, Any]] = None) -> Result:
+    """
+    Create the result of the repo from the counts of all its languages.
+
+    Only the counts of the language of the repo decide about the success. As the full analysis is kept in the
+    result, the results can be evaluated again without counting, e.g. with another minimum_code_lines.
+    """
+    gh_lang = repo.get_language().lower()
+    if gh_lang not in github_to_cloc_lookup_table:
+        txt = "Unsupported language: {}".format(gh_lang)
+        logger.info(txt)
+        return Result(repo, False, failure_reason=txt, blob_cache_stats=blob_cache_stats, metrics=metrics,
+                      full_analysis=full_analysis)
+    lang = github_to_cloc_lookup_table[gh_lang]
+    lang_result = full_analysis.get(lang)
+    if lang_result is None or lang_result["nFiles"] < 1:
+        txt = "Could not find any data for language {}".format(lang)
+        logger.info(txt)
+        return Result(repo, False, failure_reason=txt, blob_cache_stats=blob_cache_stats, metrics=metrics,
+                      full_analysis=full_analysis)
+
+    code_lines = lang_result["code"]
+    if code_lines < CONFIG["main"].getint("minimum_code_lines"):
+        txt = "To few code lines ({}) for language {}".format(code_lines, lang)
+        logger.info(txt)
+        return Result(repo, False, failure_reason=txt, analysis=lang_result, blob_cache_stats=blob_cache_stats,
+                      metrics=metrics, full_analysis=full_analysis)
+
+    return Result(repo, True, analysis=lang_result, blob_cache_stats=blob_cache_stats, metrics=metrics,
+                  full_analysis=full_analysis)
@@ -0,0 +1,100 @@
+"""Module for resolving the commits to analyse on the master."""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os import path, fsync
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from .data_structure import PossibleRepo
+from .github_api_querier import ApiQuerier
+from .helper import sanitize_filename
+from .metrics import get_metrics
+
+logger: logging.Logger = logging.getLogger("resolver")
+
+
+class CommitResolver:
+    """
+    Resolves the commits of possible repos concurrently in batches.
+
+    Resolved commits are appended to a line delimited json file, so they are not resolved again after a restart.
+    """
+
+    def __init__(self, commits_file: str, api: ApiQuerier, batch_size: int):
+        """Init."""
+        self._commits_file = commits_file
+        self._api = api
+        self._batch_size = batch_size
+        self._commits: Dict[str, str] = self._load()
+
+    def _load(self) -> Dict[str, str]:
+        result = {}
+        if not path.exists(self._commits_file):
+            return result
+        with open(self._commits_file) as f:
+            for line in f:
+                try:
+                    datum = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    logger.warning("Ignoring broken line in commits file: {}".format(line))
+                    continue
+                result[datum["repo"]] = datum["commit"]
+        logger.info("Loaded {} resolved commits.".format(len(result)))
+        return result
+
+    def _get_commit(self, repo: PossibleRepo) -> Tuple[bool, Optional[str]]:
+        """
+        Return whether the api answered and the commit of the repo or None if the api confirmed there is none.
+
+        Failed requests don't stop the whole run and are not mistaken for repos without commit.
+        """
+        metrics = get_metrics()
+        try:
+            with metrics.time("commit_resolution_seconds", "Seconds spent resolving a commit on the master."):
+                return True, self._api.get_commit(repo)
+        except (requests.RequestException, ValueError) as e:
+            logger.error("Could not resolve the commit of {}: {}".format(repo.get_name(), e))
+            metrics.inc("commit_resolution_failures_total", "Repos, whose commit could not be resolved on the master.")
+            return False, None
+
+    def _resolve_batch(self, batch: List[PossibleRepo]) -> Iterator[Tuple[PossibleRepo, Optional[str]]]:
+        keys = [sanitize_filename(repo.get_name(), repo.get_language()) for repo in batch]
+        unresolved = [repo for repo, key in zip(batch, keys) if key not in self._commits]
+        logger.info("Resolving commits for {} repos.".format(len(unresolved)))
+        with ThreadPoolExecutor(max_workers=self._api.api_concurrency) as executor:
+            answers = list(executor.map(self._get_commit, unresolved))
+        failed = set()
+        with open(self._commits_file, "a") as f:
+            for repo, (answered, commit) in zip(unresolved, answers):
+                key = sanitize_filename(repo.get_name(), repo.get_language())
+                if not answered:
+                    failed.add(key)
+                if commit is None:
+                    continue  # Don't persist, so it is tried again after a restart
+                self._commits[key] = commit
+                f.write(json.dumps({"repo": key, "commit": commit}) + "\n")
+            f.flush()
+            fsync(f.fileno())
+        if failed:
+            logger.warning("Skipping {} repos, whose commit could not be resolved. They are retried on the next run."
+                           .format(len(failed)))
+        for repo, key in zip(batch, keys):
+            if key not in failed:
+                yield repo, self._commits.get(key)
+
+    def resolve(self, repos: Iterable[PossibleRepo]) -> Iterator[Tuple[PossibleRepo, Optional[str]]]:
+        """
+        Yield the repos with their commit or None if the api confirmed that no usable commit exists.
+
+        Repos, whose commit could not be resolved because of a failed request, are skipped without a result.
+        """
+        batch = []
+        for repo in repos:
+            batch.append(repo)
+            if len(batch) >= self._batch_size:
+                yield from self._resolve_batch(batch)
+                batch = []
+        if batch:
+            yield from self._resolve_batch(batch)
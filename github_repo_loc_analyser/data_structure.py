@@ -1,10 +1,20 @@
 """Module containing the data structure classes used by this project."""
 
-from typing import Dict
+from typing import Any, Dict, Optional, Type
+
+# All subclasses of Serializable by their name.
+SERIALIZABLE_CLASSES: Dict[str, Type["Serializable"]] = {}
 
 
 class Serializable:
-    """Class which can be serialized."""
+    """Class which can be serialized. Every subclass is registered by its name for the deserialization."""
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        """Register the subclass."""
+        super().__init_subclass__(**kwargs)
+        SERIALIZABLE_CLASSES[cls.__name__] = cls
 
     def serialize(self) -> Dict:
         """Return the data representing this class as a dict."""
@@ -19,13 +29,16 @@ class Serializable:
 class Repo(Serializable):
     """The basic representation of a repository."""
 
-    def __init__(self, name: str, language: str, old_repo: bool, remote_url: str):
-        """Init."""
+    __slots__ = ("_name", "_language", "_old_repo", "_remote_url", "_size")
+
+    def __init__(self, name: str, language: str, old_repo: bool, remote_url: str, size: Optional[int] = None):
+        """Init. size is the size of the repo in KB as reported by GitHub, if known."""
         super().__init__()
         self._name = name
         self._language = language
         self._old_repo = old_repo
         self._remote_url = remote_url
+        self._size = size
 
     def get_name(self) -> str:
         """Return the full name of the repo."""
@@ -43,6 +56,10 @@ class Repo(Serializable):
         """Return the remote url (clone url) of the repo."""
         return self._remote_url
 
+    def get_size(self) -> Optional[int]:
+        """Return the size of the repo in KB as reported by GitHub or None if it is unknown."""
+        return self._size
+
     def serialize(self) -> Dict:
         """See overridden."""
         data = super().serialize()
@@ -50,20 +67,24 @@ class Repo(Serializable):
         data["language"] = self._language
         data["old_repo"] = self._old_repo
         data["remote_url"] = self._remote_url
+        data["size"] = self._size
         return data
 
     @classmethod
     def deserialize(cls, data: Dict):
         """Return a new object from the given data."""
-        return Repo(data["name"], data["language"], data["old_repo"], data["remote_url"])
+        return Repo(data["name"], data["language"], data["old_repo"], data["remote_url"], data.get("size"))
 
 
 class PossibleRepo(Repo):
     """The representation of a repo which might be used."""
 
-    def __init__(self, name: str, language: str, old_repo: bool, remote_url: str, commits_url: str):
+    __slots__ = ("_commits_url",)
+
+    def __init__(self, name: str, language: str, old_repo: bool, remote_url: str, commits_url: str,
+                 size: Optional[int] = None):
         """Init."""
-        super().__init__(name, language, old_repo, remote_url)
+        super().__init__(name, language, old_repo, remote_url, size)
         self._commits_url = commits_url
 
     def get_commits_url(self) -> str:
@@ -79,13 +100,17 @@ class PossibleRepo(Repo):
     @classmethod
     def deserialize(cls, data: Dict):
         """Return a new object from the given data."""
-        return PossibleRepo(data["name"], data["language"], data["old_repo"], data["remote_url"], data["commits_url"])
+        return PossibleRepo(data["name"], data["language"], data["old_repo"], data["remote_url"], data["commits_url"],
+                            data.get("size"))
 
 
 class AnalysisRepo(Repo):
-    def __init__(self, name: str, language: str, old_repo: bool, remote_url: str, commit: str):
+    __slots__ = ("_commit",)
+
+    def __init__(self, name: str, language: str, old_repo: bool, remote_url: str, commit: str,
+                 size: Optional[int] = None):
         """Init"""
-        super().__init__(name, language, old_repo, remote_url)
+        super().__init__(name, language, old_repo, remote_url, size)
         self._commit = commit
 
     def get_commit(self) -> str:
@@ -100,19 +125,27 @@ class AnalysisRepo(Repo):
     @classmethod
     def deserialize(cls, data: Dict):
         """Return a new object from the given data."""
-        return AnalysisRepo(data["name"], data["language"], data["old_repo"], data["remote_url"], data["commit"])
+        return AnalysisRepo(data["name"], data["language"], data["old_repo"], data["remote_url"], data["commit"],
+                            data.get("size"))
 
 
 class Result(Serializable):
     """The result of the repo analysis."""
 
-    def __init__(self, repo, sucess=True, analysis=None, failure_reason=None):
+    __slots__ = ("_repo", "_success", "_analysis", "_failure_reason", "_blob_cache_stats", "_metrics",
+                 "_full_analysis")
+
+    def __init__(self, repo, sucess=True, analysis=None, failure_reason=None, blob_cache_stats=None, metrics=None,
+                 full_analysis=None):
         """Init."""
         super().__init__()
         self._repo = repo
         self._success = sucess
         self._analysis = analysis
         self._failure_reason = failure_reason
+        self._blob_cache_stats = blob_cache_stats
+        self._metrics = metrics
+        self._full_analysis = full_analysis
 
     def get_repo(self) -> Repo:
         """Return the repo this result is for."""
@@ -127,6 +160,22 @@ class Result(Serializable):
     def failure_reason(self) -> str:
         return self._failure_reason
 
+    def get_blob_cache_stats(self) -> Optional[Dict[str, int]]:
+        """Return the hits and misses of the blob cache while counting or None if no blob cache was used."""
+        return self._blob_cache_stats
+
+    def get_metrics(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the measurements of the processing or None if there are none.
+
+        These are the start time (started_at), the seconds per stage (timings) and counts like the fetched bytes.
+        """
+        return self._metrics
+
+    def get_full_analysis(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """Return the counts of all languages in the repo by their cloc name or None if the repo was not counted."""
+        return self._full_analysis
+
     def serialize(self) -> Dict:
         """See overridden."""
         data = super().serialize()
@@ -134,9 +183,13 @@ class Result(Serializable):
         data["success"] = self._success
         data["analysis"] = self._analysis
         data["failure_reason"] = self._failure_reason
+        data["blob_cache_stats"] = self._blob_cache_stats
+        data["metrics"] = self._metrics
+        data["full_analysis"] = self._full_analysis
         return data
 
     @classmethod
     def deserialize(cls, data: Dict):
         """Return a new object from the given data."""
-        return Result(data["repo"], data["success"], data["analysis"], data["failure_reason"])
+        return Result(data["repo"], data["success"], data["analysis"], data["failure_reason"],
+                      data.get("blob_cache_stats"), data.get("metrics"), data.get("full_analysis"))
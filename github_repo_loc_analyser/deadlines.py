@@ -0,0 +1,102 @@
+"""Module for the deadlines of the stages of processing a repo and for running processes with a deadline."""
+import os
+import signal
+import subprocess
+from time import monotonic
+from typing import List, Optional
+
+from . import CONFIG
+
+STAGE_API = "api"  # A single request to the GitHub API, e.g. for resolving a commit
+STAGE_FETCH = "fetch"
+STAGE_CHECKOUT = "checkout"
+STAGE_COUNT = "count"
+# Default deadlines in seconds. They are configured with <stage>_timeout in the main section. 0 means no deadline.
+DEFAULT_TIMEOUTS = {
+    STAGE_API: 60,
+    STAGE_FETCH: 600,
+    STAGE_CHECKOUT: 300,
+    STAGE_COUNT: 900,
+}
+
+
+class StageTimeout(Exception):
+    """Raised when a stage runs past its deadline."""
+
+    def __init__(self, stage: str, seconds: float):
+        """Init."""
+        super().__init__(stage, seconds)  # All args, so it can be pickled, e.g. by the result backend
+        self.stage = stage
+        self.seconds = seconds
+
+    def __str__(self) -> str:
+        """Return the message."""
+        return "The {} stage exceeded its deadline of {} seconds.".format(self.stage, self.seconds)
+
+
+class Deadline:
+    """The point in time by which a stage has to be done."""
+
+    def __init__(self, stage: str, seconds: Optional[float]):
+        """Init. seconds None means there is no deadline."""
+        self.stage = stage
+        self.seconds = seconds
+        self._end = None if seconds is None else monotonic() + seconds
+
+    def remaining(self) -> Optional[float]:
+        """Return the seconds until the deadline or None if there is no deadline."""
+        if self._end is None:
+            return None
+        return max(0.0, self._end - monotonic())
+
+    def check(self):
+        """Raise StageTimeout if the deadline passed."""
+        if self._end is not None and monotonic() >= self._end:
+            raise self.exceeded()
+
+    def exceeded(self) -> StageTimeout:
+        """Return the exception for exceeding this deadline."""
+        return StageTimeout(self.stage, self.seconds)
+
+
+def get_timeout(stage: str) -> Optional[float]:
+    """Return the configured seconds for the stage or None if it has no deadline."""
+    seconds = CONFIG["main"].getfloat("{}_timeout".format(stage), DEFAULT_TIMEOUTS[stage])
+    return seconds if seconds > 0 else None
+
+
+def get_deadline(stage: str) -> Deadline:
+    """Return a deadline for the stage, starting now."""
+    return Deadline(stage, get_timeout(stage))
+
+
+def _kill_process_group(proc: subprocess.Popen):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass  # Already gone
+
+
+def run_process(args: List[str], deadline: Optional[Deadline] = None, cwd: Optional[str] = None,
+                stdin: Optional[bytes] = None) -> bytes:
+    """
+    Run the process and return its output.
+
+    The process gets its own process group. If it runs past the deadline, the whole group is killed (including the
+    children it started) and StageTimeout is raised. Raises CalledProcessError if it exits with an error.
+    """
+    proc = subprocess.Popen(args, cwd=cwd, stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        stdout, stderr = proc.communicate(stdin, timeout=None if deadline is None else deadline.remaining())
+    except subprocess.TimeoutExpired:
+        _kill_process_group(proc)
+        proc.communicate()
+        raise deadline.exceeded()
+    except BaseException:
+        _kill_process_group(proc)
+        proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, args, stdout, stderr)
+    return stdout
@@ -0,0 +1,173 @@
+"""Module for the local cache of git objects, which is shared by all tasks of a node."""
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from time import time
+from typing import Iterator, List, Optional, Tuple
+
+import git
+
+from . import CONFIG
+from .deadlines import Deadline, run_process
+from .git_objects import GIT_EXECUTABLE
+from .metrics import TaskMetrics
+
+logger: logging.Logger = logging.getLogger("gitcache")
+
+DEFAULT_MAX_SIZE_MB = 10240
+EVICTION_INTERVAL = 60  # seconds
+EVICTION_LOCK_NAME = "eviction.lock"
+ENTRY_SUFFIX = ".git"
+LOCK_SUFFIX = ".lock"
+CACHE_REF_PREFIX = "refs/grla/"
+PARTIAL_FETCH_FILTER = "--filter=blob:none"
+
+_git_cache = None
+
+
+class GitCache:
+    """
+    A cache of bare repositories keyed by their remote url.
+
+    Every entry is guarded by a lock file. Tasks hold a shared lock while they use an entry and an exclusive lock while
+    they fetch into it. The modification time of the lock file is the last use of the entry, which is used for the LRU
+    eviction once the cache exceeds its maximum size.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        """Init. max_size is in bytes."""
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_entry_path(self, remote_url: str) -> str:
+        key = hashlib.sha1(remote_url.encode("utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, key + ENTRY_SUFFIX)
+
+    def _open_entry(self, entry: str, remote_url: str) -> git.Repo:
+        if os.path.isdir(entry):
+            try:
+                return git.Repo(entry)
+            except git.InvalidGitRepositoryError:
+                logger.warning("Cache entry {} is broken. Recreating it.".format(entry))
+                shutil.rmtree(entry)
+        git_repo = git.Repo.init(entry, mkdir=True, bare=True)
+        git_repo.create_remote("origin", remote_url)
+        return git_repo
+
+    def _update_entry(self, entry: str, remote_url: str, commit: str, partial: bool, deadline: Optional[Deadline],
+                      metrics: Optional[TaskMetrics]):
+        git_repo = self._open_entry(entry, remote_url)
+        try:
+            git_repo.git.cat_file("-e", commit + "^{commit}")
+            logger.debug("Commit {} of {} is already cached.".format(commit, remote_url))
+            return
+        except git.GitCommandError:
+            pass
+        logger.debug("Fetching commit {} of {} into the cache.".format(commit, remote_url))
+        fetch_args = ["--depth", "1"]
+        if partial:
+            fetch_args.append(PARTIAL_FETCH_FILTER)
+        # Fetch into a ref, so the objects are reachable and not pruned by an automatic gc.
+        size_before = get_directory_size(os.path.join(entry, "objects")) if metrics is not None else 0
+        run_process([GIT_EXECUTABLE, "fetch", *fetch_args, "origin",
+                     "{}:{}{}".format(commit, CACHE_REF_PREFIX, commit)], deadline, cwd=entry)
+        if metrics is not None:
+            metrics.count("bytes_fetched", get_directory_size(os.path.join(entry, "objects")) - size_before)
+
+    @contextmanager
+    def get_objects(self, remote_url: str, commit: str, partial: bool = False, deadline: Optional[Deadline] = None,
+                    metrics: Optional[TaskMetrics] = None) -> Iterator[Tuple[str, str]]:
+        """
+        Make sure the given commit is in the cache.
+
+        If partial is True, the commit is fetched without blobs. Once an entry was fetched partially, all later fetches
+        into it are partial as well, so users of the cache must be able to fetch missing blobs themselves.
+
+        Yields the path of the object directory and the path of the shallow file of the cache entry. These can be used
+        as an alternate object store. The entry is not evicted, while the context is active.
+        Raises StageTimeout if the fetch runs past the deadline. The fetched bytes are counted in metrics.
+        """
+        entry = self._get_entry_path(remote_url)
+        with open(entry + LOCK_SUFFIX, "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._update_entry(entry, remote_url, commit, partial, deadline, metrics)
+                os.utime(lock_file.name)
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+                yield os.path.join(entry, "objects"), os.path.join(entry, "shallow")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.evict()
+
+    def _list_entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            entry = os.path.join(self._cache_dir, name)
+            try:
+                last_used = os.path.getmtime(entry + LOCK_SUFFIX)
+            except OSError:
+                last_used = 0
+            entries.append((last_used, get_directory_size(entry), entry))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is smaller than its maximum size."""
+        with open(os.path.join(self._cache_dir, EVICTION_LOCK_NAME), "a+") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Somebody else is evicting right now
+            try:
+                if time() - os.path.getmtime(lock_file.name) < EVICTION_INTERVAL:
+                    return
+                os.utime(lock_file.name)
+                entries = self._list_entries()
+                total_size = sum(size for _, size, _ in entries)
+                for _, size, entry in sorted(entries):
+                    if total_size <= self._max_size:
+                        break
+                    if self._try_remove_entry(entry):
+                        total_size -= size
+                logger.debug("Git cache size after eviction: {} bytes".format(total_size))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _try_remove_entry(self, entry: str) -> bool:
+        with open(entry + LOCK_SUFFIX, "a+") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False  # Entry is in use
+            try:
+                logger.info("Evicting {} from the git cache.".format(entry))
+                shutil.rmtree(entry, ignore_errors=True)
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_directory_size(directory: str) -> int:
+    """Return the size of all files below the given directory in bytes."""
+    size = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return size
+
+
+def get_git_cache() -> Optional[GitCache]:
+    """Return the git cache of this process or None if no git cache is configured."""
+    global _git_cache
+    if _git_cache is None and "git_cache_dir" in CONFIG["main"]:
+        max_size = CONFIG["main"].getint("git_cache_max_size", DEFAULT_MAX_SIZE_MB) * 1024 * 1024
+        _git_cache = GitCache(CONFIG["main"]["git_cache_dir"], max_size)
+    return _git_cache
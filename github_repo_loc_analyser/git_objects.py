@@ -0,0 +1,114 @@
+"""Module for reading files directly from the object database of a git repository."""
+import logging
+import subprocess
+import threading
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from .deadlines import Deadline, run_process
+
+logger: logging.Logger = logging.getLogger("gitobj")
+
+GIT_EXECUTABLE = "git"
+SYMLINK_MODE = "120000"
+
+
+def list_blobs(git_dir: str, commit: str, extensions: Tuple[str, ...],
+               deadline: Optional[Deadline] = None) -> List[Tuple[str, str]]:
+    """Return the sha and path of all files in the tree of the commit, which have one of the given extensions."""
+    output = run_process([GIT_EXECUTABLE, "ls-tree", "-r", "-z", "--full-tree", commit], deadline, cwd=git_dir)
+    result = []
+    for entry in output.split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        mode, object_type, sha = info.split(b" ")
+        path = path.decode("utf-8", errors="replace")
+        if object_type != b"blob" or mode.decode() == SYMLINK_MODE:
+            continue
+        if path.lower().endswith(extensions):
+            result.append((sha.decode(), path))
+    return result
+
+
+def find_missing_objects(git_dir: str, commit: str, deadline: Optional[Deadline] = None) -> Set[str]:
+    """Return the objects reachable from the commit, which are missing in a partial clone (without fetching them)."""
+    output = run_process([GIT_EXECUTABLE, "rev-list", "--objects", "--missing=print", commit], deadline, cwd=git_dir)
+    return {line[1:].decode() for line in output.splitlines() if line.startswith(b"?")}
+
+
+def fetch_blobs(git_dir: str, shas: Iterable[str], deadline: Optional[Deadline] = None):
+    """Fetch the given blobs from the promisor remote in a single request."""
+    # This is the same command git uses to prefetch the blobs for a checkout in a partial clone.
+    run_process([GIT_EXECUTABLE, "-c", "fetch.negotiationAlgorithm=noop", "fetch", "origin", "--no-tags",
+                 "--no-write-fetch-head", "--recurse-submodules=no", "--filter=blob:none", "--stdin"],
+                deadline, cwd=git_dir, stdin="".join(sha + "\n" for sha in shas).encode())
+
+
+class BlobReader:
+    """Reads blobs through a single long lived 'git cat-file --batch' process."""
+
+    def __init__(self, git_dir: str):
+        """Init."""
+        self._git_dir = git_dir
+        self._proc = None
+        self._timed_out = False
+
+    def __enter__(self):
+        """Start the cat-file process."""
+        self._proc = subprocess.Popen([GIT_EXECUTABLE, "cat-file", "--batch"], cwd=self._git_dir,
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stop the cat-file process."""
+        if exc_type is not None:
+            self._proc.kill()  # It might be blocked writing a blob, which is not read anymore.
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass  # Killed with a request left in the buffer
+        self._proc.stdout.close()
+        self._proc.wait()
+
+    def read(self, sha: str) -> bytes:
+        """Return the content of the given blob."""
+        self._proc.stdin.write(sha.encode() + b"\n")
+        self._proc.stdin.flush()
+        header = self._proc.stdout.readline().split()
+        if len(header) < 3 or header[1] != b"blob":
+            raise ValueError("Cannot read blob {}: {}".format(sha, b" ".join(header)))
+        size = int(header[2])
+        content = self._proc.stdout.read(size + 1)  # Content is followed by a newline
+        if len(content) < size:
+            raise ValueError("Cannot read blob {}: cat-file exited".format(sha))
+        return content[:size]
+
+    def _kill_on_deadline(self):
+        self._timed_out = True
+        self._proc.kill()
+
+    def read_all(self, shas: Iterable[str], deadline: Optional[Deadline] = None) -> Iterator[bytes]:
+        """
+        Return the contents of the given blobs one after another. Raises StageTimeout after the deadline.
+
+        The cat-file process is killed once the deadline passes, so a blocked read doesn't outlast it.
+        """
+        timer = None
+        if deadline is not None and deadline.remaining() is not None:
+            timer = threading.Timer(deadline.remaining(), self._kill_on_deadline)
+            timer.daemon = True
+            timer.start()
+        try:
+            for sha in shas:
+                if deadline is not None:
+                    deadline.check()
+                try:
+                    content = self.read(sha)
+                except (ValueError, OSError) as e:
+                    if self._timed_out:
+                        raise deadline.exceeded() from e
+                    raise
+                yield content
+        finally:
+            if timer is not None:
+                timer.cancel()
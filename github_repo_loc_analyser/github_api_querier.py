@@ -1,23 +1,36 @@
 """Module for querying the Github API."""
 import logging
-from random import randint
-from typing import List, Optional
-from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor
+from random import Random, randrange
+from queue import Queue
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Tuple
+from time import time
 from math import ceil
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from . import CONFIG
 from .data_structure import PossibleRepo
+from .deadlines import STAGE_API, get_timeout
 from .helper import sanitize_filename
+from .http_cache import get_http_cache
+from .search_partitioning import Partition, PartitionIndex, Range, SEARCH_RESULT_CAP
+from .rate_limit import get_rate_limiter, RESOURCE_CORE, RESOURCE_SEARCH
+from .sampling import RepoSampler
 
 logger: logging.Logger = logging.getLogger("gh_api")
 
 API_SERVER = "https://api.github.com/"
 API_ENDPOINT_REPOS = "search/repositories"
+# The sampled results of a partition are located by their index, so its pages must always come in the same order.
+PARTITION_SORT = "&sort=stars&order=desc"
 
 RATE_LIMIT_RETRIES = 3
+# Seconds to wait after a rate limited response without a reset time, as GitHub recommends for its secondary limits
+SECONDARY_RATE_LIMIT_WAIT = 60
 REQUESTED_PAGE_SIZE = 100
+DEFAULT_API_CONCURRENCY = 4
 
 
 class ApiQuerier:
@@ -45,113 +58,288 @@ class ApiQuerier:
         self.new_repo_date: int = main.get("new_repo_date")
 
         if "github_auth" in main:
-            self.auth = main.get("github_auth")
+            # Several tokens can be given separated by commas. The load is spread over them.
+            self.auths: List[str] = [auth.strip() for auth in main.get("github_auth").split(",")]
         else:
-            self.auth = None
+            self.auths = []
+        self._rate_limiter = get_rate_limiter(len(self.auths))
+
+        self.adaptive_partitioning: bool = main.getboolean("adaptive_partitioning", False)
+        self.num_repos: int = main.getint("num_repos", self.num_repos_per_page * self.num_repo_pages)
+        self.sampling_seed: str = main.get("sampling_seed", str(randrange(2 ** 32)))
+        logger.info("Sampling seed: {}".format(self.sampling_seed))
+
+        self.api_server: str = main.get("api_server", API_SERVER)
+        self.api_concurrency: int = main.getint("api_concurrency", DEFAULT_API_CONCURRENCY)
+        self._request_timeout: Optional[float] = get_timeout(STAGE_API)
+        # One session for all requests, so the connections are kept alive and reused.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.api_concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def get_rate_limit_headroom(self) -> Dict[str, int]:
+        """Return the known remaining budget per token and resource."""
+        return self._rate_limiter.get_headroom()
 
     def _build_request_header(self):
-        result = {"Accept": "application/vnd.github.v3+json"}
-        if self.auth is not None:
-            result["Authorization"] = self.auth
-        return result
+        return {"Accept": "application/vnd.github.v3+json"}
 
     def _perform_request_with_retry(self, request: requests.PreparedRequest) -> requests.Response:
         retries = 0
-        while retries < RATE_LIMIT_RETRIES:
+        resource = RESOURCE_SEARCH if API_ENDPOINT_REPOS in request.url else RESOURCE_CORE
+        # Every token might turn out to be exhausted once before the rate limiter has to wait for a reset.
+        while retries < RATE_LIMIT_RETRIES + len(self.auths):
+            token_index = self._rate_limiter.acquire(resource)
+            if self.auths:
+                request.headers["Authorization"] = self.auths[token_index]
             logger.info("Performing request to {}. Try #{}".format(request.url.split('?')[0], retries))
             logger.debug("Full URL:{}".format(request.url))
-            r = requests.Session().send(request)
+            r = self._session.send(request, timeout=self._request_timeout)
             logger.debug("Status code: {}".format(r.status_code))
+            if r.status_code == 304:
+                # GitHub does not charge conditional requests, which are answered with 304.
+                self._rate_limiter.refund(token_index, resource)
+            self._rate_limiter.update(token_index, resource, r.headers)
             if not (r.status_code == 403 and "rate limit exceeded" in r.text):
                 return r
-            current_time = ceil(time())
-            time_for_rl_reset = int(r.headers['X-RateLimit-Reset'])
-            to_sleep = time_for_rl_reset - current_time
-            to_sleep = max(3, to_sleep)
+            # The next acquire picks another token or waits until the earliest reset, if all tokens are exhausted.
+            reset = self._get_rate_limit_reset(r)
+            self._rate_limiter.exhaust(token_index, resource, reset)
             retries += 1
-            logger.warn("Rate limit exeeded. Waiting {} seconds.".format(to_sleep))
-            sleep(to_sleep)
+            logger.warning("Rate limit exeeded. The token can be used again in {} seconds.".format(
+                max(0, reset - ceil(time()))))
         raise ValueError("Exeeded retry limit")
 
-    def _construct_get_repos_request(self, language: str, old_repo: bool) -> requests.Request:
+    @staticmethod
+    def _get_rate_limit_reset(r: requests.Response) -> int:
+        """Return the time, when the token can be used again after a rate limited response."""
+        if "Retry-After" in r.headers:  # Sent for the secondary rate limits
+            return ceil(time()) + int(r.headers["Retry-After"])
+        if r.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in r.headers:
+            return int(r.headers["X-RateLimit-Reset"])
+        return ceil(time()) + SECONDARY_RATE_LIMIT_WAIT
+
+    def _perform_cached_request(self, request: requests.PreparedRequest, immutable: bool = False) -> requests.Response:
+        """
+        Perform the request, using the http cache if there is one.
+
+        Cached responses are returned without a request while they are fresh or if the response is immutable.
+        Otherwise they are revalidated with a conditional request, which does not count against the rate limit.
+        """
+        http_cache = get_http_cache()
+        if http_cache is None:
+            return self._perform_request_with_retry(request)
+        cached = http_cache.get(request.url)
+        if cached is not None:
+            if immutable or http_cache.is_fresh(cached):
+                logger.debug("Using cached response for {}".format(request.url))
+                return cached.to_response(request)
+            request.headers.update(cached.get_validators())
+        r = self._perform_request_with_retry(request)
+        if r.status_code == 304 and cached is not None:
+            logger.debug("Cached response for {} is still valid".format(request.url))
+            http_cache.refresh(request.url)
+            return cached.to_response(request)
+        if r.status_code == 200:
+            http_cache.put(request.url, r)
+        return r
+
+    def _construct_get_repos_request(self, language: str, old_repo: bool, page: int,
+                                     partition: Optional[Partition] = None,
+                                     page_size: int = REQUESTED_PAGE_SIZE) -> requests.Request:
+        stars = self.stars if partition is None else partition.stars.to_qualifier()
         params = "q=language:" + language + "+"
         params += "size:" + self.size + "+"
-        params += "stars:" + self.stars + "+"
+        params += "stars:" + stars + "+"
         if old_repo:
-            params += "created:" + self.old_repo_created + "+"
+            created = self.old_repo_created if partition is None else partition.created.to_qualifier()
+            params += "created:" + created + "+"
             params += "pushed:" + self.old_repo_updated
         else:
-            params += "created:" + self.new_repo_created + "+"
+            created = self.new_repo_created if partition is None else partition.created.to_qualifier()
+            params += "created:" + created + "+"
             params += "pushed:" + self.new_repo_updated
-        params += "&per_page=" + str(REQUESTED_PAGE_SIZE)
-        url = API_SERVER + API_ENDPOINT_REPOS
+        if partition is not None:
+            params += PARTITION_SORT
+        params += "&per_page=" + str(page_size)
+        params += "&page=" + str(page + 1)
+        url = self.api_server + API_ENDPOINT_REPOS
         return requests.Request('GET', url, params=params, headers=self._build_request_header())
 
-    def _get_next_url(self, resp: requests.Response) -> Optional[str]:
-        links = resp.headers["Link"].split(",")
-        next_url = None
-        for link in links:
-            parts = link.split(";")
-            if parts[1].strip() == 'rel="next"':
-                next_url = parts[0].strip().strip("<").strip(">")
-        return next_url
+    def _get_repos(self, language: str, old_repo: bool, sampler: RepoSampler,
+                   done_pages: AbstractSet[str]) -> Iterator[Tuple[str, List[PossibleRepo]]]:
+        """
+        Yield the key and the picked repos of every page, which is not in done_pages.
 
-    def _get_repos(self, language: str, old_repo: bool, results_sanitzed_filenames: List[str]) -> List[PossibleRepo]:
+        num_repos_per_page repos are sampled from each of the first num_repo_pages pages. If a page has too few unused
+        repos, the missing ones are picked from the following pages, going beyond num_repo_pages if needed.
+        """
         old_repo_string = "new"
         if old_repo:
             old_repo_string = "old"
         logger.info("Getting {} repos for {}.".format(old_repo_string, language))
-        req = self._construct_get_repos_request(language, old_repo)
 
-        result = []
-
-        for page in range(self.num_repo_pages):
+        missing = 0
+        for page in range(SEARCH_RESULT_CAP // REQUESTED_PAGE_SIZE):
+            if page >= self.num_repo_pages and missing <= 0:
+                break
+            page_key = "{}:{}:{}".format(language, old_repo_string, page)
+            if page_key in done_pages:
+                logger.debug("Skipping page {}, which is already done.".format(page_key))
+                continue
             logger.info("Getting page {}".format(page))
-            resp = self._perform_request_with_retry(req.prepare())
+            wanted = missing + (self.num_repos_per_page if page < self.num_repo_pages else 0)
+            req = self._construct_get_repos_request(language, old_repo, page)
+            resp = self._perform_cached_request(req.prepare())
             if not resp.ok:
                 logger.error("Result not ok ({}): \n{}".format(resp.status_code, resp.text))
+                missing = wanted
                 continue
 
-            if page < self.num_repo_pages - 1:
-                url = self._get_next_url(resp)
-                if url is None:
-                    logger.error("Cannot get next page from headers:{}".format(resp.headers))
-                req.url = url
-
-            data = resp.json()
-            used_indices = []
-            for _ in range(self.num_repos_per_page):
-                size = len(data["items"])
-                last_i = size - 1
-                index = -1
-                sanitized_filename = ""
-                datum = None
-                tries = 0
-                while index < 0 or index in used_indices or sanitized_filename in results_sanitzed_filenames:
-                    tries += 1
-                    if tries >= size * 2:
-                        raise ValueError("Cannot find another usable entry in this result page.")
-                    index = randint(0, last_i)
-                    datum = data["items"][index]
-                    name = datum["full_name"]
-                    sanitized_filename = sanitize_filename(name, language)
-                used_indices.append(index)
-                results_sanitzed_filenames.append(sanitized_filename)
-                logger.debug("Picked index: {}".format(index))
-                remote_url = datum["clone_url"]
-                commits_url = datum["commits_url"]
-                commits_url = commits_url.split("{")[0]
-                result.append(PossibleRepo(datum["full_name"], language, old_repo, remote_url, commits_url))
-
-        return result
-
-    def get_repos(self) -> List[PossibleRepo]:
+            items = resp.json()["items"]
+            # Seeded per page, so skipping done pages after a restart doesn't change the picks of the other pages.
+            rng = Random("{}:{}:{}:{}".format(self.sampling_seed, language, old_repo_string, page))
+            picked = sampler.sample(items, language, wanted, rng)
+            missing = wanted - len(picked)
+            if missing > 0:
+                logger.info("Page {} has too few unused repos. Picking {} more from the next page.".format(
+                    page_key, missing))
+            result = [PossibleRepo(datum["full_name"], language, old_repo, datum["clone_url"],
+                                   datum["commits_url"].split("{")[0], datum.get("size")) for datum in picked]
+            yield page_key, result
+            if len(items) < REQUESTED_PAGE_SIZE:
+                break  # Last page of the results
+        if missing > 0:
+            logger.warning("There are {} {} repos for {} missing, because the results are exhausted.".format(
+                missing, old_repo_string, language))
+
+    def _get_total_count(self, language: str, old_repo: bool, partition: Partition) -> int:
+        req = self._construct_get_repos_request(language, old_repo, 0, partition, page_size=1)
+        resp = self._perform_cached_request(req.prepare())
+        if not resp.ok:
+            raise ValueError("Cannot get the count of {} ({}): {}".format(partition, resp.status_code, resp.text))
+        return resp.json()["total_count"]
+
+    def _get_partitions(self, language: str, old_repo: bool, executor: ThreadPoolExecutor) -> PartitionIndex:
+        """Split the search recursively, until every partition has less results than the search API returns."""
+        created = self.old_repo_created if old_repo else self.new_repo_created
+        to_count = [Partition(Range.parse(created, True), Range.parse(self.stars, False))]
         result = []
-        results_sanitzed_filenames = [] # List to keep track of all the filenames we need as not to create a collision
-        for language in self.languages:
-            for old_repo in [False, True]:
-                result += self._get_repos(language.strip(), old_repo, results_sanitzed_filenames)
-        return result
+        while to_count:
+            counts = executor.map(lambda p: self._get_total_count(language, old_repo, p), to_count)
+            to_split = []
+            for partition, count in zip(to_count, counts):
+                partition.total_count = count
+                if count > SEARCH_RESULT_CAP:
+                    to_split.append(partition)
+                else:
+                    result.append(partition)
+            to_count = []
+            for partition in to_split:
+                parts = partition.split()
+                if parts is None:
+                    logger.warning("Cannot split {} further. Only the first {} of {} results can be used.".format(
+                        partition, SEARCH_RESULT_CAP, partition.total_count))
+                    partition.total_count = SEARCH_RESULT_CAP
+                    result.append(partition)
+                else:
+                    to_count += parts
+        index = PartitionIndex(result)
+        logger.info("Split search into {} partitions with {} results.".format(len(index.partitions),
+                                                                              index.total_count))
+        return index
+
+    def _get_page_items(self, language: str, old_repo: bool, partition: Partition, page: int) -> List[dict]:
+        req = self._construct_get_repos_request(language, old_repo, page, partition)
+        resp = self._perform_cached_request(req.prepare())
+        if not resp.ok:
+            logger.error("Result not ok ({}): \n{}".format(resp.status_code, resp.text))
+            return []
+        return resp.json()["items"]
+
+    def _get_sampled_repos(self, language: str, old_repo: bool, sampler: RepoSampler,
+                           done_pages: AbstractSet[str]) -> Iterator[Tuple[str, List[PossibleRepo]]]:
+        """
+        Sample repos uniformly from all results of the search, even beyond the result cap of the search API.
+
+        The search is partitioned by creation date and stars, so every partition is below the cap. Then num_repos
+        indices into the concatenated results of all partitions are sampled with a seeded random generator and the
+        pages containing them are fetched. The results of a partition are sorted by stars, so an index denotes the same
+        repo on every request. The picked repos are yielded in chunks of REQUESTED_PAGE_SIZE.
+        """
+        old_repo_string = "old" if old_repo else "new"
+        logger.info("Sampling {} repos for {}.".format(old_repo_string, language))
+        rng = Random("{}:{}:{}".format(self.sampling_seed, language, old_repo_string))
+        with ThreadPoolExecutor(max_workers=self.api_concurrency) as executor:
+            index = self._get_partitions(language, old_repo, executor)
+            samples = rng.sample(range(index.total_count), min(index.total_count, self.num_repos))
+            for chunk_number, start in enumerate(range(0, len(samples), REQUESTED_PAGE_SIZE)):
+                page_key = "{}:{}:sample:{}".format(language, old_repo_string, chunk_number)
+                if page_key in done_pages:
+                    logger.debug("Skipping chunk {}, which is already done.".format(page_key))
+                    continue
+                located = [index.locate(i) for i in samples[start:start + REQUESTED_PAGE_SIZE]]
+                page_ids = sorted({(partition, offset // REQUESTED_PAGE_SIZE) for partition, offset in located})
+                pages = dict(zip(page_ids, executor.map(
+                    lambda page_id: self._get_page_items(language, old_repo, index.partitions[page_id[0]],
+                                                         page_id[1]),
+                    page_ids)))
+                result = []
+                for partition, offset in located:
+                    items = pages[(partition, offset // REQUESTED_PAGE_SIZE)]
+                    position = offset % REQUESTED_PAGE_SIZE
+                    if position >= len(items):
+                        logger.warning("Sampled result is gone. The results changed since they were counted.")
+                        continue
+                    datum = items[position]
+                    if not sampler.claim(sanitize_filename(datum["full_name"], language)):
+                        continue
+                    result.append(PossibleRepo(datum["full_name"], language, old_repo, datum["clone_url"],
+                                               datum["commits_url"].split("{")[0], datum.get("size")))
+                yield page_key, result
+
+    def _put_repo_pages(self, pages: Iterator[Tuple[str, List[PossibleRepo]]], output: Queue):
+        try:
+            for page in pages:
+                output.put(page)
+        except Exception as e:  # Raised again by the consumer
+            output.put(e)
+        finally:
+            output.put(None)
+
+    def get_repo_pages(self, results_sanitzed_filenames: Iterable[str] = (),
+                       done_pages: AbstractSet[str] = frozenset()) -> Iterator[Tuple[str, List[PossibleRepo]]]:
+        """
+        Yield the key and the picked repos of every page for all languages and periods as soon as they are there.
+
+        Up to api_concurrency languages and periods are queried concurrently.
+        results_sanitzed_filenames are the filenames of already picked repos, which must not be picked again.
+        Pages with a key in done_pages are skipped.
+        """
+        # Keeps track of all the filenames we need as not to create a collision
+        sampler = RepoSampler(results_sanitzed_filenames)
+        combinations = [(language.strip(), old_repo) for language in self.languages for old_repo in [False, True]]
+        pages: Queue = Queue()
+        with ThreadPoolExecutor(max_workers=self.api_concurrency) as executor:
+            get_repos = self._get_sampled_repos if self.adaptive_partitioning else self._get_repos
+            for language, old_repo in combinations:
+                executor.submit(self._put_repo_pages,
+                                get_repos(language, old_repo, sampler, done_pages), pages)
+            running = len(combinations)
+            while running > 0:
+                page = pages.get()
+                if page is None:
+                    running -= 1
+                elif isinstance(page, BaseException):
+                    raise page
+                else:
+                    yield page
+
+    def get_repos(self) -> Iterator[PossibleRepo]:
+        """Yield the repos for all languages and periods as soon as they are found."""
+        for _, repos in self.get_repo_pages():
+            yield from repos
 
     def get_commit(self, repo: PossibleRepo) -> Optional[str]:
         """Get the hash of the commit to inspect for the given repo."""
@@ -167,7 +355,10 @@ class ApiQuerier:
         }
         req = requests.Request('GET', url, params=params, headers=self._build_request_header())
         logger.info("Getting commit hash for repo {}".format(repo.get_name()))
-        resp = self._perform_request_with_retry(req.prepare())
+        # The last commit before a fixed date does not change.
+        resp = self._perform_cached_request(req.prepare(), immutable=True)
+        if resp.status_code >= 500:
+            resp.raise_for_status()  # Transient, so it must not be mistaken for a repo without commit
         if not resp.ok:
             logger.error("Result not ok ({}): \n{}".format(resp.status_code, resp.text))
             return None
@@ -8,10 +8,15 @@ from typing import Callable, TextIO, Type, Any
 from unicodedata import normalize
 
 from . import CONFIG
-from . import data_structure
-from .data_structure import Serializable
+from .data_structure import SERIALIZABLE_CLASSES, Serializable
 
-DATA_TYPE_MODULES = [data_structure]
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Version of the layout of the msgpack messages. Increase it on incompatible changes of the serialized data.
+MSGPACK_SCHEMA_VERSION = 1
 
 
 class SerializableJsonEncoder(JSONEncoder):
@@ -39,15 +44,9 @@ def get_serializable_class(classname: str) -> Type[Serializable]:
 
     Raises ValueError if no Serializable class with that name is found.
     """
-    claz = None
-    for module in DATA_TYPE_MODULES:
-        claz = getattr(module, classname, None)
-        if claz is not None:
-            break
+    claz = SERIALIZABLE_CLASSES.get(classname)
     if claz is None:
         raise ValueError("No such class was found")
-    if not issubclass(claz, Serializable):
-        raise ValueError("Class with that name is not a Serializable")
     return claz
 
 
@@ -61,6 +60,34 @@ def deserialization_hook(data: Any) -> Any:
     return claz.deserialize(data)
 
 
+def _msgpack_default(o: Any) -> Any:
+    if isinstance(o, Serializable):
+        return o.serialize()
+    raise TypeError("Cannot serialize object of type {}".format(type(o).__name__))
+
+
+def msgpack_dumps(o: Any) -> bytes:
+    """Serialize the object, which may contain Serializables, with msgpack."""
+    if msgpack is None:
+        raise ValueError("The msgpack serializer needs the msgpack package.")
+    return msgpack.packb([MSGPACK_SCHEMA_VERSION, o], default=_msgpack_default, use_bin_type=True)
+
+
+def msgpack_loads(data: bytes) -> Any:
+    """
+    Deserialize data serialized with msgpack_dumps.
+
+    Raises ValueError if the data was serialized with another schema version.
+    """
+    if msgpack is None:
+        raise ValueError("The msgpack serializer needs the msgpack package.")
+    version, o = msgpack.unpackb(data, object_hook=deserialization_hook, raw=False)
+    if version != MSGPACK_SCHEMA_VERSION:
+        raise ValueError("Unsupported msgpack schema version {} (expected {}).".format(version,
+                                                                                       MSGPACK_SCHEMA_VERSION))
+    return o
+
+
 def atmoic_write_file(filepath: str, writer: Callable[[TextIO], None], text_mode: bool = True):
     """
     Tries to atomically write to the given file using writer to get the data to write.
@@ -88,7 +115,7 @@ def atmoic_write_file(filepath: str, writer: Callable[[TextIO], None], text_mode
             f.flush()
             fsync(tmpfile_fd)
         rename(tmpfile, filepath)
-    except BaseException as e:
+    except BaseException as e:  # noqa: B036 - re-raised as ValueError
         raise ValueError("Failed to do atomic write to {}.".format(filepath)) from e
     finally:
         if tmpfile is not None and path.exists(tmpfile):
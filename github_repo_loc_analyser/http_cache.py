@@ -0,0 +1,123 @@
+"""Module for the persistent cache of GitHub API responses, which is revalidated with conditional requests."""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from time import time
+from typing import Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from . import CONFIG
+
+logger: logging.Logger = logging.getLogger("httpcache")
+
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+DEFAULT_MAX_SIZE_MB = 512
+BUSY_TIMEOUT = 60  # seconds
+
+_http_cache = None
+
+
+class CachedResponse:
+    """A response from the cache."""
+
+    def __init__(self, url: str, status_code: int, headers: dict, body: bytes, stored_at: float):
+        """Init."""
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def to_response(self, request: requests.PreparedRequest) -> requests.Response:
+        """Return a requests response with the cached data."""
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = self.url
+        response.request = request
+        return response
+
+    def get_validators(self) -> dict:
+        """Return the headers for revalidating this response with a conditional request."""
+        headers = CaseInsensitiveDict(self.headers)
+        result = {}
+        if "ETag" in headers:
+            result["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            result["If-Modified-Since"] = headers["Last-Modified"]
+        return result
+
+
+class HttpCache:
+    """A size bounded cache of successful responses keyed by their url, kept in a sqlite database."""
+
+    def __init__(self, db_file: str, ttl: int, max_size: int):
+        """Init. ttl is in seconds, max_size in bytes."""
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER, "
+                                 "headers TEXT, body BLOB, size INTEGER, stored_at REAL, accessed_at REAL)")
+        self._connection.commit()
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """Return the cached response for the url or None."""
+        with self._lock:
+            row = self._connection.execute("SELECT status, headers, body, stored_at FROM responses WHERE url = ?",
+                                           (url,)).fetchone()
+            if row is None:
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time(), url))
+        status, headers, body, stored_at = row
+        return CachedResponse(url, status, json.loads(headers), body, stored_at)
+
+    def is_fresh(self, cached: CachedResponse) -> bool:
+        """Return whether the cached response is younger than the ttl."""
+        return time() - cached.stored_at < self._ttl
+
+    def put(self, url: str, response: requests.Response):
+        """Store the response and evict the least recently used responses if the cache gets too large."""
+        body = response.content
+        now = time()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (url, response.status_code, json.dumps(dict(response.headers)), body, len(body),
+                                      now, now))
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self._max_size:
+                rows = self._connection.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall()
+                for evict_url, size in rows:
+                    if total_size <= self._max_size:
+                        break
+                    self._connection.execute("DELETE FROM responses WHERE url = ?", (evict_url,))
+                    total_size -= size
+                logger.debug("Evicted responses. Cache size is now {} bytes.".format(total_size))
+
+    def refresh(self, url: str):
+        """Mark the cached response for the url as fresh, after it was revalidated."""
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE responses SET stored_at = ? WHERE url = ?", (time(), url))
+
+
+def get_http_cache() -> Optional[HttpCache]:
+    """Return the http cache of this process or None if no http cache is configured."""
+    global _http_cache
+    main = CONFIG["main"]
+    if "http_cache_file" not in main:
+        return None
+    # A sqlite connection must not be used in a forked process.
+    if _http_cache is None or _http_cache[0] != os.getpid():
+        cache = HttpCache(main["http_cache_file"], main.getint("http_cache_ttl", DEFAULT_TTL),
+                          main.getint("http_cache_max_size", DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+        _http_cache = (os.getpid(), cache)
+    return _http_cache[1]
@@ -0,0 +1,348 @@
+"""Module for the backends counting the blank, comment and code lines of a repository."""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from multiprocessing.pool import AsyncResult, Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+from . import CONFIG
+from .deadlines import Deadline, run_process
+
+logger: logging.Logger = logging.getLogger("counter")
+
+DEFAULT_COUNTER = "native"
+MIN_FILES_FOR_POOL = 64
+POOL_CHUNK_SIZE = 16
+
+STRING_PATTERNS = {
+    "double": r'"(?:\\.|[^"\\])*"',
+    "single": r"'(?:\\.|[^'\\])*'",
+    "backtick": r"`[^`]*`",
+}
+
+
+class Language:
+    """The comment rules of a language, as far as they are needed for counting lines."""
+
+    def __init__(self, name: str, extensions: List[str], line_comments: List[str],
+                 block_comments: Dict[str, str], strings: List[str],
+                 line_blocks: Optional[Tuple[str, str]] = None):
+        """
+        Init.
+
+        block_comments maps the start of a block comment to its end.
+        line_blocks is a pair of regexes matching the first and last line of blocks of lines, which are comments as a
+        whole (like perl's POD).
+        """
+        self.name = name
+        self.extensions = extensions
+        self.block_comments = block_comments
+        # Longer delimiters first, so e.g. '--[[' wins against '--'
+        groups = {
+            "block": [re.escape(b) for b in sorted(block_comments, key=len, reverse=True)],
+            "line": [re.escape(c) for c in line_comments],
+            "string": [STRING_PATTERNS[s] for s in strings],
+        }
+        self.token_regex: Pattern = re.compile("|".join("(?P<{}>{})".format(group, "|".join(patterns))
+                                                        for group, patterns in groups.items() if patterns))
+        self.line_block_start: Optional[Pattern] = None
+        self.line_block_end: Optional[Pattern] = None
+        if line_blocks is not None:
+            self.line_block_start = re.compile(line_blocks[0])
+            self.line_block_end = re.compile(line_blocks[1])
+
+
+C_STYLE_BLOCKS = {"/*": "*/"}
+
+LANGUAGES: Dict[str, Language] = {language.name: language for language in [
+    Language("Java", [".java"], ["//"], C_STYLE_BLOCKS, ["double", "single"]),
+    Language("Python", [".py", ".pyw", ".pyi"], ["#"], {'"""': '"""', "'''": "'''"}, ["double", "single"]),
+    Language("C++", [".cpp", ".cc", ".cxx", ".c++", ".cp", ".hpp", ".hh", ".hxx", ".h++", ".inl", ".ipp", ".tcc"],
+             ["//"], C_STYLE_BLOCKS, ["double", "single"]),
+    Language("Go", [".go"], ["//"], C_STYLE_BLOCKS, ["double", "single", "backtick"]),
+    Language("Lua", [".lua"], ["--"], {"--[[": "]]", "--[=[": "]=]", "--[==[": "]==]"}, ["double", "single"]),
+    Language("Perl", [".pl", ".pm", ".perl", ".plh", ".plx"], ["#"], {}, ["double", "single"],
+             line_blocks=(r"^=\w+", r"^=cut\b")),
+    Language("PHP", [".php", ".php3", ".php4", ".php5", ".phtml"], ["//", "#"], C_STYLE_BLOCKS, ["double", "single"]),
+    Language("Ruby", [".rb", ".rake", ".gemspec"], ["#"], {}, ["double", "single"],
+             line_blocks=(r"^=begin\b", r"^=end\b")),
+    Language("JavaScript", [".js", ".mjs", ".cjs"], ["//"], C_STYLE_BLOCKS, ["double", "single", "backtick"]),
+    Language("Objective-C", [".m"], ["//"], C_STYLE_BLOCKS, ["double", "single"]),
+]}
+EXTENSION_LANGUAGES: Dict[str, str] = {extension: language.name for language in LANGUAGES.values()
+                                       for extension in language.extensions}
+ALL_EXTENSIONS = tuple(EXTENSION_LANGUAGES)
+
+
+def get_language_of(path: str) -> Optional[str]:
+    """Return the name of the language of the file by its extension or None if it is in no known language."""
+    filename = os.path.basename(path).lower()
+    dot = filename.rfind(".")
+    return None if dot < 0 else EXTENSION_LANGUAGES.get(filename[dot:])
+
+
+def count_lines(text: str, language: Language) -> Tuple[int, int, int]:
+    """Return the number of blank, comment and code lines of the given source text."""
+    blank = comment = code = 0
+    block_end: Optional[str] = None
+    in_line_block = False
+    for line in text.splitlines():
+        if not line.strip():
+            blank += 1
+            continue
+        if in_line_block:
+            comment += 1
+            in_line_block = not language.line_block_end.match(line)
+            continue
+        if block_end is None and language.line_block_start is not None and language.line_block_start.match(line):
+            comment += 1
+            in_line_block = not language.line_block_end.match(line)
+            continue
+
+        has_code = False
+        pos = 0
+        while pos < len(line):
+            if block_end is not None:
+                end = line.find(block_end, pos)
+                if end < 0:
+                    break
+                pos = end + len(block_end)
+                block_end = None
+                continue
+            match = language.token_regex.search(line, pos)
+            if match is None:
+                has_code = has_code or bool(line[pos:].strip())
+                break
+            has_code = has_code or bool(line[pos:match.start()].strip())
+            if match.lastgroup == "line":
+                break
+            if match.lastgroup == "block":
+                block_end = language.block_comments[match.group()]
+            else:
+                has_code = True
+            pos = match.end()
+        if has_code:
+            code += 1
+        else:
+            comment += 1
+    return blank, comment, code
+
+
+def count_content(content: bytes, language_name: str) -> Tuple[str, int, int, int]:
+    """Return the md5 digest of the content and the number of blank, comment and code lines in it."""
+    digest = hashlib.md5(content).hexdigest()
+    blank, comment, code = count_lines(content.decode("utf-8", errors="replace"), LANGUAGES[language_name])
+    return digest, blank, comment, code
+
+
+def _count_file(filepath: str, language_name: str) -> Tuple[str, int, int, int]:
+    with open(filepath, "rb") as f:
+        return count_content(f.read(), language_name)
+
+
+def _count_contents(contents: List[bytes], language_name: str) -> List[Tuple[str, int, int, int]]:
+    return [count_content(content, language_name) for content in contents]
+
+
+class LocCounter:
+    """Base class of the backends counting the lines of code in a directory."""
+
+    NAME = ""
+    SUPPORTS_BLOBS = False
+
+    def count_directory(self, directory: str, deadline: Optional[Deadline] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Count the lines of code of all languages in the directory in a single pass.
+
+        Returns the result of every (cloc) language with files in the format of cloc's json output for a single
+        language. Raises StageTimeout if the counting runs past the deadline.
+        """
+        raise NotImplementedError()
+
+    def count_blobs(self, contents: Iterable[bytes], language: str,
+                    deadline: Optional[Deadline] = None) -> Optional[Dict[str, int]]:
+        """
+        Count the given file contents of the language. Only supported if SUPPORTS_BLOBS is True.
+
+        Returns the result in the format of cloc's json output for a single language or None if there are no contents.
+        """
+        raise NotImplementedError()
+
+
+class ClocCounter(LocCounter):
+    """Counter running the cloc executable."""
+
+    NAME = "cloc"
+    CLOC_EXECUTABLE = "cloc"
+    # Entries of the json output of cloc, which are not languages
+    NON_LANGUAGE_ENTRIES = ["header", "SUM"]
+
+    def count_directory(self, directory: str, deadline: Optional[Deadline] = None) -> Dict[str, Dict[str, int]]:
+        """See overridden."""
+        cloc_output = run_process(
+            [self.CLOC_EXECUTABLE, directory,
+             "--json"],  # "--quiet"
+            deadline)
+        if len(cloc_output) < 1:
+            return {}
+        try:
+            output = json.loads(cloc_output)
+        except json.decoder.JSONDecodeError as e:
+            raise ValueError("Output cannot be parsed as json. Cloc output is: {}".format(cloc_output)) from e
+        logger.debug("Got cloc output:{}".format(output))
+        return {language: counts for language, counts in output.items() if language not in self.NON_LANGUAGE_ENTRIES}
+
+
+class NativeCounter(LocCounter):
+    """Counter counting the lines in python, distributing the files over a process pool."""
+
+    NAME = "native"
+    SUPPORTS_BLOBS = True
+
+    def __init__(self, processes: int):
+        """Init."""
+        self._processes = processes
+
+    def _can_use_pool(self) -> bool:
+        """Return whether to count in a process pool. Daemonic processes (like celery's prefork children) can't."""
+        return self._processes > 1 and not multiprocessing.current_process().daemon
+
+    @contextmanager
+    def _create_pool(self) -> Iterator[Pool]:
+        """
+        Yield a process pool for a single count.
+
+        Every count has its own pool, so the concurrent tasks of a worker with the threads pool don't share one. The
+        pool is terminated on leaving, so after a timeout no process keeps counting.
+        """
+        pool = Pool(self._processes)
+        try:
+            yield pool
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _wait(result: AsyncResult, deadline: Optional[Deadline]) -> list:
+        """Return the result of the pool. Raises StageTimeout if it is not done by the deadline."""
+        try:
+            return result.get(None if deadline is None else deadline.remaining())
+        except multiprocessing.TimeoutError:
+            logger.warning("Counting exceeded the deadline. Terminating the process pool.")
+            raise deadline.exceeded()
+
+    def find_files(self, directory: str) -> List[Tuple[str, str]]:
+        """Return the path and the language of all files in a known language below the directory."""
+        result = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            if ".git" in dirnames:
+                dirnames.remove(".git")
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                language = get_language_of(filename)
+                if language is not None and os.path.isfile(filepath):
+                    result.append((filepath, language))
+        return result
+
+    def count_files(self, filepaths: List[str], languages: List[str],
+                    deadline: Optional[Deadline] = None) -> Iterator[Tuple[str, int, int, int]]:
+        """Return the digest and the number of blank, comment and code lines for each of the files in its language."""
+        if not self._can_use_pool() or len(filepaths) < MIN_FILES_FOR_POOL:
+            for filepath, language in zip(filepaths, languages):
+                if deadline is not None:
+                    deadline.check()
+                yield _count_file(filepath, language)
+            return
+        with self._create_pool() as pool:
+            yield from self._wait(pool.starmap_async(_count_file, zip(filepaths, languages), POOL_CHUNK_SIZE),
+                                  deadline)
+
+    def count_directory(self, directory: str, deadline: Optional[Deadline] = None) -> Dict[str, Dict[str, int]]:
+        """See overridden."""
+        files = self.find_files(directory)
+        filepaths = [filepath for filepath, _ in files]
+        languages = [language for _, language in files]
+        counts_per_language: Dict[str, List[Tuple[str, int, int, int]]] = {}
+        for language, counts in zip(languages, self.count_files(filepaths, languages, deadline)):
+            counts_per_language.setdefault(language, []).append(counts)
+        return {language: summarize(counts) for language, counts in counts_per_language.items()}
+
+    def count_contents(self, contents: Iterable[bytes], language: str,
+                       deadline: Optional[Deadline] = None) -> Iterator[Tuple[str, int, int, int]]:
+        """
+        Return the digest and the number of blank, comment and code lines for each of the file contents.
+
+        The counts are returned in the order of the contents, so callers can match them with the contents by position.
+        """
+        if language not in LANGUAGES:
+            raise ValueError("The native counter does not support the language {}".format(language))
+        if not self._can_use_pool():
+            for content in contents:
+                if deadline is not None:
+                    deadline.check()
+                yield count_content(content, language)
+            return
+        # Only keep a few chunks in flight, so the contents are not all in memory at the same time. The pool is only
+        # started once there is a full chunk.
+        with ExitStack() as stack:
+            pool: Optional[Pool] = None
+            pending = deque()
+            chunk = []
+            for content in contents:
+                chunk.append(content)
+                if len(chunk) < POOL_CHUNK_SIZE:
+                    continue
+                if pool is None:
+                    pool = stack.enter_context(self._create_pool())
+                pending.append(pool.apply_async(_count_contents, (chunk, language)))
+                chunk = []
+                if len(pending) > 2 * self._processes:
+                    yield from self._wait(pending.popleft(), deadline)
+            while pending:
+                yield from self._wait(pending.popleft(), deadline)
+            yield from _count_contents(chunk, language)  # The last partial chunk comes after all chunks in the pool
+
+    def count_blobs(self, contents: Iterable[bytes], language: str,
+                    deadline: Optional[Deadline] = None) -> Optional[Dict[str, int]]:
+        """See overridden."""
+        result = summarize(self.count_contents(contents, language, deadline))
+        if result["nFiles"] < 1:
+            return None
+        return result
+
+
+def summarize(counts: Iterable[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    """Sum up the per file counts like cloc does. Like cloc, files with identical content are only counted once."""
+    result = {"nFiles": 0, "blank": 0, "comment": 0, "code": 0}
+    seen_digests = set()
+    for digest, blank, comment, code in counts:
+        if digest in seen_digests:
+            continue
+        seen_digests.add(digest)
+        result["nFiles"] += 1
+        result["blank"] += blank
+        result["comment"] += comment
+        result["code"] += code
+    return result
+
+
+_counter: Optional[LocCounter] = None
+
+
+def get_counter() -> LocCounter:
+    """Return the counter configured with the counter option in the main section."""
+    global _counter
+    if _counter is None:
+        name = CONFIG["main"].get("counter", DEFAULT_COUNTER)
+        if name == "native":
+            _counter = NativeCounter(CONFIG["main"].getint("counter_processes", os.cpu_count() or 1))
+        elif name == "cloc":
+            _counter = ClocCounter()
+        else:
+            raise ValueError("Unknown counter: {}".format(name))
+    return _counter
@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
+import sys
+
 from . import setup
+from .analysis_cache import get_analysis_cache
+from .code_analyser import evaluate_analysis
+from .data_structure import AnalysisRepo
+from .loc_counter import get_counter
 from .master import Master
+from .result_store import create_result_store
 
 
 def main():
@@ -11,5 +18,43 @@ def main():
     master.start()
 
 
+def export_results():
+    """Export the results of the configured results backend into one json file per repo."""
+    if len(sys.argv) != 2:
+        print("Usage: {} <target directory>".format(sys.argv[0]))
+        exit(1)
+    setup()
+    create_result_store().export(sys.argv[1])
+
+
+def reevaluate_results():
+    """
+    Evaluate all results again from their counts of all languages, e.g. after changing minimum_code_lines.
+
+    Results without these counts are looked up in the analysis cache, if one is configured.
+    """
+    setup()
+    result_store = create_result_store()
+    analysis_cache = get_analysis_cache()
+    counter = get_counter().NAME
+    evaluated = changed = missing = 0
+    for result in list(result_store):
+        repo = result.get_repo()
+        full_analysis = result.get_full_analysis()
+        if full_analysis is None and analysis_cache is not None and isinstance(repo, AnalysisRepo):
+            full_analysis = analysis_cache.get(repo.get_remote_url(), repo.get_commit(), counter)
+        if full_analysis is None:
+            missing += 1
+            continue
+        new_result = evaluate_analysis(repo, full_analysis, result.get_blob_cache_stats(), result.get_metrics())
+        evaluated += 1
+        if new_result.is_success() != result.is_success():
+            changed += 1
+        result_store.add(new_result)
+    result_store.close()
+    print("Evaluated {} results again, {} changed their success. {} results have no counts of all languages.".format(
+        evaluated, changed, missing))
+
+
 if __name__ == "__main__":
     main()
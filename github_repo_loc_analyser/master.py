@@ -1,24 +1,57 @@
 """Module for the logic of the master node."""
 import logging
-from json import dump, load
-from os import path, mkdir
-from typing import List
-from time import sleep
+import socket
+from collections import Counter, deque
+from json import load
+from os import path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from statistics import median
+from time import sleep, time
 
 from celery.result import AsyncResult
-from celery.exceptions import TimeoutError
 
 from . import CONFIG
-from .data_structure import PossibleRepo, Result, Repo
+from .commit_resolver import CommitResolver
+from .data_structure import AnalysisRepo, PossibleRepo, Result, Repo
 from .github_api_querier import ApiQuerier
-from .helper import SerializableJsonDecoder, sanitize_filename
-from .helper import atmoic_write_file, SerializableJsonEncoder
-from .tasks import process_possible_repo
+from .metrics import Metrics, get_metrics, start_metrics_export
+from .profiling import PROFILE_HEADER, PROFILER_CPROFILE
+from .helper import SerializableJsonDecoder
+from .repo_list import RepoList
+from .result_store import create_result_store, get_key
+from .scheduling import DispatchBuffer, ORDER_LARGEST_FIRST, SizeClass, parse_size_classes
+from .tasks import app, process_possible_repo, process_possible_repos
+from .tracing import SPAN_BUFFER, SPAN_DISCOVER, SPAN_STORE, TRACE_HEADER, get_tracer, new_trace_id, span
 
 logger: logging.Logger = logging.getLogger("master")
 
-REPOS_FILENAME = "repos.json"
-RESULTS_DIRNAME = "results"
+REPOS_FILENAME = "repos.jsonl"
+LEGACY_REPOS_FILENAME = "repos.json"
+COMMITS_FILENAME = "commits.jsonl"
+DEFAULT_COMMIT_RESOLUTION_BATCH_SIZE = 50
+RESULT_WAIT_TIMEOUT = 1  # seconds
+DEFAULT_MAX_BATCH_SIZE = 20
+DEFAULT_TARGET_BATCH_SECONDS = 60
+# Weight of the latest batch in the moving average of the seconds per repo
+REPO_SECONDS_SMOOTHING = 0.3
+DEFAULT_DISPATCH_BUFFER_SIZE = 100
+DEFAULT_SPECULATIVE_FACTOR = 3
+TASK_SECONDS_SAMPLES = 100
+MIN_TASK_SECONDS_SAMPLES = 10
+DISPATCH_RATE_WINDOW = 60  # seconds
+
+
+class DispatchedTask:
+    """The bookkeeping of a task in flight."""
+
+    def __init__(self, queue: str, repos: List[Repo], batch: bool):
+        """Init."""
+        self.queue = queue
+        self.repos = repos
+        self.batch = batch
+        self.dispatched_at = time()
+        # The id of the speculative copy of this task or of the task this is a copy of
+        self.twin: Optional[str] = None
 
 
 class Master:
@@ -28,72 +61,320 @@ class Master:
         """Init."""
         data_dir = CONFIG["main"]["data_dir"]
         self._repos_file = path.join(data_dir, REPOS_FILENAME)
-        self._results_dir = path.join(data_dir, RESULTS_DIRNAME)
-        self._min_tasks_in_queue = CONFIG["main"].getint("min_tasks_in_queue")
+        self._legacy_repos_file = path.join(data_dir, LEGACY_REPOS_FILENAME)
+        self._commits_file = path.join(data_dir, COMMITS_FILENAME)
         self._max_tasks_in_queue = CONFIG["main"].getint("max_tasks_in_queue")
-        if not path.exists(self._results_dir):
-            mkdir(self._results_dir)
-        self._waiting_for_results_for = []
-
-    def create_repos_file(self):
-        """Query the GH Api to create the repos file."""
-        logger.info("Creating repos file.")
-        api = ApiQuerier()
-        possible_repos = api.get_repos()
-        logger.debug("Atomic write repos file...")
-        atmoic_write_file(self._repos_file, lambda f: dump(possible_repos, f, indent="  ", cls=SerializableJsonEncoder))
-
-    def get_filepath_for_repo(self, repo: Repo):
-        """Get the filepath for the data for the given repo."""
-        filename = sanitize_filename(repo.get_name(), repo.get_language()) + ".json"
-        return path.join(self._results_dir, filename)
+        self._resolve_commits = CONFIG["main"].getboolean("resolve_commits_on_master", True)
+        self._commit_resolution_batch_size = CONFIG["main"].getint("commit_resolution_batch_size",
+                                                                   DEFAULT_COMMIT_RESOLUTION_BATCH_SIZE)
+        self._result_store = create_result_store()
+        self._in_flight: Dict[str, AsyncResult] = {}
+        self._completed: Deque[AsyncResult] = deque()
+        self._batch_tasks = CONFIG["main"].getboolean("batch_tasks", False)
+        self._max_batch_size = CONFIG["main"].getint("max_batch_size", DEFAULT_MAX_BATCH_SIZE)
+        self._target_batch_seconds = CONFIG["main"].getfloat("target_batch_seconds", DEFAULT_TARGET_BATCH_SECONDS)
+        self._repo_seconds: Optional[float] = None
+        if "size_classes" in CONFIG["main"]:
+            self._size_classes = parse_size_classes(CONFIG["main"]["size_classes"])
+        else:
+            self._size_classes = [SizeClass(app.conf.task_default_queue, None)]
+        self._dispatch_order = CONFIG["main"].get("dispatch_order", ORDER_LARGEST_FIRST)
+        self._dispatch_buffer_size = max(CONFIG["main"].getint("dispatch_buffer_size", DEFAULT_DISPATCH_BUFFER_SIZE),
+                                         self._max_batch_size if self._batch_tasks else 1)
+        self._dispatched: Dict[str, DispatchedTask] = {}
+        self._tasks_per_queue: Counter = Counter()
+        self._speculative_retry = CONFIG["main"].getboolean("speculative_retry", False)
+        self._speculative_factor = CONFIG["main"].getfloat("speculative_factor", DEFAULT_SPECULATIVE_FACTOR)
+        self._task_seconds: Deque[float] = deque(maxlen=TASK_SECONDS_SAMPLES)
+        self._buffer = DispatchBuffer(self._size_classes, self._dispatch_order)
+        self._api: Optional[ApiQuerier] = None
+        self._dispatch_times: Deque[float] = deque()
+        self._metrics = get_metrics()
+        self._metrics.add_collector(self.collect_metrics)
+        profile_repos = CONFIG["main"].get("profile_repos", "")
+        self._profile_repos = {name.strip() for name in profile_repos.split(",") if name.strip()}
+        self._profiler = CONFIG["main"].get("profiler", PROFILER_CPROFILE)
+        self._tracer = get_tracer()
+        # The trace id and the time it was buffered of every traced repo, which has no result yet
+        self._traces: Dict[str, Tuple[str, float]] = {}
+        # Backends with a result consumer (like rpc://) push the results, others have to be polled.
+        self._event_driven = hasattr(app.backend, "result_consumer")
+
+    def discover_repos(self) -> Iterator[PossibleRepo]:
+        """Yield the repos as soon as they are discovered. Continues an interrupted discovery."""
+        if path.exists(self._legacy_repos_file) and not path.exists(self._repos_file):
+            logger.info("Loading legacy repos file")
+            with open(self._legacy_repos_file) as f:
+                yield from load(f, cls=SerializableJsonDecoder)
+            return
+        yield from RepoList(self._repos_file).discover(self.get_api())
+
+    def get_api(self) -> ApiQuerier:
+        """Return the api querier of the master, which is shared by the discovery and the commit resolution."""
+        if self._api is None:
+            self._api = ApiQuerier()
+        return self._api
+
+    def with_commits(self, resolved: Iterable[Tuple[PossibleRepo, Optional[str]]]) -> Iterator[AnalysisRepo]:
+        """Turn the resolved repos into analysis repos. Stores a failed result for the ones without commit."""
+        for repo, commit in resolved:
+            if commit is None:
+                self.store_result(Result(repo, sucess=False, failure_reason="Could not find a usable commit."))
+                continue
+            yield AnalysisRepo(repo.get_name(), repo.get_language(), repo.is_old_repo(), repo.get_remote_url(), commit,
+                               repo.get_size())
 
     def start(self):
         """Start the master."""
-        if not path.exists(self._repos_file):
-            self.create_repos_file()
-        logger.info("Loading repos file")
-        with open(self._repos_file) as f:
-            repos: List[PossibleRepo] = load(f, cls=SerializableJsonDecoder)
+        start_metrics_export()
+        repos_to_process = (repo for repo in self.discover_repos() if not self._result_store.contains(repo))
+        if self._resolve_commits:
+            resolver = CommitResolver(self._commits_file, self.get_api(), self._commit_resolution_batch_size)
+            repos_to_process = self.with_commits(resolver.resolve(repos_to_process))
+        if self._tracer is not None:
+            repos_to_process = self.trace_discovery(repos_to_process)
+
+        buffer = self._buffer
+        try:
+            for repo in repos_to_process:
+                buffer.add(repo)
+                # Collect without waiting, so the slots of completed tasks are refilled while the discovery goes on.
+                self.collect_completed(0)
+                self.process_completed_results()
+                self.dispatch_buffered(buffer)
+                while len(buffer) >= self._dispatch_buffer_size:
+                    self.wait_for_results()
+                    self.dispatch_buffered(buffer)
+
+            while buffer or self._in_flight:
+                self.dispatch_buffered(buffer)
+                if not buffer and self._speculative_retry:
+                    self.dispatch_speculative()
+                self.wait_for_results()
+        finally:
+            # Commit the pending results also when interrupted, e.g. by Ctrl+C.
+            self._result_store.close()
+
+    def dispatch_buffered(self, buffer: DispatchBuffer):
+        """Dispatch buffered repos to every queue with less than max_tasks_in_queue tasks in flight."""
+        for queue in buffer.get_queues():
+            while self._tasks_per_queue[queue] < self._max_tasks_in_queue:
+                # While a slot is free, a partial batch is sent instead of letting the workers idle.
+                repos = buffer.pop(queue, self.get_batch_size() if self._batch_tasks else 1)
+                if not repos:
+                    break
+                self.trace_dispatch(repos)
+                if self._batch_tasks:
+                    self.dispatch_batch(repos, queue)
+                else:
+                    self.dispatch(repos[0], queue)
+
+    def dispatch(self, repo: Repo, queue: str) -> str:
+        """Send a task for the repo to the queue and register for its result. Return the id of the task."""
+        logger.info("Delegating task for repo {} to queue {}".format(repo.get_name(), queue))
+        return self._register(process_possible_repo.apply_async((repo,), queue=queue,
+                                                                headers=self.get_task_headers([repo])),
+                              DispatchedTask(queue, [repo], False))
+
+    def dispatch_batch(self, repos: List[Repo], queue: str) -> str:
+        """Send a single task for all the repos to the queue and register for its result. Return the id of the task."""
+        logger.info("Delegating task for {} repos to queue {}".format(len(repos), queue))
+        return self._register(process_possible_repos.apply_async((repos,), queue=queue,
+                                                                 headers=self.get_task_headers(repos)),
+                              DispatchedTask(queue, repos, True))
+
+    def get_task_headers(self, repos: List[Repo]) -> Dict[str, Any]:
+        """Return the headers of the task with the trace ids and a profile request, if a repo is in profile_repos."""
+        headers: Dict[str, Any] = {}
+        if any(repo.get_name() in self._profile_repos for repo in repos):
+            headers[PROFILE_HEADER] = self._profiler
+        if self._tracer is not None:
+            headers[TRACE_HEADER] = [self._traces.get(get_key(repo), (None,))[0] for repo in repos]
+        return headers
+
+    def trace_discovery(self, repos: Iterator[Repo]) -> Iterator[Repo]:
+        """Give every repo a trace id and record the time it took to discover it."""
+        while True:
+            start = time()
+            try:
+                repo = next(repos)
+            except StopIteration:
+                return
+            trace_id = new_trace_id()
+            self._traces[get_key(repo)] = (trace_id, time())
+            self._tracer.record(trace_id, SPAN_DISCOVER, start, time(), repo=repo.get_name())
+            yield repo
 
+    def trace_dispatch(self, repos: List[Repo]):
+        """Record the time the repos waited in the dispatch buffer."""
+        if self._tracer is None:
+            return
+        now = time()
         for repo in repos:
-            filepath = self.get_filepath_for_repo(repo)
-            logger.debug("Looking at repo {}. Filename: {}".format(repo.get_name(), filepath))
-            if path.exists(filepath):
-                logger.debug("File exists")
+            trace = self._traces.get(get_key(repo))
+            if trace is not None:
+                self._tracer.record(trace[0], SPAN_BUFFER, trace[1], now, repo=repo.get_name())
+
+    def _register(self, r: AsyncResult, task: DispatchedTask) -> str:
+        self._in_flight[r.id] = r
+        self._dispatched[r.id] = task
+        self._tasks_per_queue[task.queue] += 1
+        self._dispatch_times.append(task.dispatched_at)
+        self._metrics.inc("tasks_dispatched_total", "Dispatched tasks.", queue=task.queue)
+        self._metrics.inc("repos_dispatched_total", "Dispatched repos.", len(task.repos), queue=task.queue)
+        if self._event_driven:
+            r.then(self._completed.append)
+        return r.id
+
+    def _unregister(self, task_id: str) -> Optional[DispatchedTask]:
+        if self._in_flight.pop(task_id, None) is None:
+            return None
+        task = self._dispatched.pop(task_id)
+        self._tasks_per_queue[task.queue] -= 1
+        return task
+
+    def dispatch_speculative(self):
+        """
+        Send a copy of every task, which runs speculative_factor times longer than the median task, to its queue.
+
+        Whichever copy completes first is used. Only done for queues with free slots, i.e. once the queue drained.
+        """
+        if len(self._task_seconds) < MIN_TASK_SECONDS_SAMPLES:
+            return
+        threshold = self._speculative_factor * median(self._task_seconds)
+        now = time()
+        for task_id, task in list(self._dispatched.items()):
+            if task.twin is not None or now - task.dispatched_at < threshold:
                 continue
+            if self._tasks_per_queue[task.queue] >= self._max_tasks_in_queue:
+                continue
+            logger.info("Task {} runs for {:.0f} seconds. Dispatching a speculative copy.".format(
+                task_id, now - task.dispatched_at))
+            if task.batch:
+                twin_id = self.dispatch_batch(task.repos, task.queue)
+            else:
+                twin_id = self.dispatch(task.repos[0], task.queue)
+            task.twin = twin_id
+            self._dispatched[twin_id].twin = task_id
+
+    def get_batch_size(self) -> int:
+        """Return the number of repos for the next batch, so it takes about target_batch_seconds."""
+        if self._repo_seconds is None:
+            return 1  # Measure with a single repo first
+        size = int(self._target_batch_seconds / max(self._repo_seconds, 0.001))
+        return max(1, min(self._max_batch_size, size))
+
+    def wait_for_results(self):
+        """Wait until at least one task completed or a timeout passed and process the completed results."""
+        self.collect_completed(RESULT_WAIT_TIMEOUT)
+        self.process_completed_results()
 
-            logger.info("Delegating task for repo {}".format(repo.get_name()))
-            r = process_possible_repo.delay(repo)
-            self._waiting_for_results_for.append(r)
-            if len(self._waiting_for_results_for) > self._min_tasks_in_queue:
-                oldest_result = self._waiting_for_results_for[0]
-                try:
-                    self.process_result(oldest_result)
-                except TimeoutError:
-                    pass
-            index = 0
-            while len(self._waiting_for_results_for) > self._max_tasks_in_queue:
-                result_to_get = self._waiting_for_results_for[index]
-                try:
-                    self.process_result(result_to_get)
-                except TimeoutError:
-                    pass
-                index = (index + 1) % len(self._waiting_for_results_for)
-
-        for item in self._waiting_for_results_for:
-            self.process_result(item)
+    def collect_completed(self, timeout: float):
+        """Collect the tasks, which completed so far. Waits up to timeout seconds, if none completed."""
+        if self._completed or not self._in_flight:
+            return
+        if self._event_driven:
+            try:
+                app.backend.result_consumer.drain_events(timeout=timeout)
+            except socket.timeout:
+                pass
+        else:
+            self._completed.extend(r for r in self._in_flight.values() if r.ready())
+            if not self._completed and timeout > 0:
+                sleep(timeout)
+
+    def process_completed_results(self):
+        """Process the results of all tasks, which completed so far."""
+        while self._completed:
+            self.process_result(self._completed.popleft())
+        # Also without new results, so results stored a while ago are committed after the commit interval.
+        self._result_store.flush_if_due()
 
     def process_result(self, result: AsyncResult):
-        """Process the result of a process possible repo task."""
-        analysis_result: Result = result.get(timeout=1)
-        self._waiting_for_results_for.remove(result)
+        """Process the result of a process possible repo(s) task."""
+        task = self._unregister(result.id)
+        if task is None:
+            return  # Already processed or a speculative copy, which lost
+        try:
+            value = result.get()
+        except Exception:
+            logger.exception("Task {} failed. Ignoring".format(result.id))
+            self.end_traces(task)
+            return
+        self._task_seconds.append(time() - task.dispatched_at)
+        self._metrics.observe("task_seconds", "Seconds from dispatching a task until its result arrived.",
+                              time() - task.dispatched_at, queue=task.queue)
+        if task.twin is not None and self._unregister(task.twin) is not None:
+            logger.debug("Revoking the other copy {} of task {}".format(task.twin, result.id))
+            app.control.revoke(task.twin)
+        if isinstance(value, dict):
+            self.process_batch_result(value, task)
+        else:
+            self.process_analysis_result(value, task)
+        self.end_traces(task)
+
+    def end_traces(self, task: DispatchedTask):
+        """Forget the traces of the repos of the task, which is done."""
+        for repo in task.repos:
+            self._traces.pop(get_key(repo), None)
+
+    def process_batch_result(self, batch_result: Dict, task: Optional[DispatchedTask] = None):
+        """Process the results of a process possible repos task and update the seconds per repo."""
+        results = batch_result["results"]
+        if results:
+            repo_seconds = batch_result["seconds"] / len(results)
+            if self._repo_seconds is None:
+                self._repo_seconds = repo_seconds
+            else:
+                self._repo_seconds += REPO_SECONDS_SMOOTHING * (repo_seconds - self._repo_seconds)
+            logger.debug("Seconds per repo: {:.1f}. Next batch size: {}".format(self._repo_seconds,
+                                                                                self.get_batch_size()))
+        for analysis_result in results:
+            self.process_analysis_result(analysis_result, task)
+
+    def process_analysis_result(self, analysis_result: Optional[Result], task: Optional[DispatchedTask] = None):
+        """Store the result of a single repo."""
         if analysis_result is None:
-            logger.warn("Got None result. Ignoring")
+            logger.warning("Got None result. Ignoring")
             return  # Error occurred. Don't save anything
+        self.record_result_metrics(analysis_result, task)
         logger.debug("Got some result.")
         repo = analysis_result.get_repo()
-        logger.info("Got result for {}".format(repo.get_name()))
-        filepath = self.get_filepath_for_repo(repo)
-        logger.debug("Atomically writing result for {}".format(repo.get_name()))
-        atmoic_write_file(filepath, lambda f: dump(analysis_result, f, indent="  ", cls=SerializableJsonEncoder))
+        with span(self._traces.get(get_key(repo), (None,))[0], SPAN_STORE, repo=repo.get_name()):
+            self.store_result(analysis_result)
+
+    def store_result(self, analysis_result: Result):
+        """Add the result to the result store."""
+        logger.info("Got result for {}".format(analysis_result.get_repo().get_name()))
+        self._result_store.add(analysis_result)
+
+    def record_result_metrics(self, analysis_result: Result, task: Optional[DispatchedTask]):
+        """Add the measurements of the worker in the result to the metrics."""
+        self._metrics.inc("results_total", "Received results.", success=str(analysis_result.is_success()).lower())
+        result_metrics = analysis_result.get_metrics()
+        if result_metrics is None:
+            return
+        if task is not None:
+            self._metrics.observe("queue_wait_seconds", "Seconds from dispatching a repo until a worker started it.",
+                                  max(0.0, result_metrics["started_at"] - task.dispatched_at), queue=task.queue)
+        for stage, seconds in result_metrics["timings"].items():
+            self._metrics.observe("stage_seconds", "Seconds spent in the stages of processing a repo.", seconds,
+                                  stage=stage)
+        for name, value in result_metrics["counts"].items():
+            self._metrics.inc("repo_{}_total".format(name), "Sum of {} over all repos.".format(name), value)
+
+    def collect_metrics(self, metrics: Metrics):
+        """Update the gauges of the master."""
+        now = time()
+        while self._dispatch_times and self._dispatch_times[0] < now - DISPATCH_RATE_WINDOW:
+            self._dispatch_times.popleft()
+        metrics.set("dispatch_rate", "Dispatched tasks per second over the last minute.",
+                    len(self._dispatch_times) / DISPATCH_RATE_WINDOW)
+        for size_class in self._size_classes:
+            metrics.set("tasks_in_flight", "Tasks, which were dispatched, but have no result yet.",
+                        self._tasks_per_queue[size_class.queue], queue=size_class.queue)
+        metrics.set("repos_buffered", "Repos waiting for a free slot to be dispatched.", len(self._buffer))
+        if self._api is not None:
+            for bucket, remaining in self._api.get_rate_limit_headroom().items():
+                metrics.set("rate_limit_remaining", "Known remaining GitHub API budget per token and resource.",
+                            remaining, bucket=bucket)
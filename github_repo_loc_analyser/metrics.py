@@ -0,0 +1,206 @@
+"""Module for collecting metrics and exposing them in the Prometheus text format."""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import CONFIG
+from .helper import atmoic_write_file
+from .tracing import span
+
+logger: logging.Logger = logging.getLogger("metrics")
+
+METRICS_PREFIX = "grla_"
+DEFAULT_METRICS_INTERVAL = 15  # seconds
+
+COUNTER = "counter"
+GAUGE = "gauge"
+SUMMARY = "summary"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_metrics: Optional[Tuple[int, "Metrics"]] = None
+
+
+class TaskMetrics:
+    """The durations of the stages and other measurements of processing a single repo."""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        """Init. With a trace id, the stages are also recorded as spans of the trace."""
+        self.started_at = time()
+        self.trace_id = trace_id
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Add the duration of the context to the timing of the stage."""
+        start = perf_counter()
+        try:
+            with span(self.trace_id, stage):
+                yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + perf_counter() - start
+
+    def count(self, name: str, value: int):
+        """Add the value to the count with the name."""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the metrics as they are stored in the result."""
+        return {"started_at": self.started_at, "timings": dict(self.timings), "counts": dict(self.counts)}
+
+
+class Metrics:
+    """
+    The metrics of this process: counters, gauges and summaries (count and sum of observations), all with labels.
+
+    Collectors are called before the metrics are rendered, so they can update gauges, which are expensive to keep
+    up to date all the time.
+    """
+
+    def __init__(self):
+        """Init."""
+        self._lock = threading.Lock()
+        self._types: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[Labels, List[float]]] = {}
+        self._collectors: List[Callable[["Metrics"], None]] = []
+
+    def _get(self, metric_type: str, name: str, description: str, labels: Dict[str, str]) -> List[float]:
+        name = METRICS_PREFIX + name
+        if name not in self._types:
+            self._types[name] = (metric_type, description)
+            self._values[name] = {}
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        return self._values[name].setdefault(key, [0.0, 0.0])
+
+    def inc(self, name: str, description: str, value: float = 1, **labels: str):
+        """Increase the counter."""
+        with self._lock:
+            self._get(COUNTER, name, description, labels)[0] += value
+
+    def set(self, name: str, description: str, value: float, **labels: str):
+        """Set the gauge."""
+        with self._lock:
+            self._get(GAUGE, name, description, labels)[0] = value
+
+    def observe(self, name: str, description: str, value: float, **labels: str):
+        """Add an observation to the summary."""
+        with self._lock:
+            summary = self._get(SUMMARY, name, description, labels)
+            summary[0] += 1
+            summary[1] += value
+
+    @contextmanager
+    def time(self, name: str, description: str, **labels: str) -> Iterator[None]:
+        """Observe the duration of the context in seconds."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, description, perf_counter() - start, **labels)
+
+    def add_collector(self, collector: Callable[["Metrics"], None]):
+        """Add a function, which is called before rendering to update the metrics."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception:
+                logger.exception("Metrics collector failed.")
+        lines = []
+        with self._lock:
+            for name, (metric_type, description) in sorted(self._types.items()):
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} {}".format(name, metric_type))
+                for labels, value in sorted(self._values[name].items()):
+                    if metric_type == SUMMARY:
+                        lines.append("{}_count{} {}".format(name, _format_labels(labels), value[0]))
+                        lines.append("{}_sum{} {}".format(name, _format_labels(labels), value[1]))
+                    else:
+                        lines.append("{}{} {}".format(name, _format_labels(labels), value[0]))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(label, value.replace('"', '\\"')) for label, value in labels) + "}"
+
+
+def get_metrics() -> Metrics:
+    """Return the metrics of this process."""
+    global _metrics
+    if _metrics is None or _metrics[0] != os.getpid():
+        _metrics = (os.getpid(), Metrics())
+    return _metrics[1]
+
+
+def _serve(metrics: Metrics, port: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    ThreadingHTTPServer(("", port), Handler).serve_forever()
+
+
+def _write_periodically(metrics: Metrics, filepath: str, interval: float):
+    while True:
+        sleep(interval)
+        try:
+            atmoic_write_file(filepath, lambda f: f.write(metrics.render()))
+        except ValueError:
+            logger.exception("Could not write the metrics file.")
+
+
+def start_metrics_export():
+    """
+    Expose the metrics of this process as configured in the main section.
+
+    With metrics_port, they are served over http. With metrics_file, they are written to the file every
+    metrics_interval seconds.
+    """
+    main = CONFIG["main"]
+    metrics = get_metrics()
+    if "metrics_port" in main:
+        port = main.getint("metrics_port")
+        logger.info("Serving metrics on port {}".format(port))
+        threading.Thread(target=_serve, args=(metrics, port), name="metrics-server", daemon=True).start()
+    if "metrics_file" in main:
+        interval = main.getfloat("metrics_interval", DEFAULT_METRICS_INTERVAL)
+        threading.Thread(target=_write_periodically, args=(metrics, main["metrics_file"], interval),
+                         name="metrics-writer", daemon=True).start()
+
+
+def start_worker_metrics_export():
+    """
+    Expose the metrics of this worker process as configured in the main section.
+
+    The processes of a worker have their own metrics, so with worker_metrics_dir every process writes them to its own
+    <host>-<pid>.prom file in the directory every metrics_interval seconds.
+    """
+    main = CONFIG["main"]
+    if "worker_metrics_dir" not in main:
+        return
+    directory = main["worker_metrics_dir"]
+    os.makedirs(directory, exist_ok=True)
+    filepath = os.path.join(directory, "{}-{}.prom".format(socket.gethostname(), os.getpid()))
+    interval = main.getfloat("metrics_interval", DEFAULT_METRICS_INTERVAL)
+    logger.info("Writing the metrics of this worker process to {}".format(filepath))
+    threading.Thread(target=_write_periodically, args=(get_metrics(), filepath, interval), name="metrics-writer",
+                     daemon=True).start()
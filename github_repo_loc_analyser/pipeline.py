@@ -0,0 +1,123 @@
+"""Module for the pipeline in the workers, which overlaps fetching and counting of different repos."""
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from queue import Queue
+from typing import Callable, Counter, Optional, Tuple, Union
+
+from . import CONFIG
+from .code_analyser import CodeAnalyzer
+from .data_structure import AnalysisRepo, PossibleRepo, Result
+from .profiling import get_task_samples, record_task_samples
+from .slave import Slave
+
+logger: logging.Logger = logging.getLogger("pipeline")
+
+DEFAULT_FETCH_WORKERS = 2
+DEFAULT_ANALYSE_WORKERS = 1
+DEFAULT_PREFETCH = 2
+
+_pipeline: Optional[Tuple[int, "Pipeline"]] = None
+
+
+class Pipeline:
+    """
+    Processes repos in three stages: resolving the commit, fetching it and counting the lines of code.
+
+    Every stage runs in its own threads and the stages are connected by queues. The queues after the resolve and the
+    fetch stage are bounded by prefetch, so at most that many fetched workspaces wait for the analysis. The stages only
+    overlap for repos submitted at the same time, i.e. the repos of a batch task or concurrent tasks of the threads
+    pool. Every exception, also SoftTimeLimitExceeded or SystemExit, is set on the future, so no task waits forever.
+    """
+
+    def __init__(self, fetch_workers: int, analyse_workers: int, prefetch: int):
+        """Init. Starts the threads of the stages."""
+        self._resolve_queue: Queue = Queue()
+        self._fetch_queue: Queue = Queue(maxsize=prefetch)
+        self._analyse_queue: Queue = Queue(maxsize=prefetch)
+        self._start_threads("resolve", 1, self._resolve_queue, self._resolve)
+        self._start_threads("fetch", fetch_workers, self._fetch_queue, self._fetch)
+        self._start_threads("analyse", analyse_workers, self._analyse_queue, self._analyse)
+
+    @staticmethod
+    def _start_threads(name: str, num_threads: int, queue: Queue, stage: Callable):
+        def work():
+            while True:
+                stage(*queue.get())
+
+        for i in range(num_threads):
+            threading.Thread(target=work, name="pipeline-{}-{}".format(name, i), daemon=True).start()
+
+    def submit(self, repo: Union[PossibleRepo, AnalysisRepo], trace_id: Optional[str] = None) -> "Future[Result]":
+        """
+        Add the repo to the pipeline. The returned future gets the result or the exception of the processing.
+
+        If the calling task is sampled, the stages record their stacks into its samples.
+        """
+        future: Future = Future()
+        self._resolve_queue.put((repo, trace_id, future, get_task_samples()))
+        return future
+
+    def _resolve(self, repo: Union[PossibleRepo, AnalysisRepo], trace_id: Optional[str], future: Future,
+                 samples: Optional[Counter]):
+        slave = Slave(repo, trace_id)
+        try:
+            with record_task_samples(samples):
+                resolved = slave.resolve()
+                if not isinstance(resolved, Result):
+                    analyzer = CodeAnalyzer(resolved, slave.metrics)
+                    # A cached commit is neither fetched nor counted again.
+                    resolved = analyzer.get_cached_result() or analyzer
+        except BaseException as e:  # noqa: B036 - the future must be resolved
+            future.set_exception(e)
+            return
+        if isinstance(resolved, Result):
+            future.set_result(resolved)
+            return
+        self._fetch_queue.put((resolved, future, samples))
+
+    def _fetch(self, analyzer: CodeAnalyzer, future: Future, samples: Optional[Counter]):
+        try:
+            logger.info("Fetching repository {}".format(analyzer.repo.get_name()))
+            with record_task_samples(samples):
+                analyzer.fetch()
+        except BaseException as e:  # noqa: B036 - the future must be resolved
+            analyzer.close()
+            future.set_exception(e)
+            return
+        self._analyse_queue.put((analyzer, future, samples))
+
+    def _analyse(self, analyzer: CodeAnalyzer, future: Future, samples: Optional[Counter]):
+        try:
+            with record_task_samples(samples):
+                result = analyzer.analyse()
+            future.set_result(result)
+        except BaseException as e:  # noqa: B036 - the future must be resolved
+            future.set_exception(e)
+        finally:
+            analyzer.close()
+
+
+def get_min_concurrency() -> int:
+    """Return the number of concurrent tasks needed to keep every stage of the pipeline busy."""
+    main = CONFIG["main"]
+    # One repo is resolved, while the others are fetched, wait for the analysis or are analysed.
+    return sum([1, main.getint("pipeline_fetch_workers", DEFAULT_FETCH_WORKERS),
+                main.getint("pipeline_prefetch", DEFAULT_PREFETCH),
+                main.getint("pipeline_analyse_workers", DEFAULT_ANALYSE_WORKERS)])
+
+
+def get_pipeline() -> Optional[Pipeline]:
+    """Return the pipeline of this process or None if the pipeline is not enabled."""
+    global _pipeline
+    main = CONFIG["main"]
+    if not main.getboolean("pipeline", False):
+        return None
+    # Threads don't survive a fork, so every worker process needs its own pipeline.
+    if _pipeline is None or _pipeline[0] != os.getpid():
+        pipeline = Pipeline(main.getint("pipeline_fetch_workers", DEFAULT_FETCH_WORKERS),
+                            main.getint("pipeline_analyse_workers", DEFAULT_ANALYSE_WORKERS),
+                            main.getint("pipeline_prefetch", DEFAULT_PREFETCH))
+        _pipeline = (os.getpid(), pipeline)
+    return _pipeline[1]
@@ -0,0 +1,228 @@
+"""Module for profiling single tasks, so it can be seen where the time of a slow repo goes."""
+import cProfile
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from random import random
+from time import perf_counter, time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from . import CONFIG
+from .data_structure import Repo
+from .helper import sanitize_filename
+
+logger: logging.Logger = logging.getLogger("profiling")
+
+PROFILES_DIRNAME = "profiles"
+# The header of a task, which requests a profile of it with the given profiler
+PROFILE_HEADER = "grla_profile"
+PROFILER_CPROFILE = "cprofile"
+PROFILER_SAMPLING = "sampling"
+PROFILERS = [PROFILER_CPROFILE, PROFILER_SAMPLING]
+DEFAULT_PROFILE_INTERVAL = 0.01  # seconds
+DEFAULT_PROFILE_RETENTION = 100  # files
+SAMPLER_THREAD_NAME = "sampling-profiler"
+
+_sampler: Optional[Tuple[int, "SamplingProfiler"]] = None
+_sampler_lock = threading.Lock()
+# The samples of the task profiled in a thread
+_task = threading.local()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the registered threads of the process in a background thread.
+
+    Every task records into its own counter. With the pipeline the work of a task is done by the threads of the
+    pipeline, so these record into the counter of the task, while they work on one of its repos. The name of the thread
+    is the root frame of its stacks. The stacks are written in the folded format of flamegraph.pl.
+    """
+
+    def __init__(self, interval: float):
+        """Init."""
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._samples: Dict[int, Counter] = {}  # The counter of each registered thread
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start sampling."""
+        self._thread = threading.Thread(target=self._run, name=SAMPLER_THREAD_NAME, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        self._stop.set()
+        self._thread.join()
+
+    @contextmanager
+    def record(self, samples: Counter) -> Iterator[None]:
+        """Add the stacks of the current thread to samples in the context."""
+        ident = threading.get_ident()
+        with self._lock:
+            previous = self._samples.get(ident)
+            self._samples[ident] = samples
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is None:
+                    del self._samples[ident]
+                else:
+                    self._samples[ident] = previous
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                registered = dict(self._samples)
+            if not registered:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, samples in registered.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                samples[";".join(reversed(stack))] += 1
+
+
+def get_sampler() -> SamplingProfiler:
+    """Return the sampling profiler of this process, which is shared by all its tasks."""
+    global _sampler
+    with _sampler_lock:
+        # Threads don't survive a fork, so every worker process needs its own sampler.
+        if _sampler is None or _sampler[0] != os.getpid():
+            sampler = SamplingProfiler(CONFIG["main"].getfloat("profile_interval", DEFAULT_PROFILE_INTERVAL))
+            sampler.start()
+            _sampler = (os.getpid(), sampler)
+        return _sampler[1]
+
+
+def get_task_samples() -> Optional[Counter]:
+    """Return the samples of the task profiled in the current thread or None if it is not profiled."""
+    return getattr(_task, "samples", None)
+
+
+@contextmanager
+def record_task_samples(samples: Optional[Counter]) -> Iterator[None]:
+    """Add the stacks of the current thread to the samples of a task in the context, e.g. in a pipeline stage."""
+    if samples is None:
+        yield
+        return
+    with get_sampler().record(samples):
+        yield
+
+
+def _write_samples(samples: Counter, filepath: str):
+    """Write the sampled stacks with their counts to the file."""
+    with open(filepath, "w") as f:
+        f.writelines("{} {}\n".format(stack, count) for stack, count in samples.most_common())
+
+
+def _get_profiler(requested: Optional[str]) -> Optional[str]:
+    """Return the profiler for the task or None if it is not profiled."""
+    main = CONFIG["main"]
+    profiler = None
+    if requested is not None:
+        if requested in PROFILERS:
+            profiler = requested
+        else:
+            logger.warning("Ignoring unknown profiler {} requested by the task.".format(requested))
+    every = main.getint("profile_every", 0)
+    if profiler is None and every > 0 and random() < 1 / every:
+        profiler = main.get("profiler", PROFILER_CPROFILE)
+    if profiler == PROFILER_CPROFILE and main.getboolean("pipeline", False):
+        # cProfile only sees the thread of the task, but the pipeline does the work in its own threads.
+        logger.warning("Using the sampling profiler instead of cProfile, because the pipeline is enabled.")
+        profiler = PROFILER_SAMPLING
+    return profiler
+
+
+def _remove_old_profiles(directory: str, retention: int):
+    """Remove the oldest profiles, so at most retention are left."""
+    entries = []
+    for entry in os.scandir(directory):
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass  # Removed by another process
+    for _, filepath in sorted(entries)[:max(0, len(entries) - retention)]:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def _cprofile() -> Iterator[Callable[[str], None]]:
+    """Profile the current thread with cProfile in the context. Yields the function writing the profile."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler.dump_stats
+    finally:
+        profiler.disable()
+
+
+@contextmanager
+def _sample_task() -> Iterator[Callable[[str], None]]:
+    """Sample the current thread and the pipeline threads working for its task. Yields the function writing them."""
+    samples: Counter = Counter()
+    _task.samples = samples
+    try:
+        with get_sampler().record(samples):
+            yield partial(_write_samples, samples)
+    finally:
+        _task.samples = None
+
+
+@contextmanager
+def profile_task(repo: Repo, requested: Optional[str] = None) -> Iterator[None]:
+    """
+    Profile the processing of the repo in the context, if configured in the main section or requested.
+
+    1 in profile_every tasks and the tasks with the PROFILE_HEADER are profiled with the profiler given by the header
+    or by profiler (cprofile or sampling). With profile_threshold, all other tasks are profiled with the sampling
+    profiler, but only the ones taking longer than profile_threshold seconds are written. All tasks of a process share
+    one sampling profiler. The profiles are written to the profiles directory in data_dir, which keeps the latest
+    profile_retention files.
+    """
+    main = CONFIG["main"]
+    profiler_name = _get_profiler(requested)
+    threshold = 0.0
+    if profiler_name is None:
+        if "profile_threshold" not in main:
+            yield
+            return
+        profiler_name = PROFILER_SAMPLING
+        threshold = main.getfloat("profile_threshold")
+
+    if profiler_name == PROFILER_CPROFILE:
+        profiling, extension = _cprofile(), "pstats"
+    else:
+        profiling, extension = _sample_task(), "folded"
+    write: Optional[Callable[[str], None]] = None
+    start = perf_counter()
+    try:
+        with profiling as write:
+            yield
+    finally:
+        duration = perf_counter() - start
+        if write is not None and duration >= threshold:
+            directory = os.path.join(main["data_dir"], PROFILES_DIRNAME)
+            os.makedirs(directory, exist_ok=True)
+            filepath = os.path.join(directory, "{}-{}-{}.{}".format(
+                sanitize_filename(repo.get_name(), repo.get_language()), int(time()), os.getpid(), extension))
+            write(filepath)
+            logger.info("Wrote profile of {} ({:.1f} seconds) to {}".format(repo.get_name(), duration, filepath))
+            _remove_old_profiles(directory, main.getint("profile_retention", DEFAULT_PROFILE_RETENTION))
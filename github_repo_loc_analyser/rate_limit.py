@@ -0,0 +1,175 @@
+"""Module for coordinating the GitHub API rate limit budget between all querying processes."""
+import fcntl
+import json
+import logging
+import os
+import threading
+from time import sleep, time
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from . import CONFIG
+
+logger: logging.Logger = logging.getLogger("ratelimit")
+
+MIN_WAIT = 1  # seconds
+RESOURCE_CORE = "core"
+RESOURCE_SEARCH = "search"
+
+State = Dict[str, Dict[str, int]]
+
+_rate_limiter = None
+
+
+class RateLimiter:
+    """
+    Token bucket for the rate limit budget of every auth token and API resource.
+
+    The bucket of a token is refilled by GitHub at the reset time. Every request takes a token from the bucket
+    before it is sent and every response updates the bucket from its X-RateLimit headers. If more than one auth token is
+    configured, the request is sent with the token which has most of its budget left.
+    Subclasses define, where the state of the buckets is kept.
+    """
+
+    def __init__(self, num_tokens: int):
+        """Init."""
+        self._num_tokens = max(1, num_tokens)
+
+    def _modify_state(self, modifier: Callable[[State], Tuple[bool, Any]]) -> Any:
+        """Call modifier with the state under a lock. modifier returns whether the state changed and a result."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _key(token_index: int, resource: str) -> str:
+        return "{}/{}".format(token_index, resource)
+
+    def _take(self, state: State, resource: str) -> Tuple[bool, Tuple[Optional[int], float]]:
+        now = time()
+        best_index = None
+        best_remaining = -1
+        earliest_reset = None
+        for index in range(self._num_tokens):
+            bucket = state.get(self._key(index, resource))
+            if bucket is None or bucket["reset"] <= now:
+                # Budget is unknown or was refilled. The next response tells us the actual numbers.
+                state.pop(self._key(index, resource), None)
+                return True, (index, 0)
+            if bucket["remaining"] > best_remaining:
+                best_index = index
+                best_remaining = bucket["remaining"]
+            if earliest_reset is None or bucket["reset"] < earliest_reset:
+                earliest_reset = bucket["reset"]
+        if best_remaining > 0:
+            state[self._key(best_index, resource)]["remaining"] -= 1
+            return True, (best_index, 0)
+        return False, (None, earliest_reset - now)
+
+    def acquire(self, resource: str) -> int:
+        """Wait until there is budget for a request to the given resource and return the index of the token to use."""
+        while True:
+            token_index, to_wait = self._modify_state(lambda state: self._take(state, resource))
+            if token_index is not None:
+                return token_index
+            to_wait = max(MIN_WAIT, to_wait)
+            logger.warning("Rate limit budget for {} is exhausted. Waiting {:.0f} seconds.".format(resource, to_wait))
+            sleep(to_wait)
+
+    def _update(self, state: State, token_index: int, resource: str, remaining: int, reset: int) -> Tuple[bool, None]:
+        key = self._key(token_index, resource)
+        bucket = state.get(key)
+        if bucket is not None and bucket["reset"] == reset:
+            # Other requests might have taken from the bucket while this one was in flight.
+            remaining = min(remaining, bucket["remaining"])
+        state[key] = {"remaining": remaining, "reset": reset}
+        return True, None
+
+    def update(self, token_index: int, resource: str, headers: Mapping[str, str]):
+        """Update the budget of the token from the rate limit headers of a response."""
+        if "X-RateLimit-Remaining" not in headers or "X-RateLimit-Reset" not in headers:
+            return
+        resource = headers.get("X-RateLimit-Resource", resource)
+        remaining = int(headers["X-RateLimit-Remaining"])
+        reset = int(headers["X-RateLimit-Reset"])
+        self._modify_state(lambda state: self._update(state, token_index, resource, remaining, reset))
+
+    def _refund(self, state: State, token_index: int, resource: str) -> Tuple[bool, None]:
+        bucket = state.get(self._key(token_index, resource))
+        if bucket is None:
+            return False, None  # Nothing was taken from an unknown budget
+        bucket["remaining"] += 1
+        return True, None
+
+    def refund(self, token_index: int, resource: str):
+        """Give back the budget taken for a request, which GitHub did not charge (a 304 of a conditional request)."""
+        self._modify_state(lambda state: self._refund(state, token_index, resource))
+
+    def _exhaust(self, state: State, token_index: int, resource: str, reset: int) -> Tuple[bool, None]:
+        state[self._key(token_index, resource)] = {"remaining": 0, "reset": reset}
+        return True, None
+
+    def exhaust(self, token_index: int, resource: str, reset: int):
+        """Mark the budget of the token as used up until the reset time, after GitHub rejected a request with it."""
+        self._modify_state(lambda state: self._exhaust(state, token_index, resource, reset))
+
+    def get_headroom(self) -> Dict[str, int]:
+        """Return the known remaining budget per token and resource."""
+        return self._modify_state(lambda state: (False, {key: bucket["remaining"] for key, bucket in state.items()}))
+
+
+class LocalRateLimiter(RateLimiter):
+    """Rate limiter, which keeps its state in memory. It is shared by all threads of the process."""
+
+    def __init__(self, num_tokens: int):
+        """Init."""
+        super().__init__(num_tokens)
+        self._lock = threading.Lock()
+        self._state: State = {}
+
+    def _modify_state(self, modifier: Callable[[State], Tuple[bool, Any]]) -> Any:
+        """See overridden."""
+        with self._lock:
+            return modifier(self._state)[1]
+
+
+class FileRateLimiter(RateLimiter):
+    """
+    Rate limiter, which keeps its state in a json file. It is shared by all processes using the same file.
+
+    The file is locked with flock, so only processes on the same host (e.g. containers with a shared volume) are
+    coordinated. Processes on other hosts must use their own tokens.
+    """
+
+    def __init__(self, num_tokens: int, state_file: str):
+        """Init."""
+        super().__init__(num_tokens)
+        self._lock = threading.Lock()
+        self._state_file = state_file
+
+    def _modify_state(self, modifier: Callable[[State], Tuple[bool, Any]]) -> Any:
+        """See overridden."""
+        with self._lock, open(self._state_file, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else {}
+                changed, result = modifier(state)
+                if changed:
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def get_rate_limiter(num_tokens: int) -> RateLimiter:
+    """Return the rate limiter of this process. Uses the rate_limit_state_file of the main section if configured."""
+    global _rate_limiter
+    if _rate_limiter is None or _rate_limiter[0] != os.getpid():
+        if "rate_limit_state_file" in CONFIG["main"]:
+            limiter = FileRateLimiter(num_tokens, CONFIG["main"]["rate_limit_state_file"])
+        else:
+            limiter = LocalRateLimiter(num_tokens)
+        _rate_limiter = (os.getpid(), limiter)
+    return _rate_limiter[1]
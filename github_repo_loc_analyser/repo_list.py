@@ -0,0 +1,87 @@
+"""Module for the list of discovered repos, which is written while the repos are discovered."""
+import logging
+from json import dumps, loads
+from json.decoder import JSONDecodeError
+from os import path, fsync
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from .data_structure import PossibleRepo
+from .github_api_querier import ApiQuerier
+from .helper import SerializableJsonDecoder, SerializableJsonEncoder, sanitize_filename
+
+logger: logging.Logger = logging.getLogger("repolist")
+
+
+class RepoList:
+    """
+    Append-only, line delimited json file with the discovered repos.
+
+    The repos are appended page by page, each page followed by a marker that it is done. After an interruption, the
+    repos of done pages are reused, while pages which are not done are queried again. The first entry is the sampling
+    seed, so the remaining pages are sampled with the same seed as the done ones.
+    """
+
+    def __init__(self, filepath: str):
+        """Init."""
+        self._filepath = filepath
+
+    def _read_entries(self) -> Iterator[Dict[str, Any]]:
+        if not path.exists(self._filepath):
+            return
+        with open(self._filepath) as f:
+            for line in f:
+                try:
+                    yield loads(line, cls=SerializableJsonDecoder)
+                except JSONDecodeError:
+                    logger.warning("Ignoring broken line in repos file: {}".format(line))
+
+    def _load_state(self) -> Tuple[Set[str], bool, Optional[str]]:
+        done_pages = set()
+        complete = False
+        seed = None
+        for entry in self._read_entries():
+            if "page_done" in entry:
+                done_pages.add(entry["page_done"])
+            if entry.get("complete", False):
+                complete = True
+            if "sampling_seed" in entry:
+                seed = entry["sampling_seed"]
+        return done_pages, complete, seed
+
+    def _read_done_repos(self, done_pages: Set[str]) -> Iterator[PossibleRepo]:
+        for entry in self._read_entries():
+            if "repo" in entry and entry["page"] in done_pages:
+                yield entry["repo"]
+
+    def discover(self, api: ApiQuerier) -> Iterator[PossibleRepo]:
+        """Yield the already discovered repos and then discover the remaining ones, writing them to the file."""
+        done_pages, complete, seed = self._load_state()
+        known_filenames: Set[str] = set()
+        for repo in self._read_done_repos(done_pages):
+            known_filenames.add(sanitize_filename(repo.get_name(), repo.get_language()))
+            yield repo
+        if complete:
+            logger.info("Discovery is complete. Loaded {} repos.".format(len(known_filenames)))
+            return
+        logger.info("Loaded {} repos from {} pages. Continuing discovery.".format(len(known_filenames),
+                                                                                  len(done_pages)))
+        with open(self._filepath, "a") as f:
+            if seed is None:
+                self._write_marker(f, {"sampling_seed": api.sampling_seed})
+            elif seed != api.sampling_seed:
+                logger.warning("Continuing with the sampling seed {} of the interrupted discovery instead of {}."
+                               .format(seed, api.sampling_seed))
+                api.sampling_seed = seed
+            for page_key, repos in api.get_repo_pages(known_filenames, done_pages):
+                for repo in repos:
+                    f.write(dumps({"page": page_key, "repo": repo}, cls=SerializableJsonEncoder) + "\n")
+                self._write_marker(f, {"page_done": page_key})
+                yield from repos
+            self._write_marker(f, {"complete": True})
+        logger.info("Discovery is complete.")
+
+    @staticmethod
+    def _write_marker(f, marker: Dict[str, Any]):
+        f.write(dumps(marker) + "\n")
+        f.flush()
+        fsync(f.fileno())
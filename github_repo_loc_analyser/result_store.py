@@ -0,0 +1,161 @@
+"""Module for the backends storing the analysis results."""
+import logging
+import sqlite3
+from json import dump, dumps, load, loads
+from os import path, listdir, makedirs
+from time import time
+from typing import Iterator, List, Set, Tuple
+
+from . import CONFIG
+from .data_structure import Repo, Result
+from .helper import SerializableJsonDecoder, SerializableJsonEncoder, atmoic_write_file, sanitize_filename
+
+logger: logging.Logger = logging.getLogger("results")
+
+RESULTS_DIRNAME = "results"
+RESULTS_DB_FILENAME = "results.sqlite"
+RESULT_FILE_ENDING = ".json"
+DEFAULT_RESULTS_BACKEND = "files"
+DEFAULT_COMMIT_SIZE = 100
+DEFAULT_COMMIT_INTERVAL = 5  # seconds
+
+
+def get_key(repo: Repo) -> str:
+    """Return the key of the result of the given repo. This is also the name of its result file without ending."""
+    return sanitize_filename(repo.get_name(), repo.get_language())
+
+
+class ResultStore:
+    """Base class of the stores for the results. Knows which repos already have a result."""
+
+    def __init__(self):
+        """Init."""
+        self._keys: Set[str] = set()
+
+    def contains(self, repo: Repo) -> bool:
+        """Return whether there is already a result for the given repo."""
+        return get_key(repo) in self._keys
+
+    def add(self, result: Result):
+        """Add the result. It might only be persisted on the next flush."""
+        self._keys.add(get_key(result.get_repo()))
+
+    def flush(self):
+        """Persist all added results."""
+        pass
+
+    def flush_if_due(self):
+        """Persist the added results, if the store would commit them now. Called regularly by the master."""
+        pass
+
+    def close(self):
+        """Flush and close the store."""
+        self.flush()
+
+    def __iter__(self) -> Iterator[Result]:
+        """Iterate over all persisted results."""
+        raise NotImplementedError()
+
+    def export(self, directory: str):
+        """Write every result into its own json file in the given directory (the layout of the files backend)."""
+        if not path.isdir(directory):
+            makedirs(directory)
+        for result in self:
+            filepath = path.join(directory, get_key(result.get_repo()) + RESULT_FILE_ENDING)
+            with open(filepath, "w") as f:
+                dump(result, f, indent="  ", cls=SerializableJsonEncoder)
+
+
+class FileResultStore(ResultStore):
+    """Stores every result atomically in its own json file."""
+
+    def __init__(self, results_dir: str):
+        """Init."""
+        super().__init__()
+        self._results_dir = results_dir
+        if not path.exists(self._results_dir):
+            makedirs(self._results_dir)
+        self._keys = {filename[:-len(RESULT_FILE_ENDING)] for filename in listdir(self._results_dir)
+                      if filename.endswith(RESULT_FILE_ENDING)}
+
+    def add(self, result: Result):
+        """See overridden."""
+        filepath = path.join(self._results_dir, get_key(result.get_repo()) + RESULT_FILE_ENDING)
+        logger.debug("Atomically writing result for {}".format(result.get_repo().get_name()))
+        atmoic_write_file(filepath, lambda f: dump(result, f, indent="  ", cls=SerializableJsonEncoder))
+        super().add(result)
+
+    def __iter__(self) -> Iterator[Result]:
+        """See overridden."""
+        for key in sorted(self._keys):
+            with open(path.join(self._results_dir, key + RESULT_FILE_ENDING)) as f:
+                yield load(f, cls=SerializableJsonDecoder)
+
+
+class SqliteResultStore(ResultStore):
+    """
+    Stores the results in a sqlite database in WAL mode.
+
+    Added results are committed in groups, once commit_size results are pending or commit_interval seconds passed
+    since the last commit. The interval is also checked without new results, so the last ones of a slow phase don't
+    wait for the next result. After a crash, only the results of the last uncommitted group are lost.
+    """
+
+    def __init__(self, db_file: str, commit_size: int, commit_interval: float):
+        """Init."""
+        super().__init__()
+        self._commit_size = commit_size
+        self._commit_interval = commit_interval
+        self._pending: List[Tuple[str, str]] = []
+        self._last_commit = time()
+        self._connection = sqlite3.connect(db_file)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._connection.commit()
+        self._keys = {key for (key,) in self._connection.execute("SELECT key FROM results")}
+        logger.info("Loaded index of {} results.".format(len(self._keys)))
+
+    def add(self, result: Result):
+        """See overridden."""
+        super().add(result)
+        self._pending.append((get_key(result.get_repo()), dumps(result, cls=SerializableJsonEncoder)))
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """See overridden."""
+        if len(self._pending) >= self._commit_size or time() - self._last_commit >= self._commit_interval:
+            self.flush()
+
+    def flush(self):
+        """See overridden."""
+        if self._pending:
+            logger.debug("Committing {} results.".format(len(self._pending)))
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO results (key, data) VALUES (?, ?)", self._pending)
+            self._pending = []
+        self._last_commit = time()
+
+    def close(self):
+        """See overridden."""
+        super().close()
+        self._connection.close()
+
+    def __iter__(self) -> Iterator[Result]:
+        """See overridden."""
+        for (data,) in self._connection.execute("SELECT data FROM results ORDER BY key"):
+            yield loads(data, cls=SerializableJsonDecoder)
+
+
+def create_result_store() -> ResultStore:
+    """Create the result store configured with results_backend in the main section."""
+    main = CONFIG["main"]
+    data_dir = main["data_dir"]
+    backend = main.get("results_backend", DEFAULT_RESULTS_BACKEND)
+    if backend == "files":
+        return FileResultStore(path.join(data_dir, RESULTS_DIRNAME))
+    if backend == "sqlite":
+        return SqliteResultStore(path.join(data_dir, RESULTS_DB_FILENAME),
+                                 main.getint("results_commit_size", DEFAULT_COMMIT_SIZE),
+                                 main.getfloat("results_commit_interval", DEFAULT_COMMIT_INTERVAL))
+    raise ValueError("Unknown results backend: {}".format(backend))
@@ -0,0 +1,44 @@
+"""Module for sampling repos from search results without replacement."""
+import threading
+from random import Random
+from typing import Iterable, List
+
+from .helper import sanitize_filename
+
+
+class RepoSampler:
+    """
+    Samples search result items, making sure that no repo is picked twice.
+
+    The sanitized filenames of all picked repos are kept in a set, which is shared by all languages and periods, so no
+    two repos get the same filename.
+    """
+
+    def __init__(self, used_filenames: Iterable[str] = ()):
+        """Init. used_filenames are the sanitized filenames of repos, which must not be picked."""
+        self._used_filenames = set(used_filenames)
+        self._lock = threading.Lock()
+
+    def claim(self, sanitized_filename: str) -> bool:
+        """Mark the filename as used. Return False if it was already used."""
+        with self._lock:
+            if sanitized_filename in self._used_filenames:
+                return False
+            self._used_filenames.add(sanitized_filename)
+            return True
+
+    def sample(self, items: List[dict], language: str, count: int, rng: Random) -> List[dict]:
+        """Pick up to count random items of a result page, which were not picked before."""
+        result = []
+        if count <= 0:
+            return result
+        for item in rng.sample(items, len(items)):
+            if self.claim(sanitize_filename(item["full_name"], language)):
+                result.append(item)
+                if len(result) >= count:
+                    break
+        return result
+
+    def __len__(self) -> int:
+        """Return the number of used filenames."""
+        return len(self._used_filenames)
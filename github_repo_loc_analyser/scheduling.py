@@ -0,0 +1,95 @@
+"""Module for routing the repos to queues by their size and ordering them for the dispatch."""
+import heapq
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+
+from .data_structure import Repo
+
+ORDER_LARGEST_FIRST = "largest_first"
+ORDER_SMALLEST_FIRST = "smallest_first"
+ORDER_DISCOVERY = "discovery"
+ORDERS = [ORDER_LARGEST_FIRST, ORDER_SMALLEST_FIRST, ORDER_DISCOVERY]
+
+
+class SizeClass:
+    """A class of repos up to a maximum size, which are processed by the workers of one queue."""
+
+    def __init__(self, queue: str, max_size: Optional[int]):
+        """Init. max_size is in KB. None means there is no limit."""
+        self.queue = queue
+        self.max_size = max_size
+
+    def __repr__(self) -> str:
+        """Return the queue and the maximum size."""
+        return "{}:{}".format(self.queue, self.max_size)
+
+
+def parse_size_classes(value: str) -> List[SizeClass]:
+    """
+    Parse size classes like 'small:10000,medium:1000000,huge'.
+
+    Every class is a queue name with the maximum repo size in KB. The last class must not have a maximum size.
+    """
+    result = []
+    for part in value.split(","):
+        queue, _, max_size = part.strip().partition(":")
+        result.append(SizeClass(queue, int(max_size) if max_size else None))
+    if not result or result[-1].max_size is not None:
+        raise ValueError("The last size class must not have a maximum size: {}".format(value))
+    return result
+
+
+class DispatchBuffer:
+    """
+    Buffers the repos to dispatch for every size class and hands them out in the configured order.
+
+    With largest_first the largest buffered repo is dispatched first, so the long running tasks don't end up alone at
+    the end of the run (longest processing time first). smallest_first finishes many repos early. Repos without a
+    known size are treated as the smallest.
+    """
+
+    def __init__(self, size_classes: List[SizeClass], order: str):
+        """Init."""
+        if order not in ORDERS:
+            raise ValueError("Unknown dispatch order {}. Must be one of {}.".format(order, ", ".join(ORDERS)))
+        self._size_classes = size_classes
+        self._order = order
+        self._heaps: Dict[str, List[Tuple[int, int, Repo]]] = {size_class.queue: [] for size_class in size_classes}
+        # Keeps the order of discovery for repos with the same key and makes the repos themselves never be compared.
+        self._counter = count()
+        self._size = 0
+
+    def get_queue(self, repo: Repo) -> str:
+        """Return the queue for the repo."""
+        size = repo.get_size() or 0
+        for size_class in self._size_classes:
+            if size_class.max_size is None or size <= size_class.max_size:
+                return size_class.queue
+        return self._size_classes[-1].queue
+
+    def add(self, repo: Repo):
+        """Add the repo to the buffer of its size class."""
+        size = repo.get_size() or 0
+        if self._order == ORDER_LARGEST_FIRST:
+            key = -size
+        elif self._order == ORDER_SMALLEST_FIRST:
+            key = size
+        else:
+            key = 0
+        heapq.heappush(self._heaps[self.get_queue(repo)], (key, next(self._counter), repo))
+        self._size += 1
+
+    def get_queues(self) -> List[str]:
+        """Return the queues, which have buffered repos."""
+        return [queue for queue, heap in self._heaps.items() if heap]
+
+    def pop(self, queue: str, num_repos: int = 1) -> List[Repo]:
+        """Remove and return up to num_repos repos for the queue in dispatch order."""
+        heap = self._heaps[queue]
+        result = [heapq.heappop(heap)[2] for _ in range(min(num_repos, len(heap)))]
+        self._size -= len(result)
+        return result
+
+    def __len__(self) -> int:
+        """Return the number of buffered repos."""
+        return self._size
@@ -0,0 +1,100 @@
+"""Module for splitting GitHub searches into partitions, which are below the result cap of the search API."""
+from bisect import bisect_right
+from datetime import date
+from itertools import accumulate
+from typing import List, Optional, Tuple
+
+SEARCH_RESULT_CAP = 1000
+GITHUB_EPOCH = date(2007, 10, 1)
+MAX_STARS = 10 ** 7
+
+
+class Range:
+    """A closed range of integers (or dates as ordinals) as used in the qualifiers of GitHub searches."""
+
+    def __init__(self, start: int, end: int, is_date: bool):
+        """Init."""
+        self.start = start
+        self.end = end
+        self.is_date = is_date
+
+    def _format(self, value: int) -> str:
+        if self.is_date:
+            return date.fromordinal(value).isoformat()
+        return str(value)
+
+    def to_qualifier(self) -> str:
+        """Return the range in the syntax of the search qualifiers."""
+        return "{}..{}".format(self._format(self.start), self._format(self.end))
+
+    def can_split(self) -> bool:
+        """Return whether the range contains more than one value."""
+        return self.end > self.start
+
+    def split(self) -> Tuple["Range", "Range"]:
+        """Split the range into two halves."""
+        middle = (self.start + self.end) // 2
+        return Range(self.start, middle, self.is_date), Range(middle + 1, self.end, self.is_date)
+
+    @classmethod
+    def parse(cls, qualifier: str, is_date: bool) -> "Range":
+        """Parse a qualifier value like '>20', '<=2012-01-01' or '10..100'."""
+        def parse_value(value: str) -> int:
+            if is_date:
+                return date.fromisoformat(value).toordinal()
+            return int(value)
+
+        minimum = GITHUB_EPOCH.toordinal() if is_date else 0
+        maximum = date.today().toordinal() if is_date else MAX_STARS
+        qualifier = qualifier.strip()
+        if ".." in qualifier:
+            start, end = qualifier.split("..", 1)
+            return Range(minimum if start == "*" else parse_value(start),
+                         maximum if end == "*" else parse_value(end), is_date)
+        for prefix, start, end in [(">=", 0, None), ("<=", None, 0), (">", 1, None), ("<", None, -1)]:
+            if qualifier.startswith(prefix):
+                value = parse_value(qualifier[len(prefix):])
+                return Range(minimum if start is None else value + start,
+                             maximum if end is None else value + end, is_date)
+        value = parse_value(qualifier)
+        return Range(value, value, is_date)
+
+
+class Partition:
+    """A part of a search, restricted to a range of creation dates and stars."""
+
+    def __init__(self, created: Range, stars: Range, total_count: Optional[int] = None):
+        """Init."""
+        self.created = created
+        self.stars = stars
+        self.total_count = total_count
+
+    def split(self) -> Optional[List["Partition"]]:
+        """Split the partition in halves, preferring to split the dates. Returns None if it cannot be split."""
+        if self.created.can_split():
+            return [Partition(created, self.stars) for created in self.created.split()]
+        if self.stars.can_split():
+            return [Partition(self.created, stars) for stars in self.stars.split()]
+        return None
+
+    def __repr__(self) -> str:
+        """Return the qualifiers of the partition."""
+        return "created:{} stars:{}".format(self.created.to_qualifier(), self.stars.to_qualifier())
+
+
+class PartitionIndex:
+    """Maps indices into the concatenated results of partitions to the partitions."""
+
+    def __init__(self, partitions: List[Partition]):
+        """Init. All partitions must have a total count."""
+        self.partitions = [partition for partition in partitions if partition.total_count > 0]
+        counts = [partition.total_count for partition in self.partitions]
+        self._starts = list(accumulate([0] + counts[:-1]))
+        self.total_count = sum(counts)
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """Return the number of the partition and the offset in it for the given index."""
+        if not 0 <= index < self.total_count:
+            raise IndexError("Index out of range of the partitions.")
+        i = bisect_right(self._starts, index) - 1
+        return i, index - self._starts[i]
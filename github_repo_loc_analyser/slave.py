@@ -1,23 +1,49 @@
 """Module for the logic in the slave nodes."""
+import os
+from typing import Optional, Tuple, Union
+
 from .code_analyser import CodeAnalyzer
 from .data_structure import PossibleRepo, Result, AnalysisRepo
 from .github_api_querier import ApiQuerier
+from .metrics import TaskMetrics
+
+_api_querier: Optional[Tuple[int, ApiQuerier]] = None
+
+
+def get_api_querier() -> ApiQuerier:
+    """Return the api querier of this process, so its config and connections are reused by all tasks."""
+    global _api_querier
+    # The connections of the session must not be shared with a forked process.
+    if _api_querier is None or _api_querier[0] != os.getpid():
+        _api_querier = (os.getpid(), ApiQuerier())
+    return _api_querier[1]
 
 
 class Slave:
     """Class containing the logic of the slave node."""
 
-    def __init__(self, repo: PossibleRepo):
-        """Init."""
+    def __init__(self, repo: Union[PossibleRepo, AnalysisRepo], trace_id: Optional[str] = None):
+        """Init. If the repo is an AnalysisRepo, its commit was already resolved by the master."""
         self._possible_repo = repo
+        self.metrics = TaskMetrics(trace_id)
+
+    def resolve(self) -> Union[AnalysisRepo, Result]:
+        """Return the repo with its commit or a failed result if no usable commit was found."""
+        if isinstance(self._possible_repo, AnalysisRepo):
+            return self._possible_repo
+        with self.metrics.time("get_commit"):
+            commit_hash = get_api_querier().get_commit(self._possible_repo)
+        if commit_hash is None:
+            return Result(self._possible_repo, sucess=False, failure_reason="Could not find a usable commit.",
+                          metrics=self.metrics.to_dict())
+        return AnalysisRepo(self._possible_repo.get_name(), self._possible_repo.get_language(),
+                            self._possible_repo.is_old_repo(), self._possible_repo.get_remote_url(), commit_hash,
+                            self._possible_repo.get_size())
 
     def run(self) -> Result:
         """Run the slave logic."""
-        aq = ApiQuerier()
-        commit_hash = aq.get_commit(self._possible_repo)
-        if commit_hash is None:
-            return Result(self._possible_repo, sucess=False, failure_reason="Could not find a usable commit.")
-        repo = AnalysisRepo(self._possible_repo.get_name(), self._possible_repo.get_language(),
-                            self._possible_repo.is_old_repo(), self._possible_repo.get_remote_url(), commit_hash)
-        analyzer = CodeAnalyzer(repo)
+        repo = self.resolve()
+        if isinstance(repo, Result):
+            return repo
+        analyzer = CodeAnalyzer(repo, self.metrics)
         return analyzer.process_repo()
@@ -1,47 +1,194 @@
 """Module for the celery tasks."""
 import logging
 import logging.config
+import subprocess
 from os import path, _exit
 from json import dumps, loads
-from typing import Optional
-from celery import Celery
+from time import time
+from typing import Any, Callable, Dict, List, Optional, Union
+import requests
+from celery import Celery, Task
+from celery.signals import worker_init, worker_process_init
 from celery.worker import WorkController
 from kombu.serialization import register
 
 from . import CONFIG, setup, configure_logging
 from . import base_celery_conf
-from .data_structure import PossibleRepo, Result
-from .helper import SerializableJsonDecoder, SerializableJsonEncoder
+from .data_structure import AnalysisRepo, PossibleRepo, Result
+from .deadlines import StageTimeout
+from .helper import SerializableJsonDecoder, SerializableJsonEncoder, msgpack, msgpack_dumps, msgpack_loads
+from .metrics import get_metrics, start_worker_metrics_export
+from .pipeline import get_min_concurrency, get_pipeline
+from .profiling import PROFILE_HEADER, profile_task
 from .slave import Slave
+from .tracing import SPAN_TASK, TRACE_HEADER, get_tracer
+
+INTEGER_CELERY_SETTINGS = ["worker_concurrency", "worker_prefetch_multiplier", "worker_max_tasks_per_child"]
+DEFAULT_SERIALIZER = "grla_json"
+DEFAULT_TASK_RETRIES = 2
+DEFAULT_TASK_RETRY_BACKOFF = 30  # seconds
+# Errors, which might go away when trying again later
+RETRYABLE_EXCEPTIONS = (StageTimeout, subprocess.CalledProcessError, requests.RequestException)
 
 setup()
 app = Celery(config_source=base_celery_conf)
 app.conf.update(CONFIG["celery"])
+# The config parser only knows strings, but celery needs these settings as integers.
+for setting in INTEGER_CELERY_SETTINGS:
+    if setting in CONFIG["celery"]:
+        app.conf[setting] = CONFIG["celery"].getint(setting)
 configure_logging()
+
+
+def _timed(serializer: str, direction: str, function: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """Wrap the (de)serialization function, so its duration is measured."""
+    def timed_function(o: Any) -> Any:
+        with get_metrics().time("serialization_seconds", "Seconds spent (de)serializing messages.",
+                                serializer=serializer, direction=direction):
+            return function(o)
+    return timed_function
+
+
 register('grla_json',
-         lambda o: dumps(o, cls=SerializableJsonEncoder),
-         lambda o: loads(o, cls=SerializableJsonDecoder),
+         _timed("grla_json", "dumps", lambda o: dumps(o, cls=SerializableJsonEncoder)),
+         _timed("grla_json", "loads", lambda o: loads(o, cls=SerializableJsonDecoder)),
          content_type="application/x-grla-json")
 
+logger: logging.Logger = logging.getLogger("tasks")
+
 app.conf.accept_content = ["grla_json"]
-app.conf.task_serializer = "grla_json"
-app.conf.result_serializer = "grla_json"
+if msgpack is not None:
+    register('grla_msgpack', _timed("grla_msgpack", "dumps", msgpack_dumps),
+             _timed("grla_msgpack", "loads", msgpack_loads),
+             content_type="application/x-grla-msgpack", content_encoding="binary")
+    app.conf.accept_content.append("grla_msgpack")
+# Both serializers are accepted, so the master and the workers can be switched one after the other.
+for setting in ["task_serializer", "result_serializer"]:
+    serializer = CONFIG["celery"].get(setting, DEFAULT_SERIALIZER)
+    if serializer not in app.conf.accept_content:
+        logger.error("Unknown or unavailable serializer {} for {}. "
+                     "grla_msgpack needs the msgpack package.".format(serializer, setting))
+        exit(1)
+    app.conf[setting] = serializer
+
+
+PIPELINE_POOL = "threads"
+
+
+@worker_init.connect
+def _configure_pipeline_pool(sender: WorkController, **kwargs):
+    """
+    Run the tasks of a worker with the pipeline in concurrent threads of one process.
+
+    Only the tasks running at the same time feed the pipeline. Prefetched tasks of a prefork child or the solo pool
+    would wait until the task before them finished, so the stages would never overlap.
+    """
+    if not CONFIG["main"].getboolean("pipeline", False):
+        return
+    if sender.pool_cls != PIPELINE_POOL:
+        logger.warning("The pipeline needs the {} pool, but the worker uses {}. Switching to {}."
+                       .format(PIPELINE_POOL, sender.pool_cls, PIPELINE_POOL))
+        sender.pool_cls = PIPELINE_POOL
+    min_concurrency = get_min_concurrency()
+    if sender.concurrency < min_concurrency:
+        logger.warning("Raising the concurrency of the worker from {} to {}, so every stage of the pipeline is busy."
+                       .format(sender.concurrency, min_concurrency))
+        sender.concurrency = min_concurrency
+
+
+@worker_init.connect
+def _start_worker_metrics(**kwargs):
+    """Export the metrics of the worker. With the threads or solo pool, the tasks run in this process."""
+    start_worker_metrics_export()
 
-logger: logging.Logger = logging.getLogger("tasks")
 
+@worker_process_init.connect
+def _start_worker_process_metrics(**kwargs):
+    """Export the metrics of a child process of the prefork pool, which runs the tasks."""
+    start_worker_metrics_export()
 
-@app.task
-def process_possible_repo(repo: PossibleRepo) -> Optional[Result]:
-    """Process the given possible repo."""
+
+def _get_result(repo: Union[PossibleRepo, AnalysisRepo], process: Callable[[], Optional[Result]],
+                retry: Optional[Callable[[BaseException], None]] = None) -> Optional[Result]:
+    """
+    Return the result of process.
+
+    On a transient error, retry is called, which might raise celery's Retry. If it does not, a failed result with the
+    reason is returned.
+    """
     try:
-        slave = Slave(repo)
-        result = slave.run()
+        result = process()
         if result is None:
             logger.error("Slave returned None result.")
         return result
+    except RETRYABLE_EXCEPTIONS as e:
+        logger.warning("Processing {} failed: {}".format(repo.get_name(), e))
+        if retry is not None:
+            retry(e)
+        return Result(repo, sucess=False, failure_reason="{}: {}".format(type(e).__name__, e))
     except BaseException as e:
         logger.exception("Caught exception in task. Returning None: {}")
         if "debug_abort_on_error" in CONFIG["main"] and CONFIG["main"].getboolean("debug_abort_on_error"):
             logger.error("Will exit.")
             _exit(1)
         return None
+
+
+def _start_processing(repo: Union[PossibleRepo, AnalysisRepo],
+                      trace_id: Optional[str] = None) -> Callable[[], Optional[Result]]:
+    """Submit the repo to the pipeline, if it is enabled. Return the function returning the result."""
+    pipeline = get_pipeline()
+    if pipeline is None:
+        return Slave(repo, trace_id).run
+    return pipeline.submit(repo, trace_id).result
+
+
+def _record_task_span(trace_id: Optional[str], repo: Union[PossibleRepo, AnalysisRepo], start: float, retries: int):
+    """Record the processing of the repo by this task as span of its trace."""
+    tracer = get_tracer()
+    if tracer is not None and trace_id is not None:
+        tracer.record(trace_id, SPAN_TASK, start, time(), repo=repo.get_name(), retries=retries)
+
+
+@app.task(bind=True)
+def process_possible_repo(self: Task, repo: Union[PossibleRepo, AnalysisRepo]) -> Optional[Result]:
+    """
+    Process the given possible repo. If it is an AnalysisRepo, its commit is already resolved.
+
+    Transient errors are retried up to task_retries times with an exponential backoff.
+    """
+    def retry(e: BaseException):
+        retries = self.request.retries
+        if retries < CONFIG["main"].getint("task_retries", DEFAULT_TASK_RETRIES):
+            countdown = CONFIG["main"].getfloat("task_retry_backoff", DEFAULT_TASK_RETRY_BACKOFF) * 2 ** retries
+            logger.info("Retrying {} in {} seconds.".format(repo.get_name(), countdown))
+            raise self.retry(exc=e, countdown=countdown, max_retries=None)
+
+    start = time()
+    trace_id = (self.request.get(TRACE_HEADER) or [None])[0]
+    try:
+        with profile_task(repo, self.request.get(PROFILE_HEADER)):
+            return _get_result(repo, _start_processing(repo, trace_id), retry)
+    finally:
+        _record_task_span(trace_id, repo, start, self.request.retries)
+
+
+@app.task(bind=True)
+def process_possible_repos(self: Task, repos: List[Union[PossibleRepo, AnalysisRepo]]) -> Dict[str, Any]:
+    """
+    Process the given repos.
+
+    With the pipeline, all repos are submitted at once, otherwise they are processed one after the other. Returns the results in the order of the repos (None for repos, which failed) and the seconds the batch took.
+    Transient errors are not retried, but recorded as failure reason in the result of the repo.
+    """
+    start = time()
+    trace_ids = self.request.get(TRACE_HEADER) or [None] * len(repos)
+    processes = [_start_processing(repo, trace_id) for repo, trace_id in zip(repos, trace_ids)]
+    results = []
+    for repo, trace_id, process in zip(repos, trace_ids, processes):
+        # With the pipeline, all repos are processed from the start of the batch, otherwise one after the other.
+        repo_start = start if get_pipeline() is not None else time()
+        with profile_task(repo, self.request.get(PROFILE_HEADER)):
+            results.append(_get_result(repo, process))
+        _record_task_span(trace_id, repo, repo_start, self.request.retries)
+    return {"results": results, "seconds": time() - start}
@@ -0,0 +1,169 @@
+"""
+Module for tracing every repo from its discovery to its stored result across the master and the workers.
+
+The master gives every repo a trace id, which is sent to the workers in the TRACE_HEADER of the task. Every process
+writes the spans of the traces as json lines to its own file in the traces directory in data_dir. merge_traces joins
+the files of all nodes into a timeline per repo.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from contextlib import contextmanager
+from statistics import mean
+from time import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from . import CONFIG
+
+logger: logging.Logger = logging.getLogger("tracing")
+
+TRACES_DIRNAME = "traces"
+# The header of a task with the trace ids of its repos in the order of the repos
+TRACE_HEADER = "grla_trace_ids"
+# Spans of the master
+SPAN_DISCOVER = "discover"  # Until the discovery yielded the repo. Includes the commit resolution on the master.
+SPAN_BUFFER = "buffer"  # In the dispatch buffer. Ends when the task is sent.
+SPAN_STORE = "store"  # Storing the result, after the master received it
+# Span of the worker. The stages of the processing are recorded as spans, too.
+SPAN_TASK = "task"
+# The phases of a timeline: the spans of the master and the worker and the gaps between them
+PHASES = ["discover", "buffer", "queue", "execute", "result", "store"]
+
+_tracer: Optional[Tuple[int, Optional["Tracer"]]] = None
+
+
+def new_trace_id() -> str:
+    """Return a new random trace id."""
+    return uuid4().hex
+
+
+class Tracer:
+    """Writes the spans of this process to a json lines file."""
+
+    def __init__(self, directory: str):
+        """Init."""
+        os.makedirs(directory, exist_ok=True)
+        self._host = socket.gethostname()
+        filepath = os.path.join(directory, "{}-{}.jsonl".format(self._host, os.getpid()))
+        self._file = open(filepath, "a")
+        self._lock = threading.Lock()
+
+    def record(self, trace_id: str, name: str, start: float, end: float, **attributes: Any):
+        """Write the span with the wall clock start and end time."""
+        span = dict(attributes, trace_id=trace_id, name=name, start=start, end=end, host=self._host, pid=os.getpid())
+        line = json.dumps(span) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    @contextmanager
+    def span(self, trace_id: Optional[str], name: str, **attributes: Any) -> Iterator[None]:
+        """Record the context as span, if there is a trace id."""
+        start = time()
+        try:
+            yield
+        finally:
+            if trace_id is not None:
+                self.record(trace_id, name, start, time(), **attributes)
+
+
+def get_tracer() -> Optional[Tracer]:
+    """Return the tracer of this process or None if tracing is not enabled with tracing in the main section."""
+    global _tracer
+    if _tracer is None or _tracer[0] != os.getpid():
+        tracer = None
+        if CONFIG["main"].getboolean("tracing", False):
+            tracer = Tracer(os.path.join(CONFIG["main"]["data_dir"], TRACES_DIRNAME))
+        _tracer = (os.getpid(), tracer)
+    return _tracer[1]
+
+
+@contextmanager
+def span(trace_id: Optional[str], name: str, **attributes: Any) -> Iterator[None]:
+    """Record the context as span with the tracer of this process, if tracing is enabled and there is a trace id."""
+    tracer = get_tracer()
+    if tracer is None or trace_id is None:
+        yield
+        return
+    with tracer.span(trace_id, name, **attributes):
+        yield
+
+
+def read_spans(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Yield the spans in the given files and the files in the given directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".jsonl")]
+        else:
+            files = [path]
+        for filepath in files:
+            with open(filepath) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def build_timeline(trace_id: str, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Return the timeline of a repo with the seconds spent in each of the PHASES.
+
+    queue is the time between sending the task (or the end of the previous try) and its start on a worker. result is
+    the time between the end of the last try and the start of storing the result on the master. Both depend on the
+    clocks of the nodes being in sync.
+    """
+    spans = sorted(spans, key=lambda s: s["start"])
+    phases = {phase: 0.0 for phase in PHASES}
+    previous_end: Optional[float] = None
+    for s in spans:
+        duration = s["end"] - s["start"]
+        if s["name"] in [SPAN_DISCOVER, SPAN_BUFFER, SPAN_STORE]:
+            phases[s["name"]] += duration
+        if s["name"] == SPAN_BUFFER:
+            previous_end = s["end"]
+        elif s["name"] == SPAN_TASK:
+            if previous_end is not None:
+                phases["queue"] += max(0.0, s["start"] - previous_end)
+            phases["execute"] += duration
+            previous_end = s["end"]
+        elif s["name"] == SPAN_STORE and previous_end is not None:
+            phases["result"] += max(0.0, s["start"] - previous_end)
+    return {
+        "trace_id": trace_id,
+        "repo": next((s["repo"] for s in spans if "repo" in s), None),
+        "start": spans[0]["start"],
+        "end": max(s["end"] for s in spans),
+        "phases": phases,
+        "spans": spans,
+    }
+
+
+def merge_traces():
+    """Merge the trace files of all nodes into one timeline per repo and print where the time is spent."""
+    if len(sys.argv) < 3:
+        print("Usage: {} <timelines file> <trace directory or file>...".format(sys.argv[0]))
+        exit(1)
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for s in read_spans(sys.argv[2:]):
+        traces.setdefault(s["trace_id"], []).append(s)
+    timelines = [build_timeline(trace_id, spans) for trace_id, spans in traces.items()]
+    timelines.sort(key=lambda timeline: timeline["start"])
+    with open(sys.argv[1], "w") as f:
+        f.writelines(json.dumps(timeline) + "\n" for timeline in timelines)
+
+    print("Wrote the timelines of {} repos to {}".format(len(timelines), sys.argv[1]))
+    if not timelines:
+        return
+    total = sum(sum(timeline["phases"].values()) for timeline in timelines) or 1.0
+    print("{:<10}{:>12}{:>12}{:>8}".format("phase", "mean", "max", "share"))
+    for phase in PHASES:
+        values = [timeline["phases"][phase] for timeline in timelines]
+        print("{:<10}{:>11.3f}s{:>11.3f}s{:>7.1f}%".format(phase, mean(values), max(values),
+                                                           100 * sum(values) / total))
+
+
+if __name__ == "__main__":
+    merge_traces()
@@ -0,0 +1 @@
+"""Tests of the github repo loc analyser."""
@@ -0,0 +1,33 @@
+"""Fixtures shared by the tests."""
+import pytest
+
+from github_repo_loc_analyser import CONFIG
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Set up a minimal config with the data and tmp dir in tmp_path. Returns the main section to add options to."""
+    CONFIG.clear()
+    CONFIG.read_dict({
+        "main": {"data_dir": str(tmp_path / "data"), "tmp_dir": str(tmp_path / "tmp")},
+        "celery": {},
+    })
+    (tmp_path / "data").mkdir()
+    (tmp_path / "tmp").mkdir()
+    yield CONFIG["main"]
+    CONFIG.clear()
+
+
+@pytest.fixture
+def api_config(config):
+    """Add the search filters and options of the api querier to the config. Returns the main section."""
+    CONFIG.read_dict({
+        "repo_filters": {
+            "languages": "Python", "size": "<=100000", "stars": ">=10",
+            "old_repo_created": "2010-01-01..2012-12-31", "old_repo_updated": "<=2013-12-31",
+            "new_repo_created": "2016-01-01..2018-12-31", "new_repo_updated": ">2019-01-01",
+        },
+        "main": {"num_repos_per_page": "2", "num_repo_pages": "1", "old_repo_date": "2014-01-01T00:00:00Z",
+                 "new_repo_date": "2020-01-01T00:00:00Z"},
+    })
+    return config
@@ -0,0 +1,33 @@
+"""Tests of the analysis of a repository."""
+import pytest
+
+pytest.importorskip("git")
+
+from github_repo_loc_analyser import loc_counter  # noqa: E402
+from github_repo_loc_analyser.blob_cache import get_blob_cache  # noqa: E402
+from github_repo_loc_analyser.code_analyser import CodeAnalyzer  # noqa: E402
+from github_repo_loc_analyser.data_structure import AnalysisRepo  # noqa: E402
+
+
+@pytest.fixture
+def blob_config(config, tmp_path, monkeypatch):
+    """Configure the native counter with a process pool and a blob cache."""
+    config["counter_processes"] = "4"
+    config["blob_cache_file"] = str(tmp_path / "blobs.sqlite")
+    monkeypatch.setattr(loc_counter, "_counter", None)
+    return config
+
+
+def test_count_language_blobs_caches_the_counts_of_every_blob(blob_config):
+    """Every blob is cached with its own counts, also when they are counted in the pool in several chunks."""
+    num_blobs = 100
+    blobs = [("{:040x}".format(i), "file{}.py".format(i)) for i in range(num_blobs)]
+    contents = {sha: b"value = 1\n" * (i + 1) for i, (sha, _) in enumerate(blobs)}
+    analyzer = CodeAnalyzer(AnalysisRepo("owner/repo", "Python", False, "file:///repo", "0" * 40, 1))
+
+    result = analyzer.count_language_blobs(blobs, "Python", lambda b: (contents[sha] for sha, _ in b))
+
+    assert result == {"nFiles": num_blobs, "blank": 0, "comment": 0, "code": num_blobs * (num_blobs + 1) // 2}
+    cached = get_blob_cache().get_counts(contents, "Python")
+    assert cached == {sha: (0, 0, i + 1) for i, (sha, _) in enumerate(blobs)}
+    assert analyzer.blob_cache_stats == {"hits": 0, "misses": num_blobs}
@@ -0,0 +1,40 @@
+"""Tests of resolving the commits on the master."""
+import requests
+
+from github_repo_loc_analyser.commit_resolver import CommitResolver
+from github_repo_loc_analyser.data_structure import PossibleRepo
+
+
+class FakeApi:
+    """Answers with a commit, no commit or a failed request depending on the name of the repo."""
+
+    api_concurrency = 2
+
+    def __init__(self):
+        """Init."""
+        self.requested = []
+
+    def get_commit(self, repo):
+        """See ApiQuerier."""
+        self.requested.append(repo.get_name())
+        if repo.get_name().startswith("failing"):
+            raise requests.ConnectionError("Connection reset")
+        if repo.get_name().startswith("empty"):
+            return None
+        return "sha-" + repo.get_name()
+
+
+def _repo(name):
+    return PossibleRepo(name, "Python", False, "https://github.com/" + name, "https://api.github.com/" + name)
+
+
+def test_failed_requests_are_skipped_and_retried(tmp_path):
+    """A failed request is neither reported as a repo without commit nor persisted, so the next run retries it."""
+    commits_file = str(tmp_path / "commits.jsonl")
+    repos = [_repo("ok"), _repo("failing"), _repo("empty")]
+    resolved = list(CommitResolver(commits_file, FakeApi(), 2).resolve(repos))
+    assert [(repo.get_name(), commit) for repo, commit in resolved] == [("ok", "sha-ok"), ("empty", None)]
+
+    api = FakeApi()
+    list(CommitResolver(commits_file, api, 2).resolve(repos))
+    assert sorted(api.requested) == ["empty", "failing"]
@@ -0,0 +1,69 @@
+"""Tests of the stage deadlines and of killing the processes, which run past them."""
+import pickle
+import subprocess
+from time import monotonic, sleep
+
+import pytest
+
+from github_repo_loc_analyser.deadlines import Deadline, STAGE_COUNT, STAGE_FETCH, StageTimeout, get_timeout
+from github_repo_loc_analyser.deadlines import run_process
+
+
+def _is_running(pid):
+    """Return whether the process exists and isn't a zombie waiting to be reaped."""
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_stage_timeout_survives_pickling():
+    """The result backend pickles the exception, so it must keep its stage and message."""
+    error = pickle.loads(pickle.dumps(StageTimeout(STAGE_FETCH, 1.5)))
+    assert (error.stage, error.seconds) == (STAGE_FETCH, 1.5)
+    assert str(error) == "The fetch stage exceeded its deadline of 1.5 seconds."
+
+
+def test_deadline():
+    """A deadline raises once it passed. Without seconds it never does."""
+    Deadline(STAGE_COUNT, None).check()
+    assert Deadline(STAGE_COUNT, None).remaining() is None
+    deadline = Deadline(STAGE_COUNT, 0.01)
+    assert 0 < deadline.remaining() <= 0.01
+    sleep(0.02)
+    assert deadline.remaining() == 0
+    with pytest.raises(StageTimeout):
+        deadline.check()
+
+
+def test_configured_timeouts(config):
+    """The timeouts come from the main section. 0 disables the deadline."""
+    config["fetch_timeout"] = "5"
+    config["count_timeout"] = "0"
+    assert get_timeout(STAGE_FETCH) == 5
+    assert get_timeout(STAGE_COUNT) is None
+
+
+def test_run_process():
+    """The output is returned. An exit code other than 0 raises."""
+    assert run_process(["sh", "-c", "cat"], stdin=b"abc") == b"abc"
+    with pytest.raises(subprocess.CalledProcessError):
+        run_process(["sh", "-c", "exit 3"])
+
+
+def test_process_group_is_killed_on_deadline(tmp_path):
+    """A process running past the deadline is killed together with the children it started."""
+    pid_file = str(tmp_path / "child.pid")
+    start = monotonic()
+    with pytest.raises(StageTimeout) as error:
+        run_process(["sh", "-c", "sleep 30 & echo $! > {}; sleep 30".format(pid_file)], Deadline(STAGE_FETCH, 0.5))
+    assert error.value.stage == STAGE_FETCH
+    assert monotonic() - start < 10
+    with open(pid_file) as f:
+        child = int(f.read())
+    for _ in range(50):
+        if not _is_running(child):
+            break
+        sleep(0.1)
+    assert not _is_running(child)
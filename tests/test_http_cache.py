@@ -0,0 +1,135 @@
+"""Tests of the cache of GitHub API responses, which is revalidated with conditional requests."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from github_repo_loc_analyser import http_cache, rate_limit
+from github_repo_loc_analyser.github_api_querier import ApiQuerier
+from github_repo_loc_analyser.http_cache import HttpCache
+
+ETAG = '"v1"'
+
+
+def _response(url, body, headers):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    return response
+
+
+def test_cached_response_with_validators(tmp_path):
+    """A stored response comes back with its body and the headers for revalidating it."""
+    cache = HttpCache(str(tmp_path / "cache.sqlite"), 60, 10 ** 6)
+    cache.put("http://api/a", _response("http://api/a", b'{"a": 1}', {"ETag": ETAG, "Last-Modified": "yesterday"}))
+    cached = cache.get("http://api/a")
+    assert cached.to_response(requests.Request("GET", "http://api/a").prepare()).json() == {"a": 1}
+    assert cached.get_validators() == {"If-None-Match": ETAG, "If-Modified-Since": "yesterday"}
+    assert cache.is_fresh(cached)
+    assert cache.get("http://api/b") is None
+
+
+def test_refresh_after_ttl(tmp_path):
+    """A response older than the ttl is stale, until it is refreshed after a revalidation."""
+    cache = HttpCache(str(tmp_path / "cache.sqlite"), 60, 10 ** 6)
+    cache.put("http://api/a", _response("http://api/a", b"{}", {}))
+    cache._connection.execute("UPDATE responses SET stored_at = ?", (time() - 120,))
+    assert not cache.is_fresh(cache.get("http://api/a"))
+    cache.refresh("http://api/a")
+    assert cache.is_fresh(cache.get("http://api/a"))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    """Once the cache is larger than its maximum size, the least recently used responses are removed."""
+    cache = HttpCache(str(tmp_path / "cache.sqlite"), 60, 25)
+    for name in ["a", "b"]:
+        cache.put("http://api/" + name, _response("http://api/" + name, b"x" * 10, {}))
+    cache._connection.execute("UPDATE responses SET accessed_at = accessed_at - 10 WHERE url = 'http://api/b'")
+    cache.get("http://api/a")
+    cache.put("http://api/c", _response("http://api/c", b"x" * 10, {}))
+    assert cache.get("http://api/b") is None
+    assert cache.get("http://api/a") is not None
+    assert cache.get("http://api/c") is not None
+
+
+class _ConditionalServer:
+    """Answers every request with the same json and its ETag, or 304 if the request has the ETag."""
+
+    def __init__(self):
+        """Init. Starts the server on a free port."""
+        self.conditional_requests = 0
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                headers = {"ETag": ETAG, "X-RateLimit-Remaining": "4999", "X-RateLimit-Reset": str(int(time()) + 3600),
+                           "X-RateLimit-Resource": "core"}
+                if self.headers.get("If-None-Match") == ETAG:
+                    server.conditional_requests += 1
+                    self.send_response(304)
+                    data = b""
+                else:
+                    self.send_response(200)
+                    data = json.dumps({"sha": "abc"}).encode()
+                    headers["Content-Type"] = "application/json"
+                headers["Content-Length"] = str(len(data))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/repos/owner/repo".format(self._server.server_address[1])
+
+    def close(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def server():
+    """Start a server answering conditional requests."""
+    server = _ConditionalServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def cached_api(api_config, tmp_path, monkeypatch):
+    """Return an api querier with a http cache, which revalidates every response."""
+    api_config["http_cache_file"] = str(tmp_path / "http_cache.sqlite")
+    api_config["http_cache_ttl"] = "0"
+    monkeypatch.setattr(http_cache, "_http_cache", None)
+    monkeypatch.setattr(rate_limit, "_rate_limiter", None)
+    return ApiQuerier()
+
+
+def test_revalidated_response_is_served_from_the_cache(server, cached_api):
+    """A stale response is revalidated with its ETag. The 304 gives the cached body and doesn't use up budget."""
+    first = cached_api._perform_cached_request(requests.Request("GET", server.url).prepare())
+    second = cached_api._perform_cached_request(requests.Request("GET", server.url).prepare())
+    assert first.json() == second.json() == {"sha": "abc"}
+    assert second.status_code == 200
+    assert server.requests == 2 and server.conditional_requests == 1
+    assert cached_api.get_rate_limit_headroom() == {"0/core": 4999}
+
+
+def test_immutable_response_is_not_revalidated(server, cached_api):
+    """An immutable response, like the last commit before a date, is never requested again."""
+    for _ in range(2):
+        response = cached_api._perform_cached_request(requests.Request("GET", server.url).prepare(), immutable=True)
+        assert response.json() == {"sha": "abc"}
+    assert server.requests == 1
@@ -0,0 +1,98 @@
+"""Tests of the backends counting the lines of code."""
+import multiprocessing
+import shutil
+
+import pytest
+
+from github_repo_loc_analyser.deadlines import Deadline, STAGE_COUNT, StageTimeout
+from github_repo_loc_analyser.loc_counter import ClocCounter, MIN_FILES_FOR_POOL, NativeCounter
+
+
+def _write_python_files(directory, num_files):
+    for i in range(num_files):
+        (directory / "file{}.py".format(i)).write_text("# A comment\nvalue{} = {}\n\n".format(i, i))
+
+
+def _count_in_process(directory, queue):
+    try:
+        queue.put(NativeCounter(4).count_directory(directory))
+    except Exception as e:
+        queue.put(e)
+
+
+def test_native_counter_in_daemonic_process(tmp_path):
+    """The children of celery's prefork pool are daemonic and must not start a process pool."""
+    num_files = MIN_FILES_FOR_POOL + 1
+    _write_python_files(tmp_path, num_files)
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_count_in_process, args=(str(tmp_path), queue), daemon=True)
+    process.start()
+    result = queue.get(timeout=60)
+    process.join()
+    assert result == {"Python": {"nFiles": num_files, "blank": num_files, "comment": num_files, "code": num_files}}
+
+
+def test_native_counter_with_pool(tmp_path):
+    """Enough files are distributed over the process pool and give the same result."""
+    num_files = MIN_FILES_FOR_POOL + 1
+    _write_python_files(tmp_path, num_files)
+    result = NativeCounter(4).count_directory(str(tmp_path))
+    assert result == {"Python": {"nFiles": num_files, "blank": num_files, "comment": num_files, "code": num_files}}
+
+
+def test_native_counter_keeps_the_order_of_contents():
+    """The counts of the contents come in the order of the contents, also for the chunks counted in the pool."""
+    contents = [b"value = 1\n" * (i + 1) for i in range(40)]
+    counts = list(NativeCounter(2).count_contents(iter(contents), "Python"))
+    assert [code for _, _, _, code in counts] == list(range(1, 41))
+
+
+# Files, which cloc and the native counter count differently. cloc removes comments with regexes, which don't know all
+# kinds of strings, while the native counter skips strings. The numbers are the lines, which may be counted as comment
+# by one and as code by the other. The blank lines and the total of comment and code lines are always the same.
+TOLERATED_DIFFERENCES = [
+    # cloc doesn't know raw strings, so /* in one starts a block comment.
+    ("Go", "raw_string.go", "package main\n\nvar pattern = `/* not a comment\nstill in the string */`\n", 2),
+    # cloc turns every triple quote into the start or end of a block comment, even in a string. That shifts all
+    # following blocks.
+    ("Python", "quotes.py", "marker = '\"\"\"'\nvalue = f\"{marker}#\"\ntext = \"\"\"not a docstring\n"
+                            "# still in the string\n\"\"\"\n", 5),
+]
+
+
+def _require_cloc():
+    if shutil.which(ClocCounter.CLOC_EXECUTABLE) is None:
+        pytest.skip("cloc is not installed")
+
+
+def test_native_counter_matches_cloc_on_fixture_repos(tmp_path):
+    """The fixture repos of the benchmarks are counted exactly like cloc counts them."""
+    _require_cloc()
+    fixtures = pytest.importorskip("benchmarks.fixtures")
+    repos = fixtures.create_fixture_repos(str(tmp_path), 6, list(fixtures.SNIPPETS), 20, 30)
+    for repo in repos:
+        assert NativeCounter(1).count_directory(repo.directory) == ClocCounter().count_directory(repo.directory)
+
+
+@pytest.mark.parametrize("language, filename, content, tolerance", TOLERATED_DIFFERENCES)
+def test_native_counter_tolerated_differences_to_cloc(tmp_path, language, filename, content, tolerance):
+    """The known differences to cloc stay within their tolerance."""
+    _require_cloc()
+    (tmp_path / filename).write_text(content)
+    native = NativeCounter(1).count_directory(str(tmp_path))[language]
+    cloc = ClocCounter().count_directory(str(tmp_path))[language]
+    assert native["nFiles"] == cloc["nFiles"]
+    assert native["blank"] == cloc["blank"]
+    assert native["comment"] + native["code"] == cloc["comment"] + cloc["code"]
+    assert abs(native["code"] - cloc["code"]) <= tolerance
+
+
+def test_native_counter_terminates_pool_on_deadline(tmp_path):
+    """After the deadline passed, no process of the pool keeps counting."""
+    num_files = 4 * MIN_FILES_FOR_POOL
+    for i in range(num_files):
+        (tmp_path / "file{}.py".format(i)).write_text("# A comment\nvalue = {}\n\n".format(i) * 2000)
+    with pytest.raises(StageTimeout):
+        NativeCounter(4).count_directory(str(tmp_path), Deadline(STAGE_COUNT, 0.01))
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,48 @@
+"""Tests of profiling the tasks."""
+import os
+import threading
+from collections import Counter
+from time import sleep
+
+from github_repo_loc_analyser.data_structure import Repo
+from github_repo_loc_analyser.profiling import PROFILES_DIRNAME, SamplingProfiler, profile_task
+
+
+def _work(sampler, samples, done):
+    with sampler.record(samples):
+        done.wait()
+
+
+def test_sampling_profiler_attributes_stacks_to_threads():
+    """Concurrent recordings only get the stacks of their own threads."""
+    sampler = SamplingProfiler(0.001)
+    sampler.start()
+    done = threading.Event()
+    samples = {name: Counter() for name in ["task-a", "task-b"]}
+    threads = [threading.Thread(target=_work, args=(sampler, samples[name], done), name=name) for name in samples]
+    for thread in threads:
+        thread.start()
+    sleep(0.1)
+    done.set()
+    for thread in threads:
+        thread.join()
+    sampler.stop()
+    for name, counter in samples.items():
+        assert counter
+        assert all(stack.startswith(name + ";") for stack in counter)
+
+
+def test_profile_task_writes_samples_of_slow_task(config):
+    """With profile_threshold, a task taking longer gets a profile of the shared sampler."""
+    config["profile_threshold"] = "0.05"
+    config["profile_interval"] = "0.001"
+    repo = Repo("owner/slow", "Python", False, "https://github.com/owner/slow")
+    with profile_task(repo):
+        sleep(0.1)
+    with profile_task(Repo("owner/fast", "Python", False, "https://github.com/owner/fast")):
+        pass
+    profiles = os.listdir(os.path.join(config["data_dir"], PROFILES_DIRNAME))
+    assert len(profiles) == 1 and profiles[0].endswith(".folded")
+    with open(os.path.join(config["data_dir"], PROFILES_DIRNAME, profiles[0])) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.startswith(threading.current_thread().name + ";") for line in lines)
@@ -0,0 +1,88 @@
+"""Tests of the token buckets of the GitHub API rate limit budget."""
+import multiprocessing
+from time import time
+
+from github_repo_loc_analyser import rate_limit
+from github_repo_loc_analyser.rate_limit import FileRateLimiter, LocalRateLimiter, RESOURCE_CORE, RESOURCE_SEARCH
+
+
+def _headers(remaining, reset, resource=RESOURCE_CORE):
+    return {"X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset": str(reset),
+            "X-RateLimit-Resource": resource}
+
+
+def test_unknown_budget_is_probed_first():
+    """A token without known budget is used, so its response tells the budget."""
+    limiter = LocalRateLimiter(2)
+    reset = int(time()) + 3600
+    limiter.update(0, RESOURCE_CORE, _headers(10, reset))
+    assert limiter.acquire(RESOURCE_CORE) == 1
+
+
+def test_token_with_most_budget_is_used():
+    """Every request takes from the token with most of its budget left."""
+    limiter = LocalRateLimiter(2)
+    reset = int(time()) + 3600
+    limiter.update(0, RESOURCE_CORE, _headers(3, reset))
+    limiter.update(1, RESOURCE_CORE, _headers(2, reset))
+    assert [limiter.acquire(RESOURCE_CORE) for _ in range(4)] == [0, 0, 1, 0]
+    assert limiter.get_headroom() == {"0/core": 0, "1/core": 1}
+
+
+def test_resources_have_their_own_budget():
+    """The search budget is independent of the core budget."""
+    limiter = LocalRateLimiter(1)
+    reset = int(time()) + 3600
+    limiter.update(0, RESOURCE_CORE, _headers(0, reset))
+    limiter.update(0, RESOURCE_SEARCH, _headers(5, reset, RESOURCE_SEARCH))
+    assert limiter.acquire(RESOURCE_SEARCH) == 0
+
+
+def test_concurrent_takes_are_kept_on_update():
+    """A response doesn't give back the budget, which was taken by the requests in flight meanwhile."""
+    limiter = LocalRateLimiter(1)
+    reset = int(time()) + 3600
+    limiter.update(0, RESOURCE_CORE, _headers(10, reset))
+    for _ in range(3):
+        limiter.acquire(RESOURCE_CORE)
+    limiter.update(0, RESOURCE_CORE, _headers(9, reset))
+    assert limiter.get_headroom() == {"0/core": 7}
+    limiter.refund(0, RESOURCE_CORE)
+    assert limiter.get_headroom() == {"0/core": 8}
+
+
+def test_waits_for_the_earliest_reset(monkeypatch):
+    """If every token is exhausted, the limiter waits until the first one is refilled."""
+    limiter = LocalRateLimiter(2)
+    now = int(time())
+    limiter.exhaust(0, RESOURCE_CORE, now + 100)
+    limiter.exhaust(1, RESOURCE_CORE, now + 50)
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        limiter.exhaust(1, RESOURCE_CORE, now)  # The reset time passed
+
+    monkeypatch.setattr(rate_limit, "sleep", sleep)
+    assert limiter.acquire(RESOURCE_CORE) == 1
+    assert len(waits) == 1 and 45 < waits[0] <= 50
+
+
+def _take(state_file, queue):
+    queue.put(FileRateLimiter(1, state_file).acquire(RESOURCE_CORE))
+
+
+def test_file_limiter_is_shared_between_processes(tmp_path):
+    """The processes using the same state file take from the same budget."""
+    state_file = str(tmp_path / "rate_limit.json")
+    limiter = FileRateLimiter(1, state_file)
+    limiter.update(0, RESOURCE_CORE, _headers(5, int(time()) + 3600))
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    processes = [context.Process(target=_take, args=(state_file, queue)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [queue.get(timeout=10) for _ in processes] == [0, 0, 0]
+    assert limiter.get_headroom() == {"0/core": 2}
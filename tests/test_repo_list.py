@@ -0,0 +1,41 @@
+"""Tests of the list of discovered repos."""
+from github_repo_loc_analyser.data_structure import PossibleRepo
+from github_repo_loc_analyser.repo_list import RepoList
+
+
+class FakeApi:
+    """Returns one repo per page and stops after interrupt_after pages."""
+
+    def __init__(self, sampling_seed, interrupt_after=None):
+        """Init."""
+        self.sampling_seed = sampling_seed
+        self.seeds = []
+        self._interrupt_after = interrupt_after
+
+    def get_repo_pages(self, known_filenames, done_pages):
+        """See ApiQuerier."""
+        for page in range(3):
+            page_key = str(page)
+            if page_key in done_pages:
+                continue
+            if page == self._interrupt_after:
+                raise KeyboardInterrupt()
+            self.seeds.append(self.sampling_seed)
+            name = "owner/repo{}".format(page)
+            yield page_key, [PossibleRepo(name, "Python", False, "https://github.com/" + name,
+                                          "https://api.github.com/repos/" + name + "/commits")]
+
+
+def test_resumed_discovery_uses_the_stored_seed(tmp_path):
+    """The pages after an interruption are sampled with the seed of the interrupted discovery."""
+    repos_file = str(tmp_path / "repos.jsonl")
+    first = FakeApi("1", interrupt_after=1)
+    try:
+        list(RepoList(repos_file).discover(first))
+    except KeyboardInterrupt:
+        pass
+    second = FakeApi("2")
+    discovered = [repo.get_name() for repo in RepoList(repos_file).discover(second)]
+    assert discovered == ["owner/repo0", "owner/repo1", "owner/repo2"]
+    assert first.seeds == ["1"]
+    assert second.seeds == ["1", "1"]
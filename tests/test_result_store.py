@@ -0,0 +1,66 @@
+"""Tests of the stores of the analysis results."""
+import sqlite3
+
+from github_repo_loc_analyser.data_structure import Repo, Result
+from github_repo_loc_analyser.result_store import FileResultStore, SqliteResultStore
+
+
+def _result(i):
+    return Result(Repo("owner/repo{}".format(i), "Python", False, "https://github.com/owner/repo{}".format(i)),
+                  analysis={"Python": i})
+
+
+def _count_committed(db_file):
+    with sqlite3.connect(db_file) as connection:
+        return connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+def test_sqlite_store_commits_in_groups(tmp_path):
+    """The results are committed once commit_size of them are pending."""
+    db_file = str(tmp_path / "results.sqlite")
+    store = SqliteResultStore(db_file, 3, 3600)
+    for i in range(2):
+        store.add(_result(i))
+    assert _count_committed(db_file) == 0
+    store.add(_result(2))
+    assert _count_committed(db_file) == 3
+    store.add(_result(3))
+    store.close()
+    assert _count_committed(db_file) == 4
+
+
+def test_sqlite_store_commits_after_interval_without_new_results(tmp_path):
+    """A pending result is committed by the regular check of the master, once the interval passed."""
+    db_file = str(tmp_path / "results.sqlite")
+    store = SqliteResultStore(db_file, 100, 3600)
+    store.add(_result(0))
+    store.flush_if_due()
+    assert _count_committed(db_file) == 0
+    store._commit_interval = 0
+    store.flush_if_due()
+    assert _count_committed(db_file) == 1
+    store.close()
+
+
+def test_sqlite_store_resumes(tmp_path):
+    """After reopening, the store knows the stored results and returns them."""
+    db_file = str(tmp_path / "results.sqlite")
+    store = SqliteResultStore(db_file, 100, 3600)
+    for i in range(5):
+        store.add(_result(i))
+    assert store.contains(_result(4).get_repo())
+    store.close()
+    store = SqliteResultStore(db_file, 100, 3600)
+    assert store.contains(_result(0).get_repo())
+    assert not store.contains(_result(5).get_repo())
+    assert [result.get_repo().get_name() for result in store] == ["owner/repo{}".format(i) for i in range(5)]
+    store.close()
+
+
+def test_file_store_resumes(config, tmp_path):
+    """The file store knows the results written before."""
+    store = FileResultStore(str(tmp_path / "results"))
+    store.add(_result(0))
+    store = FileResultStore(str(tmp_path / "results"))
+    assert store.contains(_result(0).get_repo())
+    assert not store.contains(_result(1).get_repo())
@@ -0,0 +1,33 @@
+"""Tests of sampling the repos from the search results."""
+from random import Random
+
+from github_repo_loc_analyser.helper import sanitize_filename
+from github_repo_loc_analyser.sampling import RepoSampler
+
+
+def _items(names):
+    return [{"full_name": name} for name in names]
+
+
+def test_sample_skips_used_repos():
+    """Repos, which were picked before or are already known, are not picked again."""
+    sampler = RepoSampler([sanitize_filename("owner/known", "Python")])
+    items = _items(["owner/known", "owner/a", "owner/b", "owner/c"])
+    first = sampler.sample(items, "Python", 2, Random(0))
+    second = sampler.sample(items, "Python", 2, Random(0))
+    names = [item["full_name"] for item in first + second]
+    assert sorted(names) == ["owner/a", "owner/b", "owner/c"]
+    assert len(sampler) == 4
+
+
+def test_sample_is_reproducible():
+    """The same seed picks the same repos."""
+    items = _items(["owner/repo{}".format(i) for i in range(50)])
+    assert RepoSampler().sample(items, "Python", 10, Random(1)) == RepoSampler().sample(items, "Python", 10, Random(1))
+
+
+def test_claim_once():
+    """A filename can only be claimed once."""
+    sampler = RepoSampler()
+    assert sampler.claim(sanitize_filename("owner/repo", "Python"))
+    assert not sampler.claim(sanitize_filename("owner/repo", "Python"))
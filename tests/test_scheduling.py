@@ -0,0 +1,55 @@
+"""Tests of routing the repos to the queues of their size classes and the dispatch order."""
+import pytest
+
+from github_repo_loc_analyser.data_structure import Repo
+from github_repo_loc_analyser.scheduling import (DispatchBuffer, ORDER_DISCOVERY, ORDER_LARGEST_FIRST,
+                                                 ORDER_SMALLEST_FIRST, parse_size_classes)
+
+SIZE_CLASSES = "small:100,medium:10000,huge"
+
+
+def _repo(name, size):
+    return Repo("owner/" + name, "Python", False, "https://github.com/owner/" + name, size)
+
+
+def _buffer(order, sizes):
+    buffer = DispatchBuffer(parse_size_classes(SIZE_CLASSES), order)
+    for name, size in sizes.items():
+        buffer.add(_repo(name, size))
+    return buffer
+
+
+def test_parse_size_classes():
+    """The classes keep their order. Only the last one has no maximum size."""
+    assert repr(parse_size_classes(SIZE_CLASSES)) == "[small:100, medium:10000, huge:None]"
+    with pytest.raises(ValueError):
+        parse_size_classes("small:100,medium:10000")
+
+
+def test_repos_are_routed_by_size():
+    """A repo goes to the first class, which it fits into. Repos of unknown size are treated as the smallest."""
+    buffer = _buffer(ORDER_DISCOVERY, {"a": 100, "b": 101, "c": 10 ** 6, "d": None})
+    assert buffer.get_queues() == ["small", "medium", "huge"]
+    assert [repo.get_name() for repo in buffer.pop("small", 10)] == ["owner/a", "owner/d"]
+    assert [repo.get_name() for repo in buffer.pop("medium", 10)] == ["owner/b"]
+    assert [repo.get_name() for repo in buffer.pop("huge", 10)] == ["owner/c"]
+    assert len(buffer) == 0
+
+
+def test_largest_first():
+    """The largest repos are dispatched first (longest processing time first). Equal sizes keep their order."""
+    buffer = _buffer(ORDER_LARGEST_FIRST, {"a": 200, "b": 5000, "c": 200, "d": 300})
+    assert [repo.get_name() for repo in buffer.pop("medium", 2)] == ["owner/b", "owner/d"]
+    assert [repo.get_name() for repo in buffer.pop("medium", 2)] == ["owner/a", "owner/c"]
+
+
+def test_smallest_first():
+    """The smallest repos are dispatched first. A repo of unknown size comes before all others."""
+    buffer = _buffer(ORDER_SMALLEST_FIRST, {"a": 20, "b": 5, "c": None})
+    assert [repo.get_name() for repo in buffer.pop("small", 3)] == ["owner/c", "owner/b", "owner/a"]
+
+
+def test_unknown_order():
+    """An unknown order is rejected."""
+    with pytest.raises(ValueError):
+        DispatchBuffer(parse_size_classes(SIZE_CLASSES), "random")
@@ -0,0 +1,85 @@
+"""Tests of splitting the search into partitions below the result cap."""
+from datetime import date
+
+import pytest
+
+from github_repo_loc_analyser.github_api_querier import ApiQuerier
+from github_repo_loc_analyser.sampling import RepoSampler
+from github_repo_loc_analyser.search_partitioning import Partition, PartitionIndex, Range, SEARCH_RESULT_CAP
+
+
+@pytest.mark.parametrize("qualifier, start, end", [
+    ("10..100", 10, 100),
+    (">20", 21, 10 ** 7),
+    (">=20", 20, 10 ** 7),
+    ("<20", 0, 19),
+    ("<=20", 0, 20),
+    ("*..5", 0, 5),
+    ("7", 7, 7),
+])
+def test_parse_stars(qualifier, start, end):
+    """The qualifiers of the stars are parsed into closed ranges."""
+    parsed = Range.parse(qualifier, False)
+    assert (parsed.start, parsed.end) == (start, end)
+
+
+def test_parse_dates():
+    """The dates are parsed into ordinals and formatted back."""
+    parsed = Range.parse("2012-01-01..2013-01-01", True)
+    assert parsed.start == date(2012, 1, 1).toordinal()
+    assert parsed.to_qualifier() == "2012-01-01..2013-01-01"
+    assert Range.parse(">2012-01-01", True).start == date(2012, 1, 2).toordinal()
+
+
+def test_split_prefers_dates_and_covers_the_range():
+    """A partition is split by date first, then by stars, and the halves cover the partition without overlap."""
+    partition = Partition(Range.parse("2012-01-01..2012-01-02", True), Range.parse("10..13", False))
+    halves = partition.split()
+    assert [half.created.to_qualifier() for half in halves] == ["2012-01-01..2012-01-01", "2012-01-02..2012-01-02"]
+    stars = halves[0].split()
+    assert [part.stars.to_qualifier() for part in stars] == ["10..11", "12..13"]
+    single = Partition(Range.parse("2012-01-01", True), Range.parse("10", False))
+    assert single.split() is None
+
+
+def test_partition_index_locates_indices():
+    """Indices into the concatenated results map to the partition and the offset in it. Empty ones are skipped."""
+    stars = Range.parse("1..2", False)
+    partitions = [Partition(Range.parse("2012-01-0{}".format(day), True), stars, count)
+                  for day, count in [(1, 3), (2, 0), (3, 2)]]
+    index = PartitionIndex(partitions)
+    assert index.total_count == 5
+    assert [index.locate(i) for i in range(5)] == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1)]
+    assert index.partitions[1] is partitions[2]
+    with pytest.raises(IndexError):
+        index.locate(5)
+
+
+def test_partition_requests_are_sorted(api_config):
+    """The pages of a partition are requested in a fixed order, so a sampled index always denotes the same repo."""
+    api = ApiQuerier()
+    partition = Partition(Range.parse("2012-01-01", True), Range.parse("10", False))
+    url = api._construct_get_repos_request("Python", True, 3, partition).prepare().url
+    assert "sort=stars&order=desc" in url
+    assert "page=4" in url
+
+
+def test_adaptive_sampling_beyond_the_result_cap(api_config):
+    """The repos are sampled from all results of a search, which has more results than the search API returns."""
+    fixtures = pytest.importorskip("benchmarks.fixtures")
+    first_created = date(2010, 1, 1).toordinal()
+    repos = [fixtures.FixtureRepo("owner/repo{}".format(i), "Python", "/nonexistent", "0" * 40, 100,
+                                  date.fromordinal(first_created + i % 1000), 10 + i % 50) for i in range(2500)]
+    github = fixtures.FakeGitHub(repos, search_rate_limit=10 ** 6, core_rate_limit=10 ** 6)
+    api_config["api_server"] = github.get_url()
+    api_config["num_repos"] = "300"
+    api_config["sampling_seed"] = "0"
+    try:
+        pages = list(ApiQuerier()._get_sampled_repos("Python", True, RepoSampler(), frozenset()))
+    finally:
+        github.close()
+    names = [repo.get_name() for _, page in pages for repo in page]
+    assert len(names) == len(set(names)) == 300
+    # Without partitions, only the first results by stars are available.
+    by_stars = sorted(repos, key=lambda repo: (repo.stars, repo.name), reverse=True)
+    assert not set(names) <= {repo.name for repo in by_stars[:SEARCH_RESULT_CAP]}